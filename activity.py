@@ -0,0 +1,160 @@
+"""
+Attività della Mini App lato server: punti settimanali e streak
+
+La Mini App invia via web_app_data lotti di eventi con lo stato finale di
+ogni casella spuntata (non il toggle), già coalescenti per giorno/attività:
+
+    {"type": "activity", "week": 5, "events": [[5, "monday", "workout", 1], ...]}
+
+Ogni evento è assoluto (fatto / non fatto), quindi riapplicare un lotto già
+ricevuto non cambia nulla. Per ogni utente il bot tiene:
+- `days`: una bitmask per giorno (palestra, corsa, dieta)
+- `raw`:  somma dei punti della settimana, aggiornata con il solo delta
+  della casella cambiata (O(1) per evento, senza rileggere weekData)
+- `streak` / `completed`: aggiornati alla chiusura della settimana, quando
+  arriva un evento (o un lotto) di una settimana successiva
+
+Stessi valori di `calculatePoints` in index.html (palestra 12, corsa 10,
+dieta 5, massimo 100) e di `resetWeek` (90+ punti allungano la streak).
+Lo stato per utente è un dict JSON-serializzabile, persistito dallo storage.
+"""
+
+DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+POINTS = {'workout': 12, 'cardio': 10, 'diet': 5}
+MAX_POINTS = 100
+STREAK_POINTS = 90       # punti per chiudere la settimana "completata"
+MAX_EVENTS = 128         # eventi per lotto (web_app_data è limitato a 4096 byte)
+
+# Caselle previste per giorno (come renderTracker in index.html)
+DAY_ACTIVITIES = {
+    'monday': ('workout', 'diet'),
+    'tuesday': ('workout', 'diet'),
+    'wednesday': ('cardio', 'diet'),
+    'thursday': ('workout', 'diet'),
+    'friday': ('workout', 'diet'),
+    'saturday': ('cardio', 'diet'),
+    'sunday': ('diet',),
+}
+
+_DAY_INDEX = {day: index for index, day in enumerate(DAYS)}
+_BITS = {activity: 1 << index for index, activity in enumerate(POINTS)}
+_EXPECTED = [sum(_BITS[activity] for activity in DAY_ACTIVITIES[day]) for day in DAYS]
+EXPECTED_BOXES = sum(len(activities) for activities in DAY_ACTIVITIES.values())
+_POPCOUNT = [bin(mask).count('1') for mask in range(1 << len(POINTS))]
+
+
+def adherence(state):
+    """Percentuale delle caselle previste della settimana spuntate (0-100)"""
+    done = sum(_POPCOUNT[mask & expected] for mask, expected in zip(state['days'], _EXPECTED))
+    return round(done * 100 / EXPECTED_BOXES)
+
+
+def parse_batch(data):
+    """Valida un lotto di eventi della Mini App; ritorna (settimana, [(settimana, giorno, attività, fatto)])"""
+    week = data.get('week')
+    events = data.get('events')
+    if not isinstance(week, int) or isinstance(week, bool) or week < 1:
+        raise ValueError(f"Settimana non valida: {week!r}")
+    if not isinstance(events, list) or len(events) > MAX_EVENTS:
+        raise ValueError("Eventi mancanti o troppi")
+    parsed = []
+    for event in events:
+        if not isinstance(event, list) or len(event) != 4:
+            raise ValueError(f"Evento non valido: {event!r}")
+        event_week, day, activity, done = event
+        if not isinstance(event_week, int) or isinstance(event_week, bool) or not 1 <= event_week <= week:
+            raise ValueError(f"Settimana dell'evento non valida: {event!r}")
+        if day not in _DAY_INDEX or activity not in POINTS or done not in (0, 1, True, False):
+            raise ValueError(f"Evento non valido: {event!r}")
+        parsed.append((event_week, _DAY_INDEX[day], activity, bool(done)))
+    return week, parsed
+
+
+class ActivityTracker:
+    """Punti della settimana in corso e streak per utente, aggiornati evento per evento"""
+
+    def __init__(self, states):
+        self._states = states
+
+    def _state(self, user_id):
+        state = self._states.get(user_id)
+        if state is None:
+            state = self._states[user_id] = {
+                'week': 1, 'days': [0] * len(DAYS), 'raw': 0, 'streak': 0, 'completed': 0
+            }
+        return state
+
+    # ---- eventi ----
+
+    def apply_batch(self, user_id, week, events):
+        """Applica un lotto validato da `parse_batch`; ritorna quante caselle sono cambiate"""
+        state = self._state(user_id)
+        changed = 0
+        for event_week, day, activity, done in events:
+            changed += self._apply(state, event_week, day, activity, done)
+        # La settimana dell'app può essere avanzata anche senza eventi (nuova settimana vuota)
+        self._advance(state, week)
+        return changed
+
+    def _apply(self, state, week, day, activity, done):
+        if week < state['week']:
+            return 0  # settimana già chiusa: evento in ritardo
+        self._advance(state, week)
+        bit = _BITS[activity]
+        mask = state['days'][day]
+        if bool(mask & bit) == done:
+            return 0
+        state['days'][day] = mask ^ bit
+        state['raw'] += POINTS[activity] if done else -POINTS[activity]
+        return 1
+
+    def _advance(self, state, week):
+        """Chiude le settimane precedenti a `week` aggiornando streak e settimane completate"""
+        if week <= state['week']:
+            return
+        if min(state['raw'], MAX_POINTS) >= STREAK_POINTS:
+            state['completed'] += 1
+            # Le settimane saltate in mezzo valgono 0 punti e interrompono la streak
+            state['streak'] = state['streak'] + 1 if week == state['week'] + 1 else 0
+        else:
+            state['streak'] = 0
+        state['week'] = week
+        state['days'] = [0] * len(DAYS)
+        state['raw'] = 0
+
+    # ---- modifiche dai comandi del bot ----
+
+    def reset_week(self, user_id):
+        """/resetsettimana: azzera le caselle senza chiudere la settimana"""
+        state = self._state(user_id)
+        state['days'] = [0] * len(DAYS)
+        state['raw'] = 0
+
+    def set_week(self, user_id, week):
+        """/setsettimana: cambia il numero di settimana senza toccare la streak"""
+        self._state(user_id)['week'] = week
+
+    def set_streak(self, user_id, streak):
+        self._state(user_id)['streak'] = streak
+
+    # ---- letture (O(1)) ----
+
+    def points(self, user_id):
+        state = self._states.get(user_id)
+        return min(state['raw'], MAX_POINTS) if state else 0
+
+    def streak(self, user_id):
+        state = self._states.get(user_id)
+        return state['streak'] if state else 0
+
+    def summary(self, user_id):
+        """Punti, streak e settimana correnti (None se l'app non ha mai inviato eventi)"""
+        state = self._states.get(user_id)
+        if state is None:
+            return None
+        return {
+            'week': state['week'],
+            'points': min(state['raw'], MAX_POINTS),
+            'streak': state['streak'],
+            'completed': state['completed'],
+        }
@@ -0,0 +1,225 @@
+"""
+Bundle statico della Mini App, servito dal bot
+
+index.html carica cdn.tailwindcss.com, che compila Tailwind nel browser a ogni
+apertura, e tiene tutto il codice inline. `python bot.py compila-app` produce
+un bundle pronto per un'origine veloce:
+- CSS Tailwind precompilato con le sole classi usate (CLI standalone
+  `tailwindcss` v3) più lo <style> della pagina
+- JS estratto e minificato (esbuild se presente, altrimenti senza commenti e
+  indentazione)
+- nomi con l'hash del contenuto (app.<hash>.css / app.<hash>.js): si possono
+  mettere in cache per un anno, una nuova build cambia il nome
+- varianti precompresse `.gz` e `.br` (brotli se installato), servite in base
+  ad Accept-Encoding senza comprimere a ogni richiesta
+
+index.html resta senza cache (revalidata con ETag) e punta ai file con hash.
+`add_bundle_routes` carica il bundle in memoria e lo serve dal WebServer.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE = 'index.html'
+DEFAULT_OUTPUT = 'dist'
+BUNDLE_PATH = '/miniapp'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Classi composte a runtime (non visibili al purge): `text-${workout.color}-600`
+SAFELIST = [f"text-{color}-600" for color in ('blue', 'green', 'purple', 'orange')]
+
+_TAILWIND_CDN = re.compile(r'\s*<script src="https://cdn\.tailwindcss\.com[^"]*"></script>')
+_STYLE = re.compile(r'<style>(.*?)</style>', re.S)
+_INLINE_SCRIPT = re.compile(r'<script>(.*?)</script>', re.S)
+_HASHED = re.compile(r'^app\.[0-9a-f]+\.(css|js)$')
+
+_TAILWIND_INPUT = "@tailwind base;\n@tailwind components;\n@tailwind utilities;\n"
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _tool(env, name):
+    """Percorso di un eseguibile (variabile d'ambiente o PATH); None se assente"""
+    return os.getenv(env) or shutil.which(name)
+
+
+def _run(command, data=None):
+    result = subprocess.run(command, input=data, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{os.path.basename(command[0])} fallito: {result.stderr.decode(errors='replace')}")
+    return result.stdout
+
+
+def compile_css(page_path, page_css):
+    """Tailwind precompilato e purgato sulle classi di `page_path`, più lo <style> della pagina"""
+    tailwind = _tool('TAILWINDCSS', 'tailwindcss')
+    if tailwind is None:
+        raise RuntimeError(
+            "La build richiede la CLI standalone di Tailwind v3: scaricala da "
+            "https://github.com/tailwindlabs/tailwindcss/releases e mettila nel PATH "
+            "(o indica il percorso in TAILWINDCSS)"
+        )
+    with tempfile.TemporaryDirectory() as workdir:
+        config = os.path.join(workdir, 'tailwind.config.js')
+        source = os.path.join(workdir, 'input.css')
+        output = os.path.join(workdir, 'output.css')
+        with open(config, 'w', encoding='utf-8') as file:
+            file.write(
+                f"module.exports = {{ content: [{os.path.abspath(page_path)!r}], "
+                f"safelist: {SAFELIST!r} }};\n"
+            )
+        with open(source, 'w', encoding='utf-8') as file:
+            file.write(_TAILWIND_INPUT + page_css)
+        _run([tailwind, '-c', config, '-i', source, '-o', output, '--minify'])
+        with open(output, 'rb') as file:
+            return file.read()
+
+
+def minify_js(code):
+    """JS minificato con esbuild; senza esbuild toglie solo commenti di riga e indentazione"""
+    esbuild = _tool('ESBUILD', 'esbuild')
+    if esbuild is not None:
+        return _run([esbuild, '--minify', '--loader=js', '--target=es2018'], code.encode())
+    # Solo trasformazioni sicure anche dentro i template literal (markup HTML)
+    lines = (line.strip() for line in code.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')).encode() + b'\n'
+
+
+def _hashed_name(data, extension):
+    return f"app.{hashlib.sha256(data).hexdigest()[:10]}.{extension}"
+
+
+def _variants(data):
+    """(estensione, contenuto) delle versioni precompresse"""
+    yield '.gz', gzip.compress(data, compresslevel=9, mtime=0)
+    brotli = _brotli()
+    if brotli is not None:
+        yield '.br', brotli.compress(data, quality=11)
+
+
+def build_bundle(source=DEFAULT_SOURCE, output=DEFAULT_OUTPUT):
+    """Compila la Mini App in `output`; ritorna {file: {'': byte, '.gz': byte, '.br': byte}}"""
+    with open(source, encoding='utf-8') as file:
+        page = _TAILWIND_CDN.sub('', file.read(), count=1)
+    style = _STYLE.search(page)
+    scripts = _INLINE_SCRIPT.findall(page)
+    if style is None or not scripts:
+        raise ValueError(f"{source}: <style> o <script> inline non trovati")
+
+    css = compile_css(source, style.group(1))
+    js = minify_js(scripts[-1])
+    css_name = _hashed_name(css, 'css')
+    js_name = _hashed_name(js, 'js')
+
+    page = page[:style.start()] + f'<link rel="stylesheet" href="{css_name}" />' + page[style.end():]
+    inline = f"<script>{scripts[-1]}</script>"
+    start = page.rindex(inline)
+    page = page[:start] + f'<script src="{js_name}"></script>' + page[start + len(inline):]
+
+    os.makedirs(output, exist_ok=True)
+    # I file delle build precedenti non servono più: index.html non è in cache
+    for name in os.listdir(output):
+        if _HASHED.match(name.removesuffix('.gz').removesuffix('.br')):
+            os.remove(os.path.join(output, name))
+
+    sizes = {}
+    for name, data in (('index.html', page.encode()), (css_name, css), (js_name, js)):
+        sizes[name] = {'': len(data)}
+        with open(os.path.join(output, name), 'wb') as file:
+            file.write(data)
+        for extension, compressed in _variants(data):
+            sizes[name][extension] = len(compressed)
+            with open(os.path.join(output, name + extension), 'wb') as file:
+                file.write(compressed)
+    if _brotli() is None:
+        logger.warning("⚠️ brotli non installato: solo varianti gzip (pip install brotli)")
+    return sizes
+
+
+# ============ SERVER ============
+
+def _accepted(header):
+    """Codifiche accettate da Accept-Encoding (escluse quelle con q=0)"""
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        key, _, quality = params.strip().partition('=')
+        try:
+            if key.strip() == 'q' and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def load_bundle(directory):
+    """{nome: {'': byte, '.gz': byte, '.br': byte}} dei file del bundle"""
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        base, extension = os.path.splitext(name)
+        if extension not in ('.gz', '.br'):
+            base, extension = name, ''
+        with open(os.path.join(directory, name), 'rb') as file:
+            files.setdefault(base, {})[extension] = file.read()
+    if 'index.html' not in files:
+        raise FileNotFoundError(f"{directory}: index.html mancante, esegui prima `python bot.py compila-app`")
+    return files
+
+
+def add_bundle_routes(server, directory, path=BUNDLE_PATH):
+    """Serve il bundle da `path`/ con varianti precompresse e header di cache"""
+    from aiohttp import web
+
+    files = load_bundle(directory)
+    etags = {name: f'"{hashlib.sha256(variants[""]).hexdigest()[:16]}"' for name, variants in files.items()}
+    logger.info(f"📦 Mini App servita da {path}/ ({len(files)} file da {directory})")
+
+    def respond(request, name):
+        variants = files.get(name)
+        if variants is None or '' not in variants:
+            raise web.HTTPNotFound()
+        headers = {
+            'Content-Type': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+            'Cache-Control': IMMUTABLE if _HASHED.match(name) else 'no-cache',
+            'ETag': etags[name],
+            'Vary': 'Accept-Encoding',
+        }
+        if request.headers.get('If-None-Match') == etags[name]:
+            return web.Response(status=304, headers=headers)
+        accepted = _accepted(request.headers.get('Accept-Encoding', ''))
+        body = variants['']
+        for extension, encoding in (('.br', 'br'), ('.gz', 'gzip')):
+            if encoding in accepted and extension in variants:
+                body = variants[extension]
+                headers['Content-Encoding'] = encoding
+                break
+        return web.Response(body=body, headers=headers)
+
+    async def index(request):
+        return respond(request, 'index.html')
+
+    async def asset(request):
+        return respond(request, request.match_info['name'])
+
+    async def redirect(request):
+        raise web.HTTPMovedPermanently(f"{path}/?{request.query_string}" if request.query_string else f"{path}/")
+
+    server.add_route('GET', path, redirect)
+    server.add_route('GET', f"{path}/", index)
+    server.add_route('GET', f"{path}/{{name}}", asset)
@@ -0,0 +1,154 @@
+"""
+Time-to-interactive della Mini App: pagina attuale vs bundle precompilato
+
+Serve in locale (aiohttp) sia index.html così com'è, con Tailwind compilato nel
+browser da cdn.tailwindcss.com, sia il bundle di `python bot.py compila-app`
+servito da add_bundle_routes (precompresso, nomi con hash, cache immutable).
+Poi apre entrambe in Chromium headless con la CPU rallentata, come su un
+telefono economico.
+
+Misure (mediana su --runs aperture):
+- interattiva: prima schermata renderizzata e con gli stili Tailwind applicati
+- TBT: somma dei long task oltre 50 ms fino a quel momento
+- byte trasferiti, a cache vuota e alla seconda apertura (cache calda)
+
+Lo script di Telegram è bloccato in entrambi i casi. La pagina attuale scarica
+Tailwind dalla CDN, quindi serve la rete.
+
+Richiede playwright: pip install playwright && playwright install chromium
+
+Uso:
+    python benchmarks/bench_bundle.py [--runs 5] [--cpu-slowdown 4] [--bundle dist]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiohttp import web  # noqa: E402
+
+from app_bundle import BUNDLE_PATH, add_bundle_routes, build_bundle  # noqa: E402
+from webserver import WebServer  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ORIGINAL_PATH = '/originale/'
+
+# Interattiva = #root popolato e classi Tailwind applicate (max-w-md -> 28rem)
+PROBE = """
+window.__longTasks = [];
+new PerformanceObserver((list) => window.__longTasks.push(...list.getEntries()))
+  .observe({ type: 'longtask', buffered: true });
+(function check() {
+  const root = document.getElementById('root');
+  const shell = root && root.firstElementChild;
+  if (shell && getComputedStyle(shell).maxWidth === '28rem') {
+    const now = performance.now();
+    window.__interactive = {
+      at: now,
+      tbt: window.__longTasks
+        .filter((task) => task.startTime < now)
+        .reduce((total, task) => total + Math.max(0, task.duration - 50), 0),
+    };
+    return;
+  }
+  requestAnimationFrame(check);
+})();
+"""
+
+
+def _playwright():
+    try:
+        from playwright.async_api import async_playwright
+    except ImportError as e:
+        raise RuntimeError(
+            "Il benchmark richiede playwright: pip install playwright && playwright install chromium"
+        ) from e
+    return async_playwright
+
+
+async def serve(bundle, port):
+    server = WebServer('127.0.0.1', port)
+    with open(os.path.join(ROOT, 'index.html'), 'rb') as file:
+        original = file.read()
+
+    async def original_page(request):
+        # Come un hosting statico qualsiasi: gzip al volo
+        response = web.Response(body=original, content_type='text/html')
+        response.enable_compression()
+        return response
+
+    server.add_route('GET', ORIGINAL_PATH, original_page)
+    add_bundle_routes(server, bundle)
+    await server.start()
+    return server
+
+
+async def open_page(context, url, cpu_slowdown):
+    """(ms fino a interattiva, TBT ms, byte trasferiti)"""
+    page = await context.new_page()
+    cdp = await context.new_cdp_session(page)
+    await cdp.send('Network.enable')
+    await cdp.send('Emulation.setCPUThrottlingRate', {'rate': cpu_slowdown})
+    transferred = []
+    cdp.on('Network.loadingFinished', lambda event: transferred.append(event['encodedDataLength']))
+    await page.route('https://telegram.org/**', lambda route: route.abort())
+    await page.add_init_script(PROBE)
+    await page.goto(url)
+    await page.wait_for_function('window.__interactive !== undefined', timeout=60_000)
+    result = await page.evaluate('window.__interactive')
+    await page.close()
+    return result['at'], result['tbt'], sum(transferred)
+
+
+async def measure(browser, url, runs, cpu_slowdown):
+    cold, warm = [], []
+    for _ in range(runs):
+        context = await browser.new_context()
+        cold.append(await open_page(context, url, cpu_slowdown))
+        warm.append(await open_page(context, url, cpu_slowdown))
+        await context.close()
+    return cold, warm
+
+
+def summary(samples):
+    interactive, tbt, transferred = zip(*samples)
+    return (f"{statistics.median(interactive):>7.0f} ms  TBT {statistics.median(tbt):>5.0f} ms  "
+            f"{statistics.median(transferred) / 1024:>6.1f} KB")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--cpu-slowdown', type=float, default=4, help="rallentamento CPU (4 = telefono economico)")
+    parser.add_argument('--bundle', help="bundle già compilato (default: compilato ora in una cartella temporanea)")
+    parser.add_argument('--port', type=int, default=8089)
+    args = parser.parse_args()
+    async_playwright = _playwright()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bundle = args.bundle
+        if bundle is None:
+            bundle = workdir
+            build_bundle(os.path.join(ROOT, 'index.html'), bundle)
+        server = await serve(bundle, args.port)
+        base = f"http://127.0.0.1:{args.port}"
+        try:
+            async with async_playwright() as playwright:
+                browser = await playwright.chromium.launch()
+                print(f"CPU rallentata {args.cpu_slowdown:g}x, mediana su {args.runs} aperture\n")
+                for name, path in (('attuale', ORIGINAL_PATH), ('bundle', f"{BUNDLE_PATH}/")):
+                    cold, warm = await measure(browser, base + path, args.runs, args.cpu_slowdown)
+                    print(f"{name:<8} cache vuota: {summary(cold)}")
+                    print(f"{'':<8} cache calda: {summary(warm)}")
+                await browser.close()
+        finally:
+            await server.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""
+Benchmark: codec compatto v1 vs JSON+base64 per il parametro ?data= della Mini App
+
+Confronta dimensione (caratteri nell'URL) e tempo di encode/decode su payload
+realistici: setup profilo, reset settimana, storico pesi di 1/2 anni.
+
+Uso:
+    python benchmarks/bench_codec.py [--runs 20000]
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from codec import DAYS, decode_app_data, encode_app_data  # noqa: E402
+
+
+def legacy_encode(data):
+    return base64.b64encode(json.dumps(data).encode()).decode()
+
+
+def legacy_decode(encoded):
+    return json.loads(base64.b64decode(encoded))
+
+
+def payloads():
+    macros = {'calories': 2838, 'protein': 212, 'carbs': 319, 'fats': 78}
+    week = {day: {'workout': i % 2 == 0, 'diet': True, 'cardio': i % 3 == 0} for i, day in enumerate(DAYS)}
+    history = [{'week': i, 'weight': round(72 + i * 0.15, 1)} for i in range(1, 105)]
+    return {
+        'setup': {'macros': macros, 'userName': 'Gabriele', 'goal': 'bulk'},
+        'setpeso': {'savedWeights': [{'week': 12, 'weight': 75.5}]},
+        'resetsettimana': {'weekData': week},
+        'pesi 52 settimane': {'savedWeights': history[:52]},
+        'pesi 104 settimane': {'savedWeights': history},
+        'snapshot completo': {
+            'macros': macros, 'userName': 'Gabriele', 'goal': 'bulk', 'currentWeek': 52,
+            'pointsForSgarro': 3, 'streak': 7, 'weekData': week, 'savedWeights': history[:52],
+        },
+    }
+
+
+def check_roundtrip():
+    """Macro a zero e negative (profilo con valori assurdi) tornano identiche"""
+    for macros in ({'calories': 0, 'protein': 0, 'carbs': 0, 'fats': 0},
+                   {'calories': -74, 'protein': 20, 'carbs': -138, 'fats': 0}):
+        data = {'macros': macros, 'userName': 'Test', 'goal': 'cut'}
+        for compress in (True, False):
+            assert decode_app_data(encode_app_data(data, compress=compress)) == data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20000)
+    args = parser.parse_args()
+    check_roundtrip()
+
+    print(f"{'payload':<20} {'json+b64':>9} {'v1':>6} {'v1 raw':>7} {'ratio':>6}   "
+          f"{'enc json':>9} {'enc v1':>8} {'dec json':>9} {'dec v1':>8}  (µs)")
+    for name, data in payloads().items():
+        legacy = legacy_encode(data)
+        compact = encode_app_data(data)
+        compact_raw = encode_app_data(data, compress=False)
+        assert decode_app_data(compact) == decode_app_data(compact_raw)
+
+        runs = max(1, args.runs // max(1, len(legacy) // 100))
+
+        def per_call(func, arg):
+            return timeit.timeit(lambda: func(arg), number=runs) / runs * 1e6
+
+        print(f"{name:<20} {len(legacy):>9} {len(compact):>6} {len(compact_raw):>7} "
+              f"{len(legacy) / len(compact):>5.1f}x   "
+              f"{per_call(legacy_encode, data):>9.1f} {per_call(encode_app_data, data):>8.1f} "
+              f"{per_call(legacy_decode, legacy):>9.1f} {per_call(decode_app_data, compact):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
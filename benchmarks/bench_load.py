@@ -0,0 +1,335 @@
+"""
+Simulatore di carico: migliaia di utenti virtuali su /setup e /cambiapeso
+
+Ogni utente virtuale percorre il flusso completo come un utente vero:
+/setup, nome, peso, altezza, età (messaggi di testo), obiettivo e livello di
+attività (callback query), poi /cambiapeso e il nuovo peso. Tutti gli utenti
+girano in parallelo contro l'Application reale (bot.build_application): gli
+update entrano dalla update_queue e passano per PerUserUpdateProcessor, la
+coda di invio e il ConversationHandler, come in produzione.
+
+La Bot API è uno stand-in senza rete: FakeRequest in-process (default) o, con
+--latency/--jitter, FakeBotAPI su localhost per simulare i tempi di risposta.
+
+Misure:
+- latenza per passo (update in coda -> risposta alla Bot API): p50/p95/p99
+- throughput (update/s e flussi completati/s)
+- memoria: RSS prima, picco durante e dopo la run, per 1000 utenti (con
+  FakeBotAPI include anche le chiamate registrate dal server finto); con
+  --tracemalloc anche l'heap Python trattenuto per utente (l'RSS non scende
+  dopo il picco, l'heap trattenuto sì: è quello che cresce con gli utenti)
+- stato residuo: conversazioni aperte, lock per utente, user_data
+
+Rilevamento di stato mescolato tra utenti: ogni utente usa valori unici
+(nome con il suo id, peso, altezza, età); ogni risposta ricevuta da una chat
+deve contenere i valori di QUELL'utente, nell'ordine atteso, senza messaggi
+in più, e a fine run profilo e user_data devono corrispondere. Le anomalie
+vengono elencate e il processo esce con codice 1.
+
+Uso:
+    python benchmarks/bench_load.py [--users 2000] [--ramp 0] [--think-ms 0]
+        [--latency 0] [--jitter 0] [--tracemalloc] [--output load-report.json]
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('METRICS_PORT', '0')
+# Il limite di 30 msg/s della coda di invio è quello di produzione, non va misurato qui
+os.environ.setdefault('OUTBOUND_RATE', '1000000')
+os.environ.setdefault('MINI_APP_URL', 'https://example.com/wintergrind/')
+
+import telegram  # noqa: E402
+
+import bot  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from fake_telegram import BOT_TOKEN, FakeRequest, callback_update_data, text_update_data  # noqa: E402
+
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+FIRST_ID = 5_000_000
+GOALS = (('bulk', '💪 Massa Muscolare'), ('cut', '🔥 Definizione'), ('maintain', '⚖️ Mantenimento'))
+ACTIVITIES = ('sedentary', 'light', 'moderate', 'active', 'very_active')
+STEPS = ('setup_start', 'setup_name', 'setup_weight', 'setup_height', 'setup_age', 'setup_goal',
+         'setup_activity', 'cambiapeso', 'nuovo_peso')
+
+
+class SlimRequest(FakeRequest):
+    """FakeRequest che conserva solo chat e testo: la memoria misurata resta quella del bot"""
+
+    async def do_request(self, *args, **kwargs):
+        result = await super().do_request(*args, **kwargs)
+        endpoint, params = self.calls[-1]
+        self.calls[-1] = (endpoint, {'chat_id': params.get('chat_id'), 'text': params.get('text')})
+        return result
+
+
+def persona(user_id):
+    """Valori unici dell'utente virtuale (testo inviato e valore atteso nelle risposte)"""
+    weight = f"{50 + user_id % 500 / 10:.1f}"
+    new_weight = f"{float(weight) - 1.5:.1f}"
+    return {
+        'name': f"Atleta{user_id}",
+        'weight': weight,
+        'height': str(150 + user_id % 50),
+        'age': str(18 + user_id % 50),
+        'goal': GOALS[user_id % len(GOALS)],
+        'activity': ACTIVITIES[user_id % len(ACTIVITIES)],
+        'new_weight': new_weight,
+    }
+
+
+def script(user_id):
+    """[(passo, dati dell'update, testi attesi nella risposta)] del flusso di un utente"""
+    p = persona(user_id)
+    goal, goal_label = p['goal']
+    return [
+        ('setup_start', text_update_data(user_id, '/setup'), ['SETUP PROFILO']),
+        ('setup_name', text_update_data(user_id, p['name']), [f"Perfetto {p['name']}!"]),
+        ('setup_weight', text_update_data(user_id, p['weight']), [f"Peso: {float(p['weight'])} kg"]),
+        ('setup_height', text_update_data(user_id, p['height']), [f"Altezza: {float(p['height'])} cm"]),
+        ('setup_age', text_update_data(user_id, p['age']), [f"Età: {p['age']} anni"]),
+        ('setup_goal', callback_update_data(user_id, f"goal_{goal}"), [f"Obiettivo: {goal_label}"]),
+        ('setup_activity', callback_update_data(user_id, f"activity_{p['activity']}"),
+         [f"Nome: {p['name']}", f"Peso: {float(p['weight'])} kg", f"Età: {p['age']} anni"]),
+        ('cambiapeso', text_update_data(user_id, '/cambiapeso'), ['AGGIORNA PESO']),
+        ('nuovo_peso', text_update_data(user_id, p['new_weight']), [f"Peso aggiornato: {float(p['new_weight'])} kg"]),
+    ]
+
+
+def rss_bytes():
+    """Memoria residente del processo (Linux: /proc, altrove il picco di getrusage)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def summarize(samples):
+    """Statistiche di latenza in ms"""
+    values = sorted(samples)
+
+    def pct(p):
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    return {
+        'count': len(values),
+        'p50_ms': round(statistics.median(values), 3),
+        'p95_ms': round(pct(95), 3),
+        'p99_ms': round(pct(99), 3),
+        'max_ms': round(values[-1], 3),
+    }
+
+
+def replies_by_chat(calls):
+    """Testi inviati a ogni chat, in ordine (sendMessage ed editMessageText)"""
+    replies = {}
+    for call in calls:
+        endpoint, params = call[0], call[1]
+        if endpoint in ('sendMessage', 'editMessageText'):
+            replies.setdefault(int(params.get('chat_id', 0)), []).append(params.get('text', ''))
+    return replies
+
+
+def find_mixing(user_ids, calls, application):
+    """Anomalie: risposte con dati di altri utenti, fuori ordine o in più; profili sbagliati"""
+    problems = []
+    replies = replies_by_chat(calls)
+    for user_id in user_ids:
+        texts = replies.get(user_id, [])
+        steps = script(user_id)
+        if len(texts) != len(steps):
+            problems.append(f"{user_id}: {len(texts)} risposte invece di {len(steps)}")
+        for (step, _, expected), text in zip(steps, texts):
+            missing = [value for value in expected if value not in text]
+            if missing:
+                problems.append(f"{user_id} {step}: manca {missing!r} in {text[:60]!r}")
+
+        p = persona(user_id)
+        profile = bot.user_profiles.get(user_id)
+        wanted = {'name': p['name'], 'weight': float(p['new_weight']), 'height': float(p['height']),
+                  'age': int(p['age']), 'goal': p['goal'][0], 'activity': p['activity']}
+        if profile is None:
+            problems.append(f"{user_id}: profilo mancante")
+        else:
+            wrong = {key: profile.get(key) for key, value in wanted.items() if profile.get(key) != value}
+            if wrong:
+                problems.append(f"{user_id}: profilo con valori non suoi {wrong}")
+        user_data = application.user_data.get(user_id, {})
+        if user_data.get('name') != p['name'] or user_data.get('waiting_for_weight'):
+            problems.append(f"{user_id}: user_data inatteso {dict(user_data)}")
+
+    # Risposte arrivate a chat che non hanno mai scritto al bot
+    strangers = set(replies) - set(user_ids)
+    if strangers:
+        problems.append(f"risposte a chat sconosciute: {sorted(strangers)[:10]}")
+    return problems
+
+
+async def run(args):
+    if args.latency or args.jitter:
+        api = FakeBotAPI(port=args.api_port, latency=args.latency, jitter=args.jitter)
+        await api.start()
+        application = bot.build_application(BOT_TOKEN, base_url=api.base_url)
+        replies = api
+    else:
+        api = None
+        application = bot.build_application(BOT_TOKEN)
+        replies = SlimRequest()
+        application.bot._request = (FakeRequest(), replies)
+
+    user_ids = list(range(FIRST_ID, FIRST_ID + args.users))
+    samples = {step: [] for step in STEPS}
+    flows = []
+    setup_handler = application.handlers[0][0]
+
+    async with application:
+        # Niente post_init: scheduler, storage e lease non servono alla misura
+        await application.start()
+        gc.collect()
+        rss_before = peak = rss_bytes()
+        if args.tracemalloc:
+            tracemalloc.start()
+        done = asyncio.Event()
+
+        async def sample_memory():
+            nonlocal peak
+            while not done.is_set():
+                peak = max(peak, rss_bytes())
+                await asyncio.sleep(0.2)
+
+        async def virtual_user(index, user_id):
+            rng = random.Random(user_id)
+            if args.ramp:
+                await asyncio.sleep(args.ramp * index / args.users)
+            flow_start = time.perf_counter()
+            for step, data, _ in script(user_id):
+                if args.think_ms:
+                    await asyncio.sleep(rng.uniform(0, args.think_ms) / 1000)
+                reply = replies.wait_for_reply(user_id)
+                start = time.perf_counter()
+                await application.update_queue.put(telegram.Update.de_json(data, application.bot))
+                try:
+                    replied_at = await asyncio.wait_for(reply, args.timeout)
+                except asyncio.TimeoutError:
+                    logging.error(f"Utente {user_id}: nessuna risposta a {step} entro {args.timeout}s")
+                    return
+                samples[step].append((replied_at - start) * 1000)
+            flows.append((time.perf_counter() - flow_start) * 1000)
+
+        print(f"\n{args.users} utenti virtuali (ramp {args.ramp:g}s, pausa fino a {args.think_ms:g} ms, "
+              f"{'FakeBotAPI su localhost' if api else 'Bot API in-process'})")
+        sampler = asyncio.create_task(sample_memory())
+        start = time.perf_counter()
+        await asyncio.gather(*(virtual_user(index, user_id) for index, user_id in enumerate(user_ids)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await sampler
+
+        # Le ultime risposte possono essere ancora in coda di invio
+        await asyncio.sleep(0.1)
+        gc.collect()
+        rss_after = rss_bytes()
+        heap = None
+        if args.tracemalloc:
+            heap = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        residual = {
+            'open_conversations': len(getattr(setup_handler, '_conversations', {})),
+            'user_chains': len(getattr(application.update_processor, '_tails', {})),
+            'user_data': len(application.user_data),
+            'profiles': len(bot.user_profiles),
+        }
+        problems = find_mixing(user_ids, replies.calls, application)
+        await application.stop()
+
+    if api is not None:
+        await api.stop()
+
+    updates = sum(len(values) for values in samples.values())
+    report = {
+        'users': args.users,
+        'completed_flows': len(flows),
+        'seconds': round(elapsed, 3),
+        'updates_per_second': round(updates / elapsed, 1),
+        'flows_per_second': round(len(flows) / elapsed, 1),
+        'steps': {step: summarize(values) for step, values in samples.items() if values},
+        'flow': summarize(flows) if flows else None,
+        'memory': {
+            'rss_before_mb': round(rss_before / 2**20, 1),
+            'rss_peak_mb': round(peak / 2**20, 1),
+            'rss_after_mb': round(rss_after / 2**20, 1),
+            'growth_per_1000_users_kb': round((rss_after - rss_before) / args.users * 1000 / 1024, 1),
+        },
+        'residual': residual,
+        'mixing_problems': len(problems),
+    }
+    if heap is not None:
+        report['memory'].update(
+            heap_retained_per_user_bytes=round(heap[0] / args.users),
+            heap_peak_mb=round(heap[1] / 2**20, 1),
+        )
+    return report, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--ramp', type=float, default=0.0, help="secondi in cui arrivano tutti gli utenti")
+    parser.add_argument('--think-ms', type=float, default=0.0, help="pausa casuale massima tra due passi")
+    parser.add_argument('--latency', type=float, default=0.0, help="latenza simulata della Bot API (s)")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--timeout', type=float, default=60.0, help="attesa massima di una risposta (s)")
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help="misura l'heap Python trattenuto (rallenta la run)")
+    parser.add_argument('--output', help="report JSON")
+    args = parser.parse_args()
+
+    report, problems = asyncio.run(run(args))
+
+    print(f"  {report['completed_flows']}/{report['users']} flussi in {report['seconds']:.2f} s  "
+          f"({report['updates_per_second']:.0f} update/s, {report['flows_per_second']:.0f} flussi/s)")
+    for step, stats in report['steps'].items():
+        print(f"  {step:<15} p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  "
+              f"p99 {stats['p99_ms']:>8.2f} ms  max {stats['max_ms']:>8.2f} ms")
+    if report['flow']:
+        flow = report['flow']
+        print(f"  {'flusso intero':<15} p50 {flow['p50_ms']:>8.2f} ms  p95 {flow['p95_ms']:>8.2f} ms  "
+              f"p99 {flow['p99_ms']:>8.2f} ms")
+    memory = report['memory']
+    print(f"  RSS {memory['rss_before_mb']} -> picco {memory['rss_peak_mb']} -> {memory['rss_after_mb']} MB  "
+          f"({memory['growth_per_1000_users_kb']} KiB ogni 1000 utenti)")
+    if 'heap_peak_mb' in memory:
+        print(f"  heap Python trattenuto {memory['heap_retained_per_user_bytes']} B/utente, "
+              f"picco {memory['heap_peak_mb']} MB")
+    print(f"  stato residuo: {report['residual']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report: {args.output}")
+
+    if problems or report['completed_flows'] != report['users']:
+        print(f"\n❌ {len(problems)} anomalie (stato mescolato tra utenti?)")
+        for problem in problems[:20]:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print("\n✅ Nessuno stato mescolato tra utenti")
+
+
+if __name__ == '__main__':
+    main()
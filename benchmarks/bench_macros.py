@@ -0,0 +1,100 @@
+"""
+Benchmark: ricalcolo BMR/TDEE/macro con loop Python per utente vs batch NumPy
+
+Per ogni dimensione confronta:
+- loop scalare (calculate_bmr/tdee/macros per profilo) sugli stessi dati
+- batch_macros su array NumPy
+- recalculate_profiles: passaggio completo sui dict dei profili (raccolta + riscrittura)
+e verifica che i risultati del batch coincidano esattamente con quelli scalari.
+
+Uso:
+    python benchmarks/bench_macros.py [--sizes 10000 100000 1000000] [--max-profiles 1000000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np  # noqa: E402
+
+from nutrition import (  # noqa: E402
+    ACTIVITY_LEVELS, GOALS, activity_code, batch_macros, calculate_bmr,
+    calculate_macros, calculate_tdee, goal_code, recalculate_profiles,
+)
+
+
+def make_profiles(count, seed=42):
+    rng = random.Random(seed)
+    return {
+        user_id: {
+            'name': f'user{user_id}',
+            # pesi come da /setup (float con decimali) e qualche intero
+            'weight': round(rng.uniform(45, 140), rng.choice((0, 1, 2))),
+            'height': rng.randint(150, 205),
+            'age': rng.randint(16, 80),
+            'goal': rng.choice(GOALS),
+            'activity': rng.choice(ACTIVITY_LEVELS),
+        }
+        for user_id in range(1, count + 1)
+    }
+
+
+def scalar_loop(profiles):
+    results = {}
+    for user_id, p in profiles.items():
+        bmr = calculate_bmr(p['weight'], p['height'], p['age'])
+        tdee = calculate_tdee(bmr, p['activity'])
+        results[user_id] = (bmr, tdee, calculate_macros(tdee, p['goal']))
+    return results
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--max-profiles', type=int, default=1_000_000,
+                        help="oltre questa dimensione salta il passaggio sui dict (memoria)")
+    args = parser.parse_args()
+
+    print(f"{'profili':>9} {'loop Python':>12} {'batch NumPy':>12} {'speedup':>8} {'pass dict':>10}  (ms)")
+    for size in args.sizes:
+        profiles = make_profiles(size)
+        values = list(profiles.values())
+        arrays = (
+            np.array([p['weight'] for p in values]),
+            np.array([p['height'] for p in values]),
+            np.array([p['age'] for p in values]),
+            np.array([activity_code(p['activity']) for p in values]),
+            np.array([goal_code(p['goal']) for p in values]),
+        )
+
+        expected, loop_s = timed(scalar_loop, profiles)
+        batch, batch_s = timed(batch_macros, *arrays)
+
+        # Stessi valori al bit, troncamento int() compreso
+        for i, (bmr, tdee, macros) in enumerate(expected.values()):
+            assert batch['bmr'][i] == bmr and batch['tdee'][i] == tdee, i
+            assert all(int(batch[key][i]) == value for key, value in macros.items()), i
+
+        pass_ms = '-'
+        if size <= args.max_profiles:
+            _, pass_s = timed(recalculate_profiles, profiles)
+            for user_id, (bmr, tdee, macros) in expected.items():
+                assert profiles[user_id]['macros'] == macros and profiles[user_id]['tdee'] == tdee
+            pass_ms = f"{pass_s * 1000:.0f}"
+
+        print(f"{size:>9} {loop_s * 1000:>12.0f} {batch_s * 1000:>12.1f} "
+              f"{loop_s / batch_s:>7.0f}x {pass_ms:>10}")
+
+
+if __name__ == '__main__':
+    main()
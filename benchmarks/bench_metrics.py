@@ -0,0 +1,100 @@
+"""
+Benchmark: overhead della strumentazione /metrics sul percorso caldo degli handler
+
+Misura:
+- costo per chiamata del wrapper di instrument_handlers su un handler vuoto
+- latenza di process_update per /oggi (Bot API in-process) con e senza strumentazione
+- tempo di render di /metrics con tutte le serie popolate
+
+Uso:
+    python benchmarks/bench_metrics.py [--calls 200000] [--updates 5000]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+from telegram.ext import Application, CommandHandler  # noqa: E402
+
+import bot  # noqa: E402
+from fake_telegram import BOT_TOKEN, FakeRequest, make_text_update  # noqa: E402
+from metrics import REGISTRY, SEND_OUTCOMES, instrument_handlers  # noqa: E402
+
+
+async def noop(update, context):
+    return None
+
+
+async def wrapper_overhead(calls):
+    application = Application.builder().token(BOT_TOKEN).request(FakeRequest()).build()
+    handler = CommandHandler('noop', noop)
+    application.add_handler(handler)
+
+    async def per_call():
+        callback = handler.callback
+        start = time.perf_counter()
+        for _ in range(calls):
+            await callback(None, None)
+        return (time.perf_counter() - start) / calls * 1e9
+
+    raw = await per_call()
+    instrument_handlers(application)
+    wrapped = await per_call()
+    return raw, wrapped
+
+
+async def dispatch_latency(updates, instrumented):
+    application = Application.builder().token(BOT_TOKEN).request(FakeRequest()).build()
+    application.add_handler(CommandHandler('oggi', bot.oggi_command))
+    if instrumented:
+        instrument_handlers(application)
+    samples = []
+    async with application:
+        for user_id in range(1, updates + 1):
+            update = make_text_update(application.bot, user_id, '/oggi')
+            start = time.perf_counter()
+            await application.process_update(update)
+            samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples), statistics.fmean(samples)
+
+
+def render_time():
+    for reminder in ('morning_reminder', 'evening_reminder', 'weekly_report'):
+        for outcome in ('success', 'forbidden', 'retry_after', 'error'):
+            SEND_OUTCOMES.inc(reminder, outcome)
+    runs = 200
+    start = time.perf_counter()
+    for _ in range(runs):
+        text = REGISTRY.render()
+    return (time.perf_counter() - start) / runs * 1000, len(text.splitlines())
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200_000)
+    parser.add_argument('--updates', type=int, default=5000)
+    args = parser.parse_args()
+
+    raw, wrapped = await wrapper_overhead(args.calls)
+    print(f"Handler vuoto        {raw:>8.0f} ns  strumentato {wrapped:>8.0f} ns  (+{wrapped - raw:.0f} ns/chiamata)")
+
+    # Alternati per non favorire il secondo giro (cache calde)
+    plain = await dispatch_latency(args.updates, instrumented=False)
+    timed = await dispatch_latency(args.updates, instrumented=True)
+    plain = min(plain, await dispatch_latency(args.updates, instrumented=False))
+    timed = min(timed, await dispatch_latency(args.updates, instrumented=True))
+    print(f"process_update /oggi p50 {plain[0]:>8.1f} µs  strumentato {timed[0]:>8.1f} µs  "
+          f"({(timed[0] - plain[0]) / plain[0] * 100:+.1f}%)")
+
+    ms, lines = render_time()
+    print(f"Render /metrics      {ms:>8.3f} ms  ({lines} righe)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+Benchmark: latenza delle risposte interattive durante un broadcast
+
+Scenario: parte un promemoria verso --bulk utenti e, mentre è in corso, altri
+utenti scrivono /oggi a intervalli regolari. Confronta la latenza delle
+risposte (process_update fino alla sendMessage completata) senza e con la coda
+di invio a priorità (outbound.OutboundQueue), a parità di limite globale.
+
+Uso:
+    python benchmarks/bench_outbound.py [--bulk 3000] [--interactive 100] [--rate 200] [--latency 0.02]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('MINI_APP_URL', 'https://example.com/wintergrind/')
+
+import telegram  # noqa: E402
+
+import bot  # noqa: E402
+from broadcast import Broadcaster  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from fake_telegram import BOT_TOKEN, text_update_data  # noqa: E402
+
+logging.getLogger('httpx').setLevel(logging.WARNING)
+logging.getLogger('broadcast').setLevel(logging.ERROR)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def scenario(api, args, with_queue):
+    bot.OUTBOUND_QUEUE = with_queue
+    bot.OUTBOUND_RATE = args.rate
+    application = bot.build_application(BOT_TOKEN, base_url=api.base_url)
+    latencies = []
+
+    async with application:
+        application.bot_data['broadcaster'] = Broadcaster(global_rate=args.rate, concurrency=args.concurrency)
+        bulk_ids = range(10_000_000, 10_000_000 + args.bulk)
+        broadcast = asyncio.create_task(bot.evening_reminder(application, bulk_ids))
+        await asyncio.sleep(0.5)   # broadcast a regime
+
+        async def reply(user_id):
+            update = telegram.Update.de_json(text_update_data(user_id, '/oggi'), application.bot)
+            start = time.perf_counter()
+            await application.process_update(update)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        tasks = []
+        for user_id in range(1, args.interactive + 1):
+            tasks.append(asyncio.create_task(reply(user_id)))
+            await asyncio.sleep(args.interval)
+        await asyncio.gather(*tasks)
+        finished_during_broadcast = not broadcast.done()
+
+        start = time.perf_counter()
+        await broadcast
+        tail = time.perf_counter() - start
+        stats = application.bot.rate_limiter.stats() if with_queue else None
+
+    return latencies, finished_during_broadcast, tail, stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bulk', type=int, default=3000)
+    parser.add_argument('--interactive', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=0.05, help="secondi tra due /oggi")
+    parser.add_argument('--rate', type=float, default=200, help="limite globale msg/s (uguale nei due casi)")
+    parser.add_argument('--concurrency', type=int, default=bot.BROADCAST_CONCURRENCY)
+    parser.add_argument('--latency', type=float, default=0.02, help="latenza simulata della Bot API (s)")
+    parser.add_argument('--api-port', type=int, default=8081)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(port=args.api_port, latency=args.latency)
+    await api.start()
+
+    print(f"\nBroadcast a {args.bulk} utenti ({args.rate:g} msg/s) + {args.interactive} /oggi ogni {args.interval}s")
+    for label, with_queue in (('senza coda', False), ('coda a priorità', True)):
+        latencies, overlapped, tail, stats = await scenario(api, args, with_queue)
+        print(f"  {label:<16} /oggi p50 {statistics.median(latencies):>8.1f} ms  "
+              f"p95 {percentile(latencies, 95):>8.1f} ms  max {max(latencies):>8.1f} ms"
+              f"{'' if overlapped else '  (broadcast finito prima: aumenta --bulk)'}")
+        if stats:
+            for priority, values in stats['classes'].items():
+                print(f"    {priority:<12} inviati {values['sent']:>6}  attesa media {values['wait_avg_ms']:>8.1f} ms  "
+                      f"max {values['wait_max_ms']:>8.1f} ms")
+
+    await api.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
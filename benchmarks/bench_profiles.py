@@ -0,0 +1,136 @@
+"""
+Benchmark: memoria dei profili, dict di dict contro ProfileStore colonnare
+
+Per ogni dimensione costruisce gli stessi profili completi (come li salva
+setup_activity: nome, peso, altezza, età, obiettivo, attività, bmr, tdee,
+macro e created_at) nelle due forme e misura:
+- memoria Python trattenuta (tracemalloc), totale e per utente
+- lettura di un profilo come fa profilo_command (tutti i campi + macro)
+- ricalcolo massivo: recalculate_profiles sui dict vs ProfileStore.recalculate
+e verifica che le due forme contengano esattamente gli stessi dati.
+
+Uso:
+    python benchmarks/bench_profiles.py [--sizes 100000 1000000]
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nutrition import (  # noqa: E402
+    ACTIVITY_LEVELS, GOALS, calculate_bmr, calculate_macros, calculate_tdee, recalculate_profiles,
+)
+from profiles import ProfileStore  # noqa: E402
+
+FIRST_ID = 100_000_000
+READS = 100_000
+
+
+def make_profile(user_id, rng, created):
+    weight = round(rng.uniform(45, 140), 1)
+    height = float(rng.randint(150, 205))
+    age = rng.randint(16, 80)
+    goal = rng.choice(GOALS)
+    activity = rng.choice(ACTIVITY_LEVELS)
+    bmr = calculate_bmr(weight, height, age)
+    tdee = calculate_tdee(bmr, activity)
+    return {
+        'name': f"Atleta{user_id}",
+        'weight': weight,
+        'height': height,
+        'age': age,
+        'goal': goal,
+        'activity': activity,
+        'bmr': bmr,
+        'tdee': tdee,
+        'macros': calculate_macros(tdee, goal),
+        'created_at': (created + timedelta(seconds=rng.randrange(10**7), microseconds=rng.randrange(10**6))).isoformat(),
+    }
+
+
+def profiles(count, seed=42):
+    rng = random.Random(seed)
+    created = datetime(2025, 11, 1)
+    for user_id in range(FIRST_ID, FIRST_ID + count):
+        yield user_id, make_profile(user_id, rng, created)
+
+
+def build_dicts(count):
+    return dict(profiles(count))
+
+
+def build_store(count):
+    store = ProfileStore()
+    for user_id, profile in profiles(count):
+        store[user_id] = profile
+    return store
+
+
+def measure(build, count):
+    """(oggetto, byte trattenuti, secondi) — i dati sorgente non restano in memoria"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    built = build(count)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return built, used, elapsed
+
+
+def read_profile(profile):
+    """I campi letti da profilo_command"""
+    macros = profile['macros']
+    return (profile['name'], profile['weight'], profile['height'], profile['age'], profile['goal'],
+            int(profile['bmr']), int(profile['tdee']), macros['calories'], macros['protein'],
+            macros['carbs'], macros['fats'])
+
+
+def read_time(container, user_ids):
+    start = time.perf_counter()
+    for user_id in user_ids:
+        read_profile(container[user_id])
+    return (time.perf_counter() - start) / len(user_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    for count in args.sizes:
+        print(f"\n{count} profili")
+        dicts, dict_bytes, dict_build = measure(build_dicts, count)
+        store, store_bytes, store_build = measure(build_store, count)
+        print(f"  dict di dict    {dict_bytes / 2**20:>8.1f} MB  {dict_bytes / count:>6.0f} B/utente  "
+              f"costruzione {dict_build:>5.2f} s")
+        print(f"  ProfileStore    {store_bytes / 2**20:>8.1f} MB  {store_bytes / count:>6.0f} B/utente  "
+              f"costruzione {store_build:>5.2f} s  ({dict_bytes / store_bytes:.1f}x meno)")
+
+        sample = random.Random(1).sample(list(dicts), min(READS, count))
+        if any(dict(store[user_id]) != dicts[user_id] for user_id in sample):
+            raise RuntimeError("ProfileStore non contiene gli stessi dati dei dict")
+        dict_read = read_time(dicts, sample)
+        store_read = read_time(store, sample)
+        print(f"  lettura profilo dict {dict_read * 1e6:>6.2f} µs   ProfileStore {store_read * 1e6:>6.2f} µs")
+
+        start = time.perf_counter()
+        recalculate_profiles(dicts)
+        dict_recalc = time.perf_counter() - start
+        start = time.perf_counter()
+        store.recalculate()
+        store_recalc = time.perf_counter() - start
+        print(f"  ricalcolo massivo dict {dict_recalc:>6.2f} s   ProfileStore {store_recalc:>6.2f} s")
+        del dicts, store
+
+
+if __name__ == '__main__':
+    main()
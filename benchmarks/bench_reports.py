@@ -0,0 +1,114 @@
+"""
+Benchmark: pipeline del report settimanale personalizzato (reports.py)
+
+Con --users utenti sintetici (stato attività + storico peso):
+- preparazione in streaming nello spool: tempo, utenti/s, picco di memoria
+  Python, dimensione e posizione dello spool (RAM o disco)
+- confronto con la lista di messaggi tutta in memoria
+- fan-out all'orario: broadcast_each verso un bot finto senza latenza,
+  leggendo dallo spool (solo I/O) o renderizzando al volo
+
+Uso:
+    python benchmarks/bench_reports.py [--users 100000] [--budget-mb 8]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from activity import DAYS  # noqa: E402
+from broadcast import Broadcaster  # noqa: E402
+from reports import ReportQueue, build_spool, render_report, week_stats  # noqa: E402
+from weights import WeightSeries  # noqa: E402
+
+FIRST_ID = 10_000_000
+
+
+def make_users(count, seed=7):
+    rng = random.Random(seed)
+    names, activity_states, weights = {}, {}, {}
+    today = date(2026, 3, 1)
+    for user_id in range(FIRST_ID, FIRST_ID + count):
+        names[user_id] = f"Utente{user_id}"
+        days = [rng.randrange(8) for _ in DAYS]
+        raw = sum(12 * (m & 1) + 10 * ((m >> 1) & 1) + 5 * ((m >> 2) & 1) for m in days)
+        activity_states[user_id] = {'week': 9, 'days': days, 'raw': raw, 'streak': rng.randrange(5), 'completed': 3}
+        series = WeightSeries()
+        weight = rng.uniform(60, 100)
+        for offset in range(0, 14, rng.choice((1, 2, 3))):
+            series.add(today - timedelta(days=13 - offset), weight + rng.uniform(-1, 1))
+        weights[user_id] = series
+    return names, activity_states, weights
+
+
+class NullBot:
+    """Bot finto: send_message non fa I/O (misura solo il costo lato bot)"""
+
+    rate_limiter = None
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--budget-mb', type=float, default=8)
+    args = parser.parse_args()
+
+    names, activity_states, weights = make_users(args.users)
+
+    def render(user_id):
+        return render_report(names[user_id], week_stats(activity_states.get(user_id), weights.get(user_id)))
+
+    user_ids = list(names)
+    budget = int(args.budget_mb * 1024 * 1024)
+    print(f"\n{args.users} utenti, budget spool {args.budget_mb:g} MB")
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    spool = await build_spool(user_ids, render, budget)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    print(f"  spool          {elapsed:>7.2f} s  ({args.users / elapsed:>8.0f} utenti/s)  "
+          f"picco {peak / 1024 / 1024:>6.1f} MB  spool {spool.size / 1024 / 1024:.1f} MB "
+          f"{'su disco' if spool.on_disk else 'in RAM'}")
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    in_memory = [(user_id, render(user_id)) for user_id in user_ids]
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    print(f"  lista in RAM   {elapsed:>7.2f} s  ({args.users / elapsed:>8.0f} utenti/s)  "
+          f"picco {peak / 1024 / 1024:>6.1f} MB")
+    del in_memory
+
+    queue = ReportQueue(render, budget)
+    broadcaster = Broadcaster(global_rate=10_000_000, per_chat_rate=1000, concurrency=20)
+    for label, spools in (('fan-out da spool', [spool]), ('fan-out al volo', [])):
+        bot = NullBot()
+        start = time.perf_counter()
+        await broadcaster.broadcast_each(bot, 'weekly_report', queue.messages(spools, user_ids), len(user_ids),
+                                         parse_mode='Markdown')
+        elapsed = time.perf_counter() - start
+        print(f"  {label:<16} {elapsed:>5.2f} s  ({bot.sent / elapsed:>8.0f} msg/s lato bot)")
+
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+Benchmark: latenza degli handler con storage SQLite (write-behind) vs solo dict
+
+Esegue setup_activity, change_goal_callback e handle_text_messages per N utenti
+con entrambi i backend e confronta p50/p95/max per handler.
+
+Uso:
+    python benchmarks/bench_storage.py [--users 2000]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram.ext import Application, CallbackContext  # noqa: E402
+
+import bot  # noqa: E402
+from fake_telegram import BOT_TOKEN, FakeRequest, make_callback_update, make_text_update  # noqa: E402
+from storage import MemoryStorage, SQLiteStorage  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run_handlers(application, users):
+    timings = {'setup_activity': [], 'change_goal_callback': [], 'handle_text_messages': []}
+
+    async def timed(name, handler, update):
+        context = CallbackContext.from_update(update, application)
+        start = time.perf_counter()
+        await handler(update, context)
+        timings[name].append((time.perf_counter() - start) * 1000)
+
+    for user_id in range(1, users + 1):
+        user_data = application.user_data[user_id]
+        user_data.update({'name': f'Utente{user_id}', 'weight': 70 + user_id % 30,
+                          'height': 175, 'age': 25, 'goal': 'bulk'})
+        await timed('setup_activity', bot.setup_activity,
+                    make_callback_update(application.bot, user_id, 'activity_moderate'))
+        await timed('change_goal_callback', bot.change_goal_callback,
+                    make_callback_update(application.bot, user_id, 'change_goal_cut'))
+        user_data['waiting_for_weight'] = True
+        await timed('handle_text_messages', bot.handle_text_messages,
+                    make_text_update(application.bot, user_id, '72.5'))
+    return timings
+
+
+async def bench(backend_name, storage, users):
+    bot.user_profiles.clear()
+    bot.user_settings.clear()
+    bot.app_states.clear()
+    bot.weight_history.clear()
+    # Stessi namespace (e codec) dello storage del bot
+    for namespace, cache in bot.storage._caches.items():
+        storage.register(namespace, cache, *bot.storage._codecs[namespace])
+    bot.storage = storage
+
+    application = Application.builder().token(BOT_TOKEN).request(FakeRequest()).build()
+    async with application:
+        await storage.open()
+        timings = await run_handlers(application, users)
+        start = time.perf_counter()
+        await storage.close()
+        close_ms = (time.perf_counter() - start) * 1000
+
+    print(f"\n== {backend_name} ({users} utenti, flush finale {close_ms:.1f} ms) ==")
+    for name, values in timings.items():
+        print(f"  {name:<22} p50 {statistics.median(values):.3f} ms  "
+              f"p95 {percentile(values, 95):.3f} ms  max {max(values):.3f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    args = parser.parse_args()
+
+    await bench('dict (MemoryStorage)', MemoryStorage(), args.users)
+    with tempfile.TemporaryDirectory() as tmp:
+        await bench('SQLite WAL write-behind',
+                    SQLiteStorage(os.path.join(tmp, 'bench.db'), flush_interval=0.05), args.users)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+"""
+Suite di benchmark del bot contro una Bot API locale simulata
+
+Usa l'Application reale (bot.build_application, la stessa di main()) puntata a
+benchmarks/fake_bot_api.py, che registra le chiamate e simula latenza di rete,
+429 (RetryAfter) e 403 (utenti che hanno bloccato il bot).
+
+Misure:
+- latenza per handler, dispatch completo incluso (process_update -> risposta HTTP):
+  start_command, il flusso /setup del ConversationHandler (passo per passo e
+  intero), profilo_command
+- throughput dei broadcast dei promemoria a 1k/10k/100k utenti
+
+429 e 403 sono simulati solo durante i broadcast. I risultati finiscono in un
+report JSON (--output) oltre che a video.
+
+Uso:
+    python benchmarks/bench_suite.py [--users 500] [--sizes 1000 10000 100000]
+        [--latency 0.02] [--jitter 0.01] [--flood-rate 0.0005] [--forbidden-rate 0.02]
+        [--job evening] [--output benchmark-report.json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+# Il limite di 30 msg/s della coda di invio è quello di produzione, non va misurato qui
+os.environ.setdefault('OUTBOUND_RATE', '1000000')
+os.environ.setdefault('MINI_APP_URL', 'https://example.com/wintergrind/')
+
+import telegram  # noqa: E402
+
+import bot  # noqa: E402
+from broadcast import Broadcaster  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from fake_telegram import BOT_TOKEN, callback_update_data, text_update_data  # noqa: E402
+
+# Una riga di log per ogni richiesta HTTP (o ogni broadcast) falserebbe la misura
+logging.getLogger('httpx').setLevel(logging.WARNING)
+logging.getLogger('broadcast').setLevel(logging.ERROR)
+
+SETUP_FLOW = (
+    ('setup_start', text_update_data, '/setup'),
+    ('setup_name', text_update_data, 'Bestia'),
+    ('setup_weight', text_update_data, '75.5'),
+    ('setup_height', text_update_data, '180'),
+    ('setup_age', text_update_data, '25'),
+    ('setup_goal', callback_update_data, 'goal_bulk'),
+    ('setup_activity', callback_update_data, 'activity_moderate'),
+)
+
+
+def summarize(samples):
+    """Statistiche di latenza in ms"""
+    values = sorted(samples)
+
+    def pct(p):
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    return {
+        'count': len(values),
+        'mean_ms': round(statistics.fmean(values), 3),
+        'p50_ms': round(statistics.median(values), 3),
+        'p95_ms': round(pct(95), 3),
+        'p99_ms': round(pct(99), 3),
+        'max_ms': round(values[-1], 3),
+    }
+
+
+async def measure_handlers(application, users, concurrency):
+    """Ogni utente: /start, flusso /setup completo, /profilo; utenti diversi in parallelo"""
+    samples = {name: [] for name in ('start_command', 'setup_flow', 'profilo_command')}
+    samples.update({name: [] for name, _, _ in SETUP_FLOW})
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def dispatch(name, data):
+        update = telegram.Update.de_json(data, application.bot)
+        start = time.perf_counter()
+        await application.process_update(update)
+        elapsed = (time.perf_counter() - start) * 1000
+        samples[name].append(elapsed)
+        return elapsed
+
+    async def user_session(user_id):
+        async with semaphore:
+            await dispatch('start_command', text_update_data(user_id, '/start'))
+            flow = 0.0
+            for name, make_data, payload in SETUP_FLOW:
+                flow += await dispatch(name, make_data(user_id, payload))
+            samples['setup_flow'].append(flow)
+            await dispatch('profilo_command', text_update_data(user_id, '/profilo'))
+
+    await asyncio.gather(*(user_session(user_id) for user_id in range(1, users + 1)))
+
+    completed = sum(1 for user_id in range(1, users + 1) if user_id in bot.user_profiles)
+    if completed != users:
+        raise RuntimeError(f"Flusso /setup completato solo da {completed}/{users} utenti")
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+async def measure_broadcast(application, job, size):
+    recipients = list(range(1, size + 1))
+    start = time.perf_counter()
+    await bot.REMINDER_JOBS[job](application, recipients)
+    elapsed = time.perf_counter() - start
+
+    runs = application.bot_data['broadcaster'].last_runs.values()
+    stats = [run.as_dict() for run in runs]
+    sent = sum(run['sent'] for run in stats)
+    return {
+        'job': job,
+        'users': size,
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(size / elapsed, 1),
+        'sent': sent,
+        'forbidden': sum(run['forbidden'] for run in stats),
+        'failed': sum(run['failed'] for run in stats),
+        'retry_after': sum(run['retries'] for run in stats),
+        'paused_seconds': round(sum(run['paused_for'] for run in stats), 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500, help="utenti per la latenza degli handler")
+    parser.add_argument('--handler-concurrency', type=int, default=20)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--job', choices=sorted(bot.REMINDER_JOBS), default='evening')
+    parser.add_argument('--rate', type=float, default=1_000_000,
+                        help="limite globale del broadcaster (msg/s); default: nessun limite pratico")
+    parser.add_argument('--concurrency', type=int, default=bot.BROADCAST_CONCURRENCY)
+    parser.add_argument('--latency', type=float, default=0.0, help="latenza simulata della Bot API (s)")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="probabilità di un 429 per invio")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--forbidden-rate', type=float, default=0.0, help="quota di chat che rispondono 403")
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--output', default='benchmark-report.json')
+    args = parser.parse_args()
+
+    # 429 e 403 solo durante i broadcast: chi sta scrivendo al bot non l'ha bloccato
+    api = FakeBotAPI(port=args.api_port, latency=args.latency, jitter=args.jitter,
+                     retry_after=args.retry_after)
+    await api.start()
+
+    application = bot.build_application(BOT_TOKEN, base_url=api.base_url)
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'python_telegram_bot': telegram.__version__,
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+    }
+
+    async with application:
+        # Niente post_init: scheduler, storage e lease non servono alla misura
+        application.bot_data['broadcaster'] = Broadcaster(global_rate=args.rate, concurrency=args.concurrency)
+
+        print(f"\n== Latenza handler ({args.users} utenti, concorrenza {args.handler_concurrency}) ==")
+        report['handlers'] = await measure_handlers(application, args.users, args.handler_concurrency)
+        for name, stats in report['handlers'].items():
+            print(f"  {name:<16} p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  "
+                  f"p99 {stats['p99_ms']:>8.2f} ms  max {stats['max_ms']:>8.2f} ms")
+
+        api.flood_rate = args.flood_rate
+        api.forbidden_rate = args.forbidden_rate
+        print(f"\n== Broadcast {args.job} (rate {args.rate:g} msg/s, concorrenza {args.concurrency}) ==")
+        report['broadcasts'] = []
+        for size in args.sizes:
+            result = await measure_broadcast(application, args.job, size)
+            report['broadcasts'].append(result)
+            print(f"  {size:>7} utenti  {result['seconds']:>8.2f} s  {result['messages_per_second']:>8.0f} msg/s  "
+                  f"inviati {result['sent']}  bloccati {result['forbidden']}  "
+                  f"429 {result['retry_after']}  falliti {result['failed']}")
+
+        # Con la coda di invio i 429 vengono ritentati lì, non dal broadcaster
+        if application.bot.rate_limiter is not None:
+            report['outbound'] = application.bot.rate_limiter.stats()
+
+    report['api'] = {
+        'calls': len(api.calls),
+        'errors': {f"{endpoint} {status}": count for (endpoint, status), count in sorted(api.errors.items())},
+    }
+    await api.stop()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Report: {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
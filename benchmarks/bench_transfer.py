@@ -0,0 +1,134 @@
+"""
+Benchmark: export/import in blocco di profili e impostazioni (bot.py esporta / importa)
+
+Per ogni dimensione crea un database SQLite con N utenti (profilo completo e
+impostazioni), esporta in JSONL (e in Parquet se pyarrow è installato),
+reimporta in un database vuoto e controlla che i dati coincidano. Riporta
+righe al secondo e, con --memory, il picco di memoria Python (tracemalloc) di
+ogni passaggio: con lo streaming a blocchi non deve crescere con N.
+
+Uso:
+    python benchmarks/bench_transfer.py [--sizes 100000 1000000] [--memory]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_profiles import profiles  # noqa: E402
+from storage import connect, write_records  # noqa: E402
+from transfer import DEFAULT_CHUNK_SIZE, export_records, import_records  # noqa: E402
+
+TIMEZONES = ('Europe/Rome', 'Europe/London', 'America/New_York', 'Asia/Tokyo')
+SAMPLE = 2_000
+
+
+def make_settings(rng):
+    return {
+        'notifications': rng.random() > 0.1,
+        'reminder_morning': True,
+        'reminder_evening': rng.random() > 0.3,
+        'reminder_weekly': True,
+        'timezone': rng.choice(TIMEZONES),
+        'morning_time': f"{rng.randint(5, 10):02d}:{rng.choice((0, 15, 30, 45)):02d}",
+    }
+
+
+def build_database(path, count):
+    rng = random.Random(7)
+    conn = connect(path)
+    records = profiles(count)
+    while True:
+        chunk = [record for _, record in zip(range(DEFAULT_CHUNK_SIZE), records)]
+        if not chunk:
+            break
+        batch = {
+            'profiles': [(user_id, json.dumps(profile)) for user_id, profile in chunk],
+            'settings': [(user_id, json.dumps(make_settings(rng))) for user_id, _ in chunk],
+        }
+        with conn:
+            write_records(conn, batch, 'bench', time.time())
+    conn.close()
+
+
+def sample(path, user_ids):
+    conn = sqlite3.connect(path)
+    found = {}
+    for user_id in user_ids:
+        for namespace in ('profiles', 'settings'):
+            # Con il namespace la ricerca usa la chiave primaria (solo `key` scansiona la tabella)
+            row = conn.execute(
+                "SELECT data FROM records WHERE namespace = ? AND key = ?", (namespace, user_id)
+            ).fetchone()
+            if row is not None:
+                found[(namespace, user_id)] = json.loads(row[0])
+    conn.close()
+    return found
+
+
+def traced(func, *args):
+    """(statistiche, picco tracemalloc in byte)"""
+    tracemalloc.start()
+    stats = func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return stats, peak
+
+
+def has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--memory', action='store_true', help="ripete i passaggi con tracemalloc (più lento)")
+    args = parser.parse_args()
+
+    formats = ['jsonl'] + (['parquet'] if has_pyarrow() else [])
+    if len(formats) == 1:
+        print("pyarrow non installato: solo JSONL")
+
+    for count in args.sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            source = os.path.join(workdir, 'source.db')
+            start = time.perf_counter()
+            build_database(source, count)
+            print(f"\n{count} utenti (database creato in {time.perf_counter() - start:.1f} s, "
+                  f"{os.path.getsize(source) / 2**20:.0f} MB)")
+            user_ids = random.Random(3).sample(range(100_000_000, 100_000_000 + count), min(SAMPLE, count))
+            expected = sample(source, user_ids)
+
+            for fmt in formats:
+                dump = os.path.join(workdir, f"dump.{fmt}")
+                target = os.path.join(workdir, f"target-{fmt}.db")
+                exported = export_records(source, dump)
+                imported = import_records(target, dump)
+                if imported.rows != count or imported.rejected or sample(target, user_ids) != expected:
+                    raise RuntimeError(f"{fmt}: i dati reimportati non coincidono")
+                print(f"  {fmt:<8} export {exported.elapsed:>5.1f} s {exported.rate:>9.0f} righe/s   "
+                      f"import {imported.elapsed:>5.1f} s {imported.rate:>9.0f} righe/s   "
+                      f"file {os.path.getsize(dump) / 2**20:>5.0f} MB")
+
+                if args.memory:
+                    os.remove(target)
+                    _, export_peak = traced(export_records, source, dump)
+                    _, import_peak = traced(import_records, target, dump)
+                    print(f"  {'':<8} picco memoria: export {export_peak / 2**20:.1f} MB, "
+                          f"import {import_peak / 2**20:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
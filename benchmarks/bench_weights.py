@@ -0,0 +1,110 @@
+"""
+Benchmark: storico del peso (weights.WeightSeries) contro una lista di dict
+
+Per ogni pesata aggiunta calcola media mobile a 7 giorni e variazione
+settimanale, come fanno /setpeso (ricalcolo automatico) e /trend:
+- lista di {'date', 'weight'} riscandita a ogni pesata (O(n))
+- WeightSeries con finestre incrementali (O(1) ammortizzato)
+
+Misura anche la memoria dello storico per utente.
+
+Uso:
+    python benchmarks/bench_weights.py [--days 730] [--users 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from weights import WINDOW_DAYS, WeightSeries  # noqa: E402
+
+
+def history(days, seed):
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    weight = rng.uniform(65, 95)
+    for day in range(days):
+        weight += rng.uniform(-0.4, 0.35)
+        yield start + timedelta(days=day), round(weight, 1)
+
+
+def scan_stats(entries):
+    """Come farebbe un handler senza stato: riscandisce tutte le pesate"""
+    last = entries[-1]['date']
+    current = [e['weight'] for e in entries if (last - e['date']).days < WINDOW_DAYS]
+    previous = [e['weight'] for e in entries if WINDOW_DAYS <= (last - e['date']).days < 2 * WINDOW_DAYS]
+    average = sum(current) / len(current)
+    delta = average - sum(previous) / len(previous) if previous else None
+    return average, delta
+
+
+def run_list(users, days):
+    start = time.perf_counter()
+    for user in range(users):
+        entries = []
+        for day, weight in history(days, user):
+            entries.append({'date': day, 'weight': weight})
+            scan_stats(entries)
+    return time.perf_counter() - start
+
+
+def run_series(users, days):
+    start = time.perf_counter()
+    for user in range(users):
+        series = WeightSeries()
+        for day, weight in history(days, user):
+            series.add(day, weight)
+            series.rolling_average, series.weekly_delta
+    return time.perf_counter() - start
+
+
+def memory(build, users, days):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(user, days) for user in range(users)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used / users
+
+
+def build_list(user, days):
+    return [{'date': day, 'weight': weight} for day, weight in history(days, user)]
+
+
+def build_series(user, days):
+    series = WeightSeries()
+    for day, weight in history(days, user):
+        series.add(day, weight)
+    return series
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=730, help="pesate per utente (una al giorno)")
+    parser.add_argument('--users', type=int, default=200)
+    args = parser.parse_args()
+
+    pesate = args.users * args.days
+    # Il riscandire è quadratico: lo si misura su meno utenti e si riporta per pesata
+    scan_users = max(1, args.users // 20)
+    scanned = run_list(scan_users, args.days) / (scan_users * args.days)
+    incremental = run_series(args.users, args.days) / pesate
+    print(f"\n{args.days} pesate per utente")
+    print(f"  lista + riscansione  {scanned * 1e6:>9.2f} µs/pesata")
+    print(f"  WeightSeries         {incremental * 1e6:>9.2f} µs/pesata  ({scanned / incremental:.0f}x)")
+
+    list_bytes = memory(build_list, scan_users, args.days)
+    series_bytes = memory(build_series, scan_users, args.days)
+    print(f"  memoria lista        {list_bytes / 1024:>9.1f} KiB/utente")
+    print(f"  memoria WeightSeries {series_bytes / 1024:>9.1f} KiB/utente  ({list_bytes / series_bytes:.0f}x meno)")
+
+
+if __name__ == '__main__':
+    main()
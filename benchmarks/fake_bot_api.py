@@ -0,0 +1,144 @@
+"""
+Stand-in HTTP locale della Bot API di Telegram
+
+Risponde su http://127.0.0.1:<port>/bot<token>/<metodo> come l'API vera,
+registra ogni chiamata con il timestamp e permette di attendere la prossima
+risposta inviata a una chat (per misurare la latenza richiesta -> risposta).
+
+Gira su un thread con un proprio event loop, così il costo del server finto
+non si somma a quello del bot che si sta misurando.
+
+Simulazione di rete e limiti (solo per i metodi send*/edit*):
+- latency / jitter: ritardo di ogni risposta (secondi)
+- flood_rate: probabilità di un 429 "Too Many Requests" con retry_after
+- forbidden_rate: quota di chat che hanno bloccato il bot (403, sempre le stesse)
+
+Uso come base_url del bot:  http://127.0.0.1:<port>/bot
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+
+from aiohttp import web
+
+from fake_telegram import fake_result
+
+
+class FakeBotAPI:
+    """Server aiohttp che imita la Bot API e registra le chiamate"""
+
+    def __init__(self, host='127.0.0.1', port=8081, latency=0.0, jitter=0.0,
+                 flood_rate=0.0, retry_after=1, forbidden_rate=0.0, seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.forbidden_rate = forbidden_rate
+        self.seed = seed
+        self.calls = []
+        self.errors = Counter()   # (metodo, codice HTTP) -> risposte di errore simulate
+        self._random = random.Random(seed)
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    def wait_for_reply(self, chat_id):
+        """Future (del loop chiamante) risolta al prossimo messaggio inviato a chat_id"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._waiters.setdefault(chat_id, []).append((loop, future))
+        return future
+
+    def count(self, endpoint):
+        with self._lock:
+            return sum(1 for name, _, _ in self.calls if name == endpoint)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+
+    def is_forbidden(self, chat_id):
+        """Le chat "bloccate" sono deterministiche: stessa chat, stesso esito"""
+        return self.forbidden_rate > 0 and random.Random(chat_id * 7919 + self.seed).random() < self.forbidden_rate
+
+    def _simulated_error(self, endpoint, chat_id):
+        if not endpoint.startswith(('send', 'edit')):
+            return None
+        if self.flood_rate and self._random.random() < self.flood_rate:
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': f'Too Many Requests: retry after {self.retry_after}',
+                         'parameters': {'retry_after': self.retry_after}}
+        if self.is_forbidden(chat_id):
+            return 403, {'ok': False, 'error_code': 403,
+                         'description': 'Forbidden: bot was blocked by the user'}
+        return None
+
+    def _resolve(self, chat_id, now):
+        with self._lock:
+            waiters = self._waiters.get(chat_id)
+            if not waiters:
+                return
+            loop, future = waiters.pop(0)
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(now))
+
+    async def handle(self, request):
+        endpoint = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._random.random() * self.jitter)
+        now = time.perf_counter()
+        chat_id = int(params.get('chat_id', 0) or 0)
+        with self._lock:
+            self.calls.append((endpoint, params, now))
+
+        error = self._simulated_error(endpoint, chat_id)
+        if error is not None:
+            status, body = error
+            with self._lock:
+                self.errors[(endpoint, status)] += 1
+            return web.json_response(body, status=status)
+
+        if endpoint in ('sendMessage', 'editMessageText'):
+            self._resolve(chat_id, now)
+
+        return web.json_response({'ok': True, 'result': fake_result(endpoint, params)})
+
+    def _serve(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        self._loop.run_until_complete(web.TCPSite(self._runner, self.host, self.port).start())
+        ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    async def start(self):
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(ready,), daemon=True)
+        self._thread.start()
+        await asyncio.to_thread(ready.wait)
+
+    async def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            await asyncio.to_thread(self._thread.join)
@@ -0,0 +1,127 @@
+"""
+Stand-in in-process della Bot API di Telegram per benchmark locali
+
+FakeRequest sostituisce il layer HTTP di python-telegram-bot: nessuna rete,
+ogni chiamata viene registrata e riceve una risposta plausibile, e come
+FakeBotAPI si può attendere la prossima risposta inviata a una chat.
+Le funzioni make_*_update costruiscono Update sintetici da dare agli handler.
+"""
+
+import asyncio
+import itertools
+import json
+import time
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+BOT_ID = 1000000
+BOT_TOKEN = f"{BOT_ID}:FAKE-TOKEN"
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+class FakeRequest(BaseRequest):
+    """BaseRequest che risponde localmente e registra le chiamate"""
+
+    def __init__(self):
+        self.calls = []
+        self._waiters = {}
+
+    def wait_for_reply(self, chat_id):
+        """Future risolta (con il perf_counter) al prossimo messaggio inviato a chat_id"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append(future)
+        return future
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((endpoint, params))
+        if endpoint in ('sendMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            waiters = self._waiters.get(chat_id)
+            if waiters:
+                future = waiters.pop(0)
+                if not waiters:
+                    del self._waiters[chat_id]
+                if not future.done():
+                    future.set_result(time.perf_counter())
+        result = fake_result(endpoint, params)
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def fake_result(endpoint, params):
+    """Risultato plausibile di un metodo della Bot API"""
+    if endpoint == 'getMe':
+        return {'id': BOT_ID, 'is_bot': True, 'first_name': 'WinterGrindBot',
+                'username': 'WinterGrindBot'}
+    if endpoint in ('sendMessage', 'editMessageText'):
+        return {
+            'message_id': next(_message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+            'text': params.get('text', ''),
+        }
+    if endpoint == 'getUpdates':
+        return []
+    return True
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'Utente{user_id}'}
+
+
+def _message(user_id, text):
+    message = {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return message
+
+
+def text_update_data(user_id, text):
+    """JSON di un update con un messaggio di testo (o comando, se inizia con '/')"""
+    return {'update_id': next(_update_ids), 'message': _message(user_id, text)}
+
+
+def callback_update_data(user_id, callback_data):
+    """JSON di un update con una callback query da tastiera inline"""
+    return {
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_update_ids)),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': callback_data,
+            'message': {
+                'message_id': next(_message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'WinterGrindBot'},
+                'text': '...',
+            },
+        },
+    }
+
+
+def make_text_update(bot, user_id, text):
+    return Update.de_json(text_update_data(user_id, text), bot)
+
+
+def make_callback_update(bot, user_id, callback_data):
+    return Update.de_json(callback_update_data(user_id, callback_data), bot)
@@ -0,0 +1,104 @@
+"""
+Harness locale per la modalità webhook: latenza richiesta -> risposta senza Telegram
+
+Avvia il bot reale (build_application + run_webhook) puntato a una Bot API
+finta (benchmarks/fake_bot_api.py), poi invia via POST al webhook update
+sintetici con il secret token e misura il tempo fino alla sendMessage di
+risposta ricevuta dalla Bot API finta.
+
+Uso:
+    python benchmarks/webhook_harness.py [--requests 2000] [--concurrency 50] [--command /oggi]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+# Il limite di 30 msg/s della coda di invio è quello di produzione, non va misurato qui
+os.environ.setdefault('OUTBOUND_RATE', '1000000')
+
+import aiohttp  # noqa: E402
+
+import bot  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from fake_telegram import BOT_TOKEN, text_update_data  # noqa: E402
+from webhook import SECRET_HEADER, run_webhook  # noqa: E402
+from webserver import WebServer  # noqa: E402
+
+SECRET = 'harness-secret'
+
+# Una riga di log per ogni richiesta HTTP falserebbe la misura
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--command', default='/oggi')
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--webhook-port', type=int, default=8088)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(port=args.api_port)
+    await api.start()
+
+    application = bot.build_application(BOT_TOKEN, base_url=api.base_url)
+    server = WebServer('127.0.0.1', args.webhook_port)
+    webhook_url = f"http://127.0.0.1:{args.webhook_port}/telegram"
+    bot_task = asyncio.create_task(run_webhook(
+        application, server, url=webhook_url, secret=SECRET,
+        path='/telegram', allowed_updates=bot.ALLOWED_UPDATES
+    ))
+    while not api.count('setWebhook'):
+        await asyncio.sleep(0.05)
+
+    latencies = []
+    rejected = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with aiohttp.ClientSession() as session:
+        # Una richiesta senza secret deve essere rifiutata
+        async with session.post(webhook_url, json=text_update_data(1, args.command)) as response:
+            rejected = response.status
+
+        async def one(user_id):
+            async with semaphore:
+                reply = api.wait_for_reply(user_id)
+                start = time.perf_counter()
+                async with session.post(webhook_url, json=text_update_data(user_id, args.command),
+                                        headers={SECRET_HEADER: SECRET}) as response:
+                    response.raise_for_status()
+                latencies.append((await reply - start) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(user_id) for user_id in range(1, args.requests + 1)))
+        elapsed = time.perf_counter() - started
+
+    bot_task.cancel()
+    try:
+        await bot_task
+    except asyncio.CancelledError:
+        pass
+    await api.stop()
+
+    print(f"\nWebhook {args.command}: {args.requests} richieste, concorrenza {args.concurrency}")
+    print(f"  senza secret token -> HTTP {rejected}")
+    print(f"  throughput  {args.requests / elapsed:.0f} update/s")
+    print(f"  latenza     p50 {statistics.median(latencies):.2f} ms  p95 {percentile(latencies, 95):.2f} ms  "
+          f"p99 {percentile(latencies, 99):.2f} ms  max {max(latencies):.2f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
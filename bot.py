@@ -12,22 +12,63 @@ import json
 import logging
 import os
 from dotenv import load_dotenv
-import base64
-from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+from datetime import datetime, timezone
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+    WebAppInfo,
+)
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     ContextTypes,
     MessageHandler,
     ConversationHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
 )
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+import argparse
+import asyncio
+import hashlib
 import sys
+import time
+from urllib.parse import quote
 from telegram.error import Conflict
+from activity import ActivityTracker, parse_batch
+from broadcast import Broadcaster
+from delivery import DeliveryHealth
+from flood import DEFAULT_BURST, DEFAULT_MAX_USERS, DEFAULT_RATE, FloodControl, classify_update
+from journal import BroadcastJournal
+from metrics import JOB_DURATION, JOB_START_DELAY, REGISTRY, THROTTLED, instrument_handlers, metrics_handler
+from outbound import OutboundQueue
+from persistence import SQLitePersistence
+from reports import ReportQueue, render_report, week_stats
+from nutrition import calculate_bmr, calculate_macros, calculate_tdee
+from profiles import ProfileStore
+from leader import DEFAULT_LEASE_TTL, LeaderElection, default_instance_id
+from storage import create_storage
+from app_bundle import DEFAULT_OUTPUT, add_bundle_routes, build_bundle
+from codec import encode_app_data
+from subscribers import SubscriberIndex, is_subscribed
+from state_api import MiniAppStates, add_state_routes
+from sync import AppStateTracker
+from update_processor import PerUserUpdateProcessor
+from weights import WeightSeries, sparkline
+from transfer import DEFAULT_CHUNK_SIZE, FORMATS, export_records, import_records
+from timing_wheel import (
+    DEFAULT_EVENING_TIME,
+    DEFAULT_MORNING_TIME,
+    ReminderSchedule,
+    get_timezone,
+    parse_time,
+)
 
 # Carica le variabili d'ambiente dal file .env
 load_dotenv()
@@ -35,6 +76,71 @@ load_dotenv()
 # ============ CONFIGURAZIONE ============
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 MINI_APP_URL = os.getenv("MINI_APP_URL")
+# URL pubblico da cui la Mini App raggiunge l'API dello stato servita dal bot (vuoto = disattivata)
+APP_API_URL = os.getenv("APP_API_URL")
+# Cartella del bundle compilato con `python bot.py compila-app`: se impostata il bot serve la Mini App da /miniapp/
+MINI_APP_BUNDLE = os.getenv("MINI_APP_BUNDLE")
+
+# Broadcast promemoria (limiti Telegram: ~30 msg/s globali, ~1 msg/s per chat)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "30"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+
+# Storage persistente ('sqlite' o 'memory')
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+DATABASE_PATH = os.getenv("DATABASE_PATH", "wintergrind.db")
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "2"))
+
+# Modalità webhook (se WEBHOOK_URL è impostato, altrimenti polling)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Di default derivato dal token: uguale su tutte le repliche dietro il load balancer
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.getenv("PORT", "8080"))
+
+# Update elaborati in parallelo (in ordine per lo stesso utente)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+# Connessioni HTTP verso la Bot API (default PTB: 1, troppo poche con update concorrenti)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "8"))
+
+# Multi-istanza: identità della replica e durata del lease del leader dei promemoria
+INSTANCE_ID = os.getenv("INSTANCE_ID") or default_instance_id()
+LEASE_TTL = float(os.getenv("LEASE_TTL", str(DEFAULT_LEASE_TTL)))
+
+# Endpoint /metrics (formato Prometheus); METRICS_PORT=0 lo disattiva
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+
+# Utenti abilitati ai comandi di amministrazione (es: ADMIN_IDS=123,456)
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(',') if user_id.strip()}
+
+# Coda di invio con priorità (risposte prima dei broadcast) e limite globale condiviso
+OUTBOUND_QUEUE = os.getenv("OUTBOUND_QUEUE", "1") != "0"
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "30"))
+
+# Flood control per utente: token al secondo, picco e utenti tracciati (FLOOD_RATE=0 lo disattiva)
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", str(DEFAULT_RATE)))
+FLOOD_BURST = float(os.getenv("FLOOD_BURST", str(DEFAULT_BURST)))
+FLOOD_MAX_USERS = int(os.getenv("FLOOD_MAX_USERS", str(DEFAULT_MAX_USERS)))
+
+# Ricalcolo automatico delle macro quando la media mobile del peso si sposta di almeno N kg
+WEIGHT_READJUST_KG = float(os.getenv("WEIGHT_READJUST_KG", "0.5"))
+
+# Report settimanale: preparato N minuti prima dell'invio (0 = al momento), spool in RAM fino a N MB
+REPORT_LEAD_MINUTES = int(os.getenv("REPORT_LEAD_MINUTES", "30"))
+REPORT_MEMORY_MB = float(os.getenv("REPORT_MEMORY_MB", "8"))
+
+# Broadcast interrotti (crash, cambio di leader) ripresi entro N minuti dall'orario programmato
+BROADCAST_RESUME_MINUTES = float(os.getenv("BROADCAST_RESUME_MINUTES", "30"))
+
+# Fuso orario di default per i promemoria (nome IANA)
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "Europe/Rome")
+
+# Argomenti di /notifiche -> tipo di promemoria
+REMINDER_ARGS = {'mattina': 'morning', 'sera': 'evening', 'settimanale': 'weekly'}
+
+# Solo i tipi di update che il bot gestisce (i dati della Mini App arrivano come message)
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
 # Stati per ConversationHandler
 SETUP_NAME, SETUP_WEIGHT, SETUP_HEIGHT, SETUP_AGE, SETUP_GOAL, SETUP_ACTIVITY = range(6)
@@ -46,67 +152,79 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Database in memoria (sostituire con DB reale in produzione)
-user_profiles = {}
+# Cache in memoria, resa persistente dallo storage in write-behind
+user_profiles = ProfileStore()   # colonnare: user_id -> vista dict-like del profilo
 user_settings = {}
+app_states = {}
+weight_history = {}   # user_id -> WeightSeries
+activity_states = {}
+miniapp_states = {}   # user_id -> stato della Mini App salvato via API
+delivery_chats = {}   # chat_id -> chat morta o in backoff
+delivery_days = {}    # yyyymmdd -> esiti degli invii del giorno
+
+storage = create_storage(STORAGE_BACKEND, DATABASE_PATH, STORAGE_FLUSH_INTERVAL, INSTANCE_ID)
+storage.register('profiles', user_profiles, encode=dict)
+storage.register('settings', user_settings)
+storage.register('app_state', app_states)
+storage.register('weights', weight_history, encode=WeightSeries.to_dict, decode=WeightSeries.from_dict)
+storage.register('activity', activity_states)
+storage.register('miniapp', miniapp_states)
+storage.register('delivery', delivery_chats)
+storage.register('delivery_days', delivery_days)
+
+# Versioni dello stato inviato alla Mini App (delta sync)
+app_state = AppStateTracker(app_states)
+
+# Stato della Mini App salvato tramite l'API HTTP (ETag = versione)
+miniapp = MiniAppStates(miniapp_states, on_change=lambda user_id: storage.touch('miniapp', user_id))
+
+# Punti settimanali e streak dagli eventi della Mini App
+activity = ActivityTracker(activity_states)
+
+# Indice degli iscritti per tipo di promemoria (aggiornato a ogni modifica)
+subscribers = SubscriberIndex()
+
+# Esiti degli invii: le chat che hanno bloccato il bot escono dai promemoria
+delivery = DeliveryHealth(delivery_chats, delivery_days, on_change=storage.touch)
+delivery.on_dead = subscribers.remove
+
+# Token bucket per utente davanti a tutti gli handler (gli admin sono esclusi)
+flood = FloodControl(FLOOD_RATE, FLOOD_BURST, FLOOD_MAX_USERS, exempt=ADMIN_IDS)
+
+# Orari dei promemoria per utente (timing wheel a bucket di un minuto, in UTC)
+reminder_schedule = ReminderSchedule(user_settings, DEFAULT_TIMEZONE)
+
+# Solo il leader invia i promemoria (lease nello stesso file SQLite dello storage)
+election = LeaderElection(
+    DATABASE_PATH if STORAGE_BACKEND.lower() == 'sqlite' else None,
+    ttl=LEASE_TTL,
+    instance_id=INSTANCE_ID
+)
+election.on_elected = reminder_schedule.resume
+
+# Journal delle consegne di ogni run di promemoria, per riprendere gli invii interrotti
+journal = BroadcastJournal(
+    DATABASE_PATH if STORAGE_BACKEND.lower() == 'sqlite' else None,
+    freshness=BROADCAST_RESUME_MINUTES * 60
+)
 
 # Scheduler
 scheduler = AsyncIOScheduler()
 
+# Metriche calcolate solo alla lettura di /metrics
+REGISTRY.gauge('wintergrind_profiles', "Profili in memoria", lambda: len(user_profiles))
+REGISTRY.gauge('wintergrind_settings', "Impostazioni utente in memoria", lambda: len(user_settings))
+REGISTRY.gauge('wintergrind_subscribers', "Iscritti per tipo di promemoria",
+               lambda: {reminder_type: subscribers.count(reminder_type) for reminder_type in REMINDER_JOBS},
+               ('reminder',))
+REGISTRY.gauge('wintergrind_storage_pending', "Record in attesa di flush", lambda: storage.pending)
+REGISTRY.gauge('wintergrind_dead_chats', "Chat escluse dai promemoria (bot bloccato o chat inesistente)",
+               lambda: delivery.dead_count)
+REGISTRY.gauge('wintergrind_flood_users', "Utenti con un bucket del flood control", lambda: len(flood))
+REGISTRY.gauge('wintergrind_leader', "1 se l'istanza invia i promemoria", lambda: int(election.is_leader))
 
-# ============ FUNZIONI CALCOLO ============
-
-def calculate_bmr(weight, height, age, gender='male'):
-    """Calcola il metabolismo basale (BMR)"""
-    if gender.lower() == 'male':
-        # Formula Mifflin-St Jeor per uomini
-        bmr = (10 * weight) + (6.25 * height) - (5 * age) + 5
-    else:
-        # Formula per donne
-        bmr = (10 * weight) + (6.25 * height) - (5 * age) - 161
-    return bmr
-
-
-def calculate_tdee(bmr, activity_level):
-    """Calcola il dispendio energetico totale giornaliero"""
-    multipliers = {
-        'sedentary': 1.2,      # Poco o nessun esercizio
-        'light': 1.375,        # Esercizio leggero 1-3 giorni/settimana
-        'moderate': 1.55,      # Esercizio moderato 3-5 giorni/settimana
-        'active': 1.725,       # Esercizio intenso 6-7 giorni/settimana
-        'very_active': 1.9     # Esercizio molto intenso, lavoro fisico
-    }
-    return bmr * multipliers.get(activity_level, 1.55)
-
-
-def calculate_macros(calories, goal='bulk'):
-    """Calcola le macro in base all'obiettivo"""
-    if goal == 'bulk':
-        # Massa: +10% calorie, alto protein, medio carb
-        target_cal = int(calories * 1.1)
-        protein = int((target_cal * 0.30) / 4)  # 30% proteine
-        carbs = int((target_cal * 0.45) / 4)    # 45% carboidrati
-        fats = int((target_cal * 0.25) / 9)     # 25% grassi
-    elif goal == 'cut':
-        # Definizione: -20% calorie, alto protein, basso carb
-        target_cal = int(calories * 0.8)
-        protein = int((target_cal * 0.40) / 4)  # 40% proteine
-        carbs = int((target_cal * 0.30) / 4)    # 30% carboidrati
-        fats = int((target_cal * 0.30) / 9)     # 30% grassi
-    else:  # maintain
-        # Mantenimento
-        target_cal = int(calories)
-        protein = int((target_cal * 0.30) / 4)
-        carbs = int((target_cal * 0.40) / 4)
-        fats = int((target_cal * 0.30) / 9)
-    
-    return {
-        'calories': target_cal,
-        'protein': protein,
-        'carbs': carbs,
-        'fats': fats
-    }
 
+# ============ FUNZIONI CALCOLO ============
 
 def get_workout_for_day(day_name):
     """Ritorna l'allenamento programmato"""
@@ -122,6 +240,82 @@ def get_workout_for_day(day_name):
     return workouts.get(day_name.lower(), 'Riposo')
 
 
+def mini_app_url(app_data=None):
+    """URL della Mini App con i dati codificati nel parametro ?data= (e l'API dello stato in ?api=)"""
+    params = []
+    if app_data:
+        params.append(f"data={encode_app_data(app_data)}")
+    if APP_API_URL:
+        params.append(f"api={quote(APP_API_URL.rstrip('/'), safe='')}")
+    return f"{MINI_APP_URL}?{'&'.join(params)}" if params else MINI_APP_URL
+
+
+def app_link(user_id, app_data=None):
+    """Registra le modifiche allo stato dell'app e ritorna il link con il solo delta non confermato"""
+    if app_data:
+        app_state.update(user_id, app_data)
+        storage.touch('app_state', user_id)
+    return mini_app_url(app_state.delta(user_id))
+
+
+def sync_reminders(user_id):
+    """Riallinea indice iscritti e orari dei promemoria alle impostazioni dell'utente"""
+    settings = user_settings[user_id]
+    subscribers.update(user_id, settings)
+    reminder_schedule.update(user_id, settings)
+
+
+def on_remote_settings(user_id, settings):
+    """Impostazioni modificate da un'altra istanza: riallinea promemoria locali"""
+    if settings is None:
+        subscribers.remove(user_id)
+        reminder_schedule.remove(user_id)
+    else:
+        sync_reminders(user_id)
+
+
+storage.on_change('settings', on_remote_settings)
+
+
+# ============ STORICO PESO ============
+
+def apply_weight(user_id, weight):
+    """Aggiorna il peso del profilo e ricalcola BMR/TDEE/macro; ritorna le nuove macro"""
+    profile = user_profiles[user_id]
+    profile['weight'] = weight
+    bmr = calculate_bmr(weight, profile['height'], profile['age'])
+    tdee = calculate_tdee(bmr, profile['activity'])
+    macros = calculate_macros(tdee, profile['goal'])
+    profile['bmr'] = bmr
+    profile['tdee'] = tdee
+    profile['macros'] = macros
+    storage.touch('profiles', user_id)
+    # Le nuove macro arriveranno all'app con il prossimo link
+    app_state.update(user_id, {'macros': macros})
+    storage.touch('app_state', user_id)
+    return macros
+
+
+def record_weight(user_id, weight, readjust=True):
+    """Aggiunge la pesata di oggi allo storico; con `readjust` ricalcola le macro
+    se la media mobile si è spostata di almeno WEIGHT_READJUST_KG dal peso del profilo.
+    Ritorna la serie e le nuove macro (None se non ricalcolate)."""
+    series = weight_history.get(user_id)
+    if series is None:
+        series = weight_history[user_id] = WeightSeries()
+    today = datetime.now(reminder_schedule.timezone_of(user_id)).date()
+    series.add(today, weight)
+    storage.touch('weights', user_id)
+    report_queue.touch(user_id)
+    profile = user_profiles.get(user_id)
+    if not readjust or profile is None:
+        return series, None
+    average = round(series.rolling_average, 1)
+    if abs(average - profile['weight']) < WEIGHT_READJUST_KG:
+        return series, None
+    return series, apply_weight(user_id, average)
+
+
 # ============ SETUP INIZIALE ============
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -132,7 +326,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Controlla se l'utente ha già un profilo
     if user_id in user_profiles:
         keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton("🔥 Apri Winter Grind", web_app=WebAppInfo(url=MINI_APP_URL))
+            InlineKeyboardButton("🔥 Apri Winter Grind", web_app=WebAppInfo(url=mini_app_url()))
         ]])
         
         await update.message.reply_text(
@@ -298,13 +492,17 @@ async def setup_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'created_at': datetime.now().isoformat()
     }
     
-    # Abilita notifiche di default
-    user_settings[user_id] = {
+    # Abilita notifiche di default (mantiene fuso e orari già scelti)
+    user_settings.setdefault(user_id, {}).update({
         'notifications': True,
         'reminder_morning': True,
         'reminder_evening': True,
         'reminder_weekly': True
-    }
+    })
+    storage.touch('profiles', user_id)
+    storage.touch('settings', user_id)
+    sync_reminders(user_id)
+    record_weight(user_id, data['weight'], readjust=False)
     
     goal_emoji = {'bulk': '💪', 'cut': '🔥', 'maintain': '⚖️'}
     
@@ -314,12 +512,11 @@ async def setup_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'userName': data['name'],
         'goal': data['goal']
     }
-    encoded = base64.b64encode(json.dumps(app_data).encode()).decode()
     
     keyboard = InlineKeyboardMarkup([[
         InlineKeyboardButton(
             "🔥 Apri Winter Grind",
-            web_app=WebAppInfo(url=f"{MINI_APP_URL}?data={encoded}")
+            web_app=WebAppInfo(url=app_link(user_id, app_data))
         )
     ]])
     
@@ -368,6 +565,8 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /profilo - Vedi il tuo profilo
 /macros - Mostra le tue macro
 /notifiche - Gestisci promemoria
+/orari <HH:MM> [HH:MM] - Orari promemoria (es: /orari 07:30 21:00)
+/fuso <fuso> - Fuso orario (es: /fuso Europe/Rome)
 
 *🛠️ Modifica Dati App:*
 /setsettimana <N> - Imposta settimana (es: /setsettimana 5)
@@ -379,6 +578,7 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 *📊 Personalizzazione:*
 /cambiaobiettivo - Cambia obiettivo (bulk/cut/maintain)
 /cambiapeso - Aggiorna peso
+/trend - Andamento del peso
 /ricalcola - Ricalcola macro
 
 *❓ Altro:*
@@ -402,15 +602,18 @@ async def app_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'goal': profile['goal']
         }
     
-    encoded = base64.b64encode(json.dumps(app_data).encode()).decode()
-    url = f"{MINI_APP_URL}?data={encoded}" if app_data else MINI_APP_URL
+    url = app_link(user_id, app_data)
     
-    keyboard = InlineKeyboardMarkup([[
-        InlineKeyboardButton("🔥 Apri App", web_app=WebAppInfo(url=url))
-    ]])
+    # Pulsante della tastiera (non inline): solo così l'app può inviare i progressi al bot
+    keyboard = ReplyKeyboardMarkup(
+        [[KeyboardButton("🔥 Winter Grind", web_app=WebAppInfo(url=url))]],
+        resize_keyboard=True,
+        is_persistent=True
+    )
     
     await update.message.reply_text(
-        "Clicca per aprire Winter Grind 💪",
+        "Clicca il pulsante qui sotto per aprire Winter Grind 💪\n\n"
+        "Da lì puoi inviare i tuoi progressi al bot con 📤",
         reply_markup=keyboard
     )
 
@@ -465,7 +668,7 @@ async def macros_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     macros = user_profiles[user_id]['macros']
     
     keyboard = InlineKeyboardMarkup([[
-        InlineKeyboardButton("📱 Apri App", web_app=WebAppInfo(url=MINI_APP_URL))
+        InlineKeyboardButton("📱 Apri App", web_app=WebAppInfo(url=mini_app_url()))
     ]])
     
     await update.message.reply_text(
@@ -490,11 +693,14 @@ async def oggi_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     }
     
     keyboard = InlineKeyboardMarkup([[
-        InlineKeyboardButton("✅ Segna Completato", web_app=WebAppInfo(url=MINI_APP_URL))
+        InlineKeyboardButton("✅ Segna Completato", web_app=WebAppInfo(url=mini_app_url()))
     ]])
     
+    summary = activity.summary(update.effective_user.id)
+    progress = f"📊 Settimana: {summary['points']}/100 punti\n\n" if summary else ""
+    
     await update.message.reply_text(
-        f"📅 *Oggi è {day_names.get(today, 'oggi')}*\n\n{workout}\n\n"
+        f"📅 *Oggi è {day_names.get(today, 'oggi')}*\n\n{workout}\n\n{progress}"
         f"Hai già completato l'allenamento? 💪",
         parse_mode='Markdown',
         reply_markup=keyboard
@@ -505,15 +711,19 @@ async def oggi_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def set_settimana_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Imposta settimana - /setsettimana 5"""
+    user_id = update.effective_user.id
+    
     try:
         week_num = int(context.args[0])
         data = {'currentWeek': week_num}
-        encoded = base64.b64encode(json.dumps(data).encode()).decode()
+        activity.set_week(user_id, week_num)
+        storage.touch('activity', user_id)
+        report_queue.touch(user_id)
         
         keyboard = InlineKeyboardMarkup([[
             InlineKeyboardButton(
                 "📱 Apri App (Settimana Aggiornata)",
-                web_app=WebAppInfo(url=f"{MINI_APP_URL}?data={encoded}")
+                web_app=WebAppInfo(url=app_link(user_id, data))
             )
         ]])
         
@@ -532,15 +742,16 @@ async def set_settimana_command(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def add_sgarro_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Aggiungi punti sgarro - /addsgarro 2"""
+    user_id = update.effective_user.id
+    
     try:
         punti = int(context.args[0])
         data = {'pointsForSgarro': punti}
-        encoded = base64.b64encode(json.dumps(data).encode()).decode()
         
         keyboard = InlineKeyboardMarkup([[
             InlineKeyboardButton(
                 "🍕 Apri App (Sgarri Aggiornati)",
-                web_app=WebAppInfo(url=f"{MINI_APP_URL}?data={encoded}")
+                web_app=WebAppInfo(url=app_link(user_id, data))
             )
         ]])
         
@@ -572,17 +783,21 @@ async def set_peso_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         data = {
             'savedWeights': [{'week': current_week, 'weight': peso}]
         }
-        encoded = base64.b64encode(json.dumps(data).encode()).decode()
+        
+        series, macros = record_weight(user_id, peso)
         
         keyboard = InlineKeyboardMarkup([[
             InlineKeyboardButton(
                 "⚖️ Apri App (Peso Aggiunto)",
-                web_app=WebAppInfo(url=f"{MINI_APP_URL}?data={encoded}")
+                web_app=WebAppInfo(url=app_link(user_id, data))
             )
         ]])
         
+        message = f"✅ *Peso aggiunto: {peso} kg*\n\nMedia 7 giorni: {series.rolling_average:.1f} kg"
+        if macros:
+            message += f"\n🔄 Macro ricalcolate sulla media: *{macros['calories']} kcal*"
         await update.message.reply_text(
-            f"✅ *Peso aggiunto: {peso} kg*\n\nApri l'app per vedere 📊",
+            message + "\n\nApri l'app per vedere 📊",
             parse_mode='Markdown',
             reply_markup=keyboard
         )
@@ -595,18 +810,22 @@ async def set_peso_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def reset_settimana_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Reset settimana"""
+    user_id = update.effective_user.id
+    
     data = {
         'weekData': {
             day: {'workout': False, 'diet': False, 'cardio': False}
             for day in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
         }
     }
-    encoded = base64.b64encode(json.dumps(data).encode()).decode()
+    activity.reset_week(user_id)
+    storage.touch('activity', user_id)
+    report_queue.touch(user_id)
     
     keyboard = InlineKeyboardMarkup([[
         InlineKeyboardButton(
             "🔄 Apri App (Reset Applicato)",
-            web_app=WebAppInfo(url=f"{MINI_APP_URL}?data={encoded}")
+            web_app=WebAppInfo(url=app_link(user_id, data))
         )
     ]])
     
@@ -619,15 +838,19 @@ async def reset_settimana_command(update: Update, context: ContextTypes.DEFAULT_
 
 async def add_streak_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Aggiungi streak - /addstreak 3"""
+    user_id = update.effective_user.id
+    
     try:
         streak = int(context.args[0])
         data = {'streak': streak}
-        encoded = base64.b64encode(json.dumps(data).encode()).decode()
+        activity.set_streak(user_id, streak)
+        storage.touch('activity', user_id)
+        report_queue.touch(user_id)
         
         keyboard = InlineKeyboardMarkup([[
             InlineKeyboardButton(
                 "🔥 Apri App (Streak Aggiornata)",
-                web_app=WebAppInfo(url=f"{MINI_APP_URL}?data={encoded}")
+                web_app=WebAppInfo(url=app_link(user_id, data))
             )
         ]])
         
@@ -646,34 +869,143 @@ async def add_streak_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 # ============ GESTIONE NOTIFICHE ============
 
 async def notifiche_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Gestisci notifiche"""
+    """Gestisci notifiche - /notifiche [mattina|sera|settimanale]"""
     user_id = update.effective_user.id
     
     if user_id not in user_settings:
         user_settings[user_id] = {'notifications': True}
+    settings = user_settings[user_id]
     
-    user_settings[user_id]['notifications'] = not user_settings[user_id].get('notifications', True)
-    status = "attivate" if user_settings[user_id]['notifications'] else "disattivate"
-    emoji = "🔔" if user_settings[user_id]['notifications'] else "🔕"
+    if context.args:
+        # Attiva/disattiva un singolo promemoria
+        reminder_type = REMINDER_ARGS.get(context.args[0].lower())
+        if reminder_type is None:
+            await update.message.reply_text(
+                "❌ Uso: `/notifiche [mattina|sera|settimanale]`",
+                parse_mode='Markdown'
+            )
+            return
+        key = f'reminder_{reminder_type}'
+        settings[key] = not settings.get(key, True)
+    else:
+        settings['notifications'] = not settings.get('notifications', True)
+    
+    storage.touch('settings', user_id)
+    sync_reminders(user_id)
+    
+    enabled = settings.get('notifications', True)
+    status = "attivate" if enabled else "disattivate"
+    emoji = "🔔" if enabled else "🔕"
+    
+    def mark(reminder_type):
+        return "✅" if is_subscribed(settings, reminder_type) else "❌"
     
     await update.message.reply_text(
         f"{emoji} *Notifiche {status}*\n\n"
-        f"Promemoria programmati:\n"
-        f"• 08:00 - Allenamento del giorno\n"
-        f"• 20:00 - Reminder serale\n"
-        f"• Domenica 21:00 - Report settimanale\n\n"
-        f"Usa di nuovo /notifiche per cambiare.",
+        f"Promemoria programmati ({reminder_schedule.timezone_of(user_id).key}):\n"
+        f"{mark('morning')} {settings.get('morning_time', DEFAULT_MORNING_TIME)} - Allenamento del giorno\n"
+        f"{mark('evening')} {settings.get('evening_time', DEFAULT_EVENING_TIME)} - Reminder serale\n"
+        f"{mark('weekly')} Domenica 21:00 - Report settimanale\n\n"
+        f"Usa di nuovo /notifiche per cambiare tutto, oppure\n"
+        f"/notifiche mattina, sera o settimanale per un singolo promemoria.\n"
+        f"Usa /orari e /fuso per scegliere orari e fuso orario.",
+        parse_mode='Markdown'
+    )
+
+
+async def orari_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Imposta orari promemoria - /orari 07:30 21:00"""
+    user_id = update.effective_user.id
+    
+    try:
+        morning_time = parse_time(context.args[0])
+        evening_time = parse_time(context.args[1]) if len(context.args) > 1 else None
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "❌ Uso: `/orari <mattina> [sera]`\nEsempio: `/orari 07:30 21:00`",
+            parse_mode='Markdown'
+        )
+        return
+    
+    settings = user_settings.setdefault(user_id, {'notifications': True})
+    settings['morning_time'] = morning_time
+    if evening_time:
+        settings['evening_time'] = evening_time
+    storage.touch('settings', user_id)
+    sync_reminders(user_id)
+    
+    await update.message.reply_text(
+        f"⏰ *Orari aggiornati*\n\n"
+        f"☀️ Mattina: {settings['morning_time']}\n"
+        f"🌙 Sera: {settings.get('evening_time', DEFAULT_EVENING_TIME)}\n"
+        f"🌍 Fuso: {reminder_schedule.timezone_of(user_id).key}",
         parse_mode='Markdown'
     )
 
 
+async def fuso_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Imposta fuso orario - /fuso Europe/Rome"""
+    user_id = update.effective_user.id
+    
+    try:
+        tz = get_timezone(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "❌ Uso: `/fuso <fuso orario>`\nEsempio: `/fuso Europe/Rome` o `/fuso America/New_York`",
+            parse_mode='Markdown'
+        )
+        return
+    
+    settings = user_settings.setdefault(user_id, {'notifications': True})
+    settings['timezone'] = tz.key
+    storage.touch('settings', user_id)
+    sync_reminders(user_id)
+    
+    local_now = datetime.now(tz).strftime('%H:%M')
+    await update.message.reply_text(
+        f"🌍 *Fuso orario: {tz.key}*\n\n"
+        f"Da te sono le {local_now}. I promemoria arriveranno all'ora locale.",
+        parse_mode='Markdown'
+    )
+
+
+def apply_app_sync(user_id, data):
+    """Conferma del delta sync ed eventi delle caselle inviati dalla Mini App
+    (via web_app_data o con una PATCH all'API dello stato)"""
+    # Conferma dello stato applicato dall'app: i prossimi link conterranno solo il nuovo delta
+    ack_version = data.get('ackVersion')
+    if ack_version is not None:
+        # Solo interi (anche come stringa): Infinity/NaN del JSON darebbero OverflowError
+        if isinstance(ack_version, bool) or not isinstance(ack_version, (int, str)):
+            raise ValueError(f"ackVersion non valida: {ack_version!r}")
+        if app_state.ack(user_id, int(ack_version)):
+            storage.touch('app_state', user_id)
+    
+    # Caselle spuntate nell'app (anche in coda ad altri messaggi, es. sgarro_used)
+    if data.get('events') is not None:
+        week, events = parse_batch(data)
+        activity.apply_batch(user_id, week, events)
+        storage.touch('activity', user_id)
+        report_queue.touch(user_id)
+
+
 async def handle_webapp_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Gestisce dati dalla Mini App"""
+    user_id = update.effective_user.id
     try:
         data = json.loads(update.effective_message.web_app_data.data)
         data_type = data.get('type')
+        apply_app_sync(user_id, data)
         
-        if data_type == 'sgarro_used':
+        if data_type == 'activity' and activity.summary(user_id):
+            summary = activity.summary(user_id)
+            await update.message.reply_text(
+                f"✅ *Progressi salvati!*\n\n"
+                f"📊 Settimana {summary['week']}: *{summary['points']}/100 punti*\n"
+                f"🔥 Streak: {summary['streak']} settimane",
+                parse_mode='Markdown'
+            )
+        elif data_type == 'sgarro_used':
             remaining = data.get('remainingSgarri', 0)
             await update.message.reply_text(
                 f"🍕 *Sgarro Usato!*\n\nGoditelo 😋\nSgarri rimasti: {remaining}",
@@ -685,78 +1017,156 @@ async def handle_webapp_data(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 # ============ PROMEMORIA AUTOMATICI ============
 
-async def morning_reminder(application: Application):
-    """Reminder mattutino - 8:00"""
-    today = datetime.now().strftime('%A').lower()
-    workout = get_workout_for_day(today)
+async def morning_reminder(application: Application, recipients, checkpoint=None):
+    """Reminder mattutino - all'orario scelto da ogni utente"""
     day_names = {
         'monday': 'Lunedì', 'tuesday': 'Martedì', 'wednesday': 'Mercoledì',
         'thursday': 'Giovedì', 'friday': 'Venerdì', 'saturday': 'Sabato', 'sunday': 'Domenica'
     }
     
-    message = f"☀️ *Buongiorno Bestia!*\n\nOggi è {day_names.get(today, 'oggi')}\n\n{workout}\n\nAndiamo a spaccare! 💪🔥"
-    
     keyboard = InlineKeyboardMarkup([[
-        InlineKeyboardButton("📱 Apri App", web_app=WebAppInfo(url=MINI_APP_URL))
+        InlineKeyboardButton("📱 Apri App", web_app=WebAppInfo(url=mini_app_url()))
     ]])
     
-    for user_id, settings in user_settings.items():
-        if settings.get('notifications', True):
-            try:
-                await application.bot.send_message(
-                    chat_id=user_id,
-                    text=message,
-                    parse_mode='Markdown',
-                    reply_markup=keyboard
-                )
-            except Exception as e:
-                logger.error(f"Errore invio morning reminder a {user_id}: {e}")
+    # Con fusi diversi lo stesso minuto UTC può cadere in giorni locali diversi
+    by_day = {}
+    for user_id in recipients:
+        today = datetime.now(reminder_schedule.timezone_of(user_id)).strftime('%A').lower()
+        by_day.setdefault(today, []).append(user_id)
+    
+    for today, chat_ids in by_day.items():
+        workout = get_workout_for_day(today)
+        message = f"☀️ *Buongiorno Bestia!*\n\nOggi è {day_names.get(today, 'oggi')}\n\n{workout}\n\nAndiamo a spaccare! 💪🔥"
+        await application.bot_data['broadcaster'].broadcast(
+            application.bot,
+            'morning_reminder',
+            chat_ids,
+            checkpoint=checkpoint,
+            text=message,
+            parse_mode='Markdown',
+            reply_markup=keyboard
+        )
 
 
-async def evening_reminder(application: Application):
-    """Reminder serale - 20:00"""
+async def evening_reminder(application: Application, recipients, checkpoint=None):
+    """Reminder serale - all'orario scelto da ogni utente"""
     message = "🌙 *Check Serale*\n\nHai già loggato oggi?\n\n✅ Allenamento fatto?\n✅ Dieta rispettata?\n\nOgni giorno conta! 💪"
     
     keyboard = InlineKeyboardMarkup([[
-        InlineKeyboardButton("📱 Segna Ora", web_app=WebAppInfo(url=MINI_APP_URL))
+        InlineKeyboardButton("📱 Segna Ora", web_app=WebAppInfo(url=mini_app_url()))
     ]])
     
-    for user_id, settings in user_settings.items():
-        if settings.get('notifications', True):
-            try:
-                await application.bot.send_message(
-                    chat_id=user_id,
-                    text=message,
-                    parse_mode='Markdown',
-                    reply_markup=keyboard
-                )
-            except Exception as e:
-                logger.error(f"Errore invio evening reminder a {user_id}: {e}")
+    await application.bot_data['broadcaster'].broadcast(
+        application.bot,
+        'evening_reminder',
+        recipients,
+        checkpoint=checkpoint,
+        text=message,
+        parse_mode='Markdown',
+        reply_markup=keyboard
+    )
 
 
-async def weekly_report(application: Application):
-    """Report settimanale - Domenica 21:00"""
-    message = "📊 *REPORT SETTIMANALE*\n\nSettimana completata! 🎉\n\n" \
-              "È il momento di:\n1️⃣ Controllare i tuoi punti totali\n" \
-              "2️⃣ Vedere se hai guadagnato uno sgarro\n" \
-              "3️⃣ Resettare per la prossima settimana\n\n" \
-              "La costanza batte il talento! 🔥"
-    
+def render_weekly_report(user_id):
+    """Report settimanale personalizzato di un utente"""
+    name = user_profiles.get(user_id, {}).get('name', 'Atleta')
+    return render_report(name, week_stats(activity_states.get(user_id), weight_history.get(user_id)))
+
+
+# Report preparati in anticipo dal tick, inviati all'orario con solo I/O
+report_queue = ReportQueue(render_weekly_report, memory_budget=int(REPORT_MEMORY_MB * 1024 * 1024))
+
+
+async def weekly_report(application: Application, recipients, checkpoint=None):
+    """Report settimanale personalizzato - Domenica 21:00 ora locale"""
     keyboard = InlineKeyboardMarkup([[
-        InlineKeyboardButton("📊 Vedi Report", web_app=WebAppInfo(url=MINI_APP_URL))
+        InlineKeyboardButton("📊 Vedi Report", web_app=WebAppInfo(url=mini_app_url()))
     ]])
     
-    for user_id, settings in user_settings.items():
-        if settings.get('notifications', True):
-            try:
-                await application.bot.send_message(
-                    chat_id=user_id,
-                    text=message,
-                    parse_mode='Markdown',
-                    reply_markup=keyboard
-                )
-            except Exception as e:
-                logger.error(f"Errore invio weekly report a {user_id}: {e}")
+    spools = await report_queue.take(reminder_schedule.last_minute)
+    await application.bot_data['broadcaster'].broadcast_each(
+        application.bot,
+        'weekly_report',
+        report_queue.messages(spools, recipients),
+        len(recipients),
+        checkpoint=checkpoint,
+        parse_mode='Markdown',
+        reply_markup=keyboard
+    )
+
+
+REMINDER_JOBS = {
+    'morning': morning_reminder,
+    'evening': evening_reminder,
+    'weekly': weekly_report,
+}
+
+
+async def run_reminder(application: Application, reminder_type, recipients, scheduled_at, checkpoint=None):
+    """Esegue un promemoria registrando ritardo di avvio, durata e consegne (nel journal)"""
+    job = REMINDER_JOBS[reminder_type]
+    if checkpoint is None:
+        checkpoint = await journal.start_run(reminder_type, scheduled_at, recipients)
+        if checkpoint is None:
+            return  # run di questo minuto già registrata: la riprende il journal
+        JOB_START_DELAY.observe((datetime.now(timezone.utc) - scheduled_at).total_seconds(), job.__name__)
+    start = time.perf_counter()
+    try:
+        await job(application, recipients, checkpoint)
+    except asyncio.CancelledError:
+        # Spegnimento a metà invio: la run resta aperta e riprende al riavvio
+        raise
+    except Exception:
+        # Destinatari non raggiunti: la run resta aperta e la riprende il prossimo tick
+        await journal.abandon(checkpoint)
+        raise
+    else:
+        await journal.finish(checkpoint)
+    finally:
+        JOB_DURATION.observe(time.perf_counter() - start, job.__name__)
+
+
+async def resume_broadcasts(application: Application):
+    """Riprende le run interrotte verso i soli destinatari non ancora raggiunti"""
+    for checkpoint, remaining in await journal.resumable():
+        reminder_type = checkpoint.reminder_type
+        recipients = delivery.filter([user_id for user_id in remaining if subscribers.has(reminder_type, user_id)])
+        logger.info(f"♻️ Ripresa del broadcast {checkpoint.run_id}: {len(recipients)} destinatari rimasti")
+        if not recipients:
+            await journal.finish(checkpoint)
+            continue
+        application.create_task(
+            run_reminder(application, reminder_type, recipients, checkpoint.scheduled_at, checkpoint)
+        )
+
+
+async def reminder_tick(application: Application):
+    """Ogni minuto: svuota i bucket della timing wheel e avvia i broadcast (solo sul leader)"""
+    now = datetime.now(timezone.utc)
+    scheduled_at = now.replace(second=0, microsecond=0)
+    JOB_START_DELAY.observe((now - scheduled_at).total_seconds(), 'reminder_tick')
+    if not election.is_leader:
+        return
+    start = time.perf_counter()
+    await resume_broadcasts(application)
+    due = reminder_schedule.due(now)
+    await election.save_progress(reminder_schedule.last_minute)
+    
+    if REPORT_LEAD_MINUTES > 0:
+        # I report di tra REPORT_LEAD_MINUTES minuti si preparano ora, in background
+        target = reminder_schedule.last_minute + REPORT_LEAD_MINUTES
+        report_queue.prepare(target, [
+            user_id for user_id in reminder_schedule.upcoming('weekly', target)
+            if subscribers.has('weekly', user_id) and not delivery.suppressed(user_id)
+        ])
+    
+    for reminder_type, user_ids in due.items():
+        # Le chat morte o in backoff dopo errori di rete vengono saltate
+        recipients = delivery.filter([user_id for user_id in user_ids if subscribers.has(reminder_type, user_id)])
+        if recipients:
+            # Non blocca il tick: un broadcast lungo non deve far saltare il minuto successivo
+            application.create_task(run_reminder(application, reminder_type, recipients, scheduled_at))
+    JOB_DURATION.observe(time.perf_counter() - start, 'reminder_tick')
 
 
 # ============ CAMBIO OBIETTIVO/PESO ============
@@ -801,6 +1211,7 @@ async def change_goal_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     # Ricalcola macro
     new_macros = calculate_macros(profile['tdee'], new_goal)
     profile['macros'] = new_macros
+    storage.touch('profiles', user_id)
     
     goal_names = {'bulk': '💪 Massa', 'cut': '🔥 Definizione', 'maintain': '⚖️ Mantenimento'}
     
@@ -809,12 +1220,11 @@ async def change_goal_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         'macros': new_macros,
         'goal': new_goal
     }
-    encoded = base64.b64encode(json.dumps(app_data).encode()).decode()
     
     keyboard = InlineKeyboardMarkup([[
         InlineKeyboardButton(
             "📱 Apri App (Aggiornata)",
-            web_app=WebAppInfo(url=f"{MINI_APP_URL}?data={encoded}")
+            web_app=WebAppInfo(url=app_link(user_id, app_data))
         )
     ]])
     
@@ -842,6 +1252,112 @@ async def cambia_peso_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     context.user_data['waiting_for_weight'] = True
 
 
+async def trend_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Andamento del peso: media mobile, variazione settimanale e grafico"""
+    user_id = update.effective_user.id
+    series = weight_history.get(user_id)
+    
+    if not series:
+        await update.message.reply_text(
+            "⚖️ Nessuna pesata registrata.\n\nUsa /setpeso o /cambiapeso per iniziare!"
+        )
+        return
+    
+    message = (
+        f"📈 *ANDAMENTO PESO*\n\n"
+        f"⚖️ Ultima pesata: *{series.latest:.1f} kg* ({series.latest_day.strftime('%d/%m')})\n"
+        f"📊 Media 7 giorni: *{series.rolling_average:.1f} kg*\n"
+    )
+    delta = series.weekly_delta
+    if delta is not None:
+        arrow = '📉' if delta < 0 else '📈' if delta > 0 else '➡️'
+        message += f"{arrow} Settimana: *{delta:+.1f} kg*\n"
+    if len(series) > 1:
+        message += f"🏁 Dall'inizio: *{series.total_change:+.1f} kg* ({len(series)} pesate)\n"
+        points = series.downsample(16)
+        message += f"\n`{sparkline([weight for _, weight in points])}`\n"
+        message += f"{points[0][0].strftime('%d/%m')} → {points[-1][0].strftime('%d/%m')}"
+    
+    await update.message.reply_text(message, parse_mode='Markdown')
+
+
+def recalculate_all_profiles():
+    """Ricalcola BMR/TDEE/macro di tutti i profili (dopo una modifica ai coefficienti)"""
+    changed = user_profiles.recalculate()
+    for user_id in changed:
+        storage.touch('profiles', user_id)
+        app_state.update(user_id, {'macros': user_profiles[user_id]['macros']})
+        storage.touch('app_state', user_id)
+    return changed
+
+
+async def flood_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Scarta gli update in eccesso prima che arrivino agli handler (gruppo -2, prima di tutti)"""
+    user = update.effective_user
+    if user is None:
+        return
+    kind, key = classify_update(update, flood.commands)
+    throttled = flood.check(user.id, kind, key)
+    if throttled is None:
+        return
+    action, notify = throttled
+    THROTTLED.inc(action, kind)
+    if notify:
+        # Avvisi diradati: anche l'avviso consuma il budget di invio
+        wait = max(1, round(flood.retry_after(user.id, kind)))
+        notice = f"⏳ Stai andando troppo veloce! Riprova tra {wait} secondi."
+        if update.callback_query is not None:
+            await update.callback_query.answer(notice)
+        elif update.effective_message is not None:
+            await update.effective_message.reply_text(notice)
+        logger.info(f"🚦 Flood control: {user.id} rallentato ({kind})")
+    raise ApplicationHandlerStop
+
+
+async def revive_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Chi scrive al bot è di nuovo raggiungibile: rientra nei promemoria (gruppo -1, prima degli altri handler)"""
+    user = update.effective_user
+    if user is not None and delivery.revive(user.id) and user.id in user_settings:
+        sync_reminders(user.id)
+        logger.info(f"📬 Chat {user.id} di nuovo raggiungibile")
+
+
+async def consegne_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: invii consegnati e sprecati degli ultimi giorni"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    rows = delivery.daily_stats(7)
+    lines = [f"{day.strftime('%d/%m')}: ✅ {delivered}  🗑️ {wasted}  ⏭️ {skipped}"
+             for day, delivered, wasted, skipped in rows]
+    await update.message.reply_text(
+        f"📬 *CONSEGNE PROMEMORIA*\n\n"
+        f"{chr(10).join(lines) or 'Nessun invio registrato'}\n\n"
+        f"✅ consegnati  🗑️ sprecati  ⏭️ saltati\n"
+        f"🚫 Chat escluse: {delivery.dead_count}",
+        parse_mode='Markdown'
+    )
+
+
+async def ricalcola_tutti_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: ricalcola le macro di tutti gli utenti in un solo passaggio"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    start = time.perf_counter()
+    changed = recalculate_all_profiles()
+    elapsed = (time.perf_counter() - start) * 1000
+    logger.info(f"🧮 Ricalcolo massivo: {len(changed)}/{len(user_profiles)} profili aggiornati in {elapsed:.0f} ms")
+    
+    await update.message.reply_text(
+        f"✅ *RICALCOLO MASSIVO COMPLETATO*\n\n"
+        f"👥 Profili: {len(user_profiles)}\n"
+        f"🔄 Aggiornati: {len(changed)}\n"
+        f"⏱️ Tempo: {elapsed:.0f} ms",
+        parse_mode='Markdown'
+    )
+
+
 async def ricalcola_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ricalcola tutto"""
     user_id = update.effective_user.id
@@ -860,14 +1376,14 @@ async def ricalcola_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     profile['bmr'] = bmr
     profile['tdee'] = tdee
     profile['macros'] = macros
+    storage.touch('profiles', user_id)
     
     app_data = {'macros': macros}
-    encoded = base64.b64encode(json.dumps(app_data).encode()).decode()
     
     keyboard = InlineKeyboardMarkup([[
         InlineKeyboardButton(
             "📱 Apri App (Aggiornata)",
-            web_app=WebAppInfo(url=f"{MINI_APP_URL}?data={encoded}")
+            web_app=WebAppInfo(url=app_link(user_id, app_data))
         )
     ]])
     
@@ -895,17 +1411,9 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
             new_weight = float(update.message.text.replace(',', '.'))
             
             if user_id in user_profiles:
-                user_profiles[user_id]['weight'] = new_weight
-                
-                # Ricalcola
-                profile = user_profiles[user_id]
-                bmr = calculate_bmr(new_weight, profile['height'], profile['age'])
-                tdee = calculate_tdee(bmr, profile['activity'])
-                macros = calculate_macros(tdee, profile['goal'])
-                
-                profile['bmr'] = bmr
-                profile['tdee'] = tdee
-                profile['macros'] = macros
+                # Peso indicato esplicitamente: si usa subito, senza aspettare la media
+                record_weight(user_id, new_weight, readjust=False)
+                apply_weight(user_id, new_weight)
                 
                 await update.message.reply_text(
                     f"✅ *Peso aggiornato: {new_weight} kg*\n\n"
@@ -942,6 +1450,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • Mattina (8:00) - Workout del giorno
 • Sera (20:00) - Reminder
 • Domenica (21:00) - Report settimanale
+Orari e fuso sono personalizzabili con /orari e /fuso
 
 *⚙️ Personalizzazione:*
 Il bot calcola automaticamente le tue macro in base a:
@@ -957,51 +1466,112 @@ Usa /menu per vedere tutti i comandi! 💪
 
 # ============ INIT POST-STARTUP ============
 
+async def start_metrics_server(application: Application):
+    """Serve /metrics su un server HTTP locale separato dal webhook"""
+    if not METRICS_PORT:
+        return
+    try:
+        from webserver import WebServer
+    except ImportError:
+        logger.warning("⚠️ aiohttp non installato: endpoint /metrics disattivato")
+        return
+    server = WebServer(METRICS_HOST, METRICS_PORT)
+    server.add_route('GET', '/metrics', metrics_handler())
+    await server.start()
+    application.bot_data['metrics_server'] = server
+
+
+def add_app_routes(server):
+    """Registra sul server HTTP l'API dello stato e il bundle statico della Mini App (se attivi)"""
+    if APP_API_URL:
+        add_state_routes(server, miniapp, BOT_TOKEN, app_url=MINI_APP_URL, on_patch=apply_app_sync)
+    if MINI_APP_BUNDLE:
+        add_bundle_routes(server, MINI_APP_BUNDLE)
+
+
+async def start_app_server(application: Application):
+    """In polling serve API e Mini App su un server proprio (in webhook usa quello del webhook)"""
+    if not (APP_API_URL or MINI_APP_BUNDLE) or WEBHOOK_URL:
+        return
+    try:
+        from webserver import WebServer
+    except ImportError:
+        logger.warning("⚠️ aiohttp non installato: API dello stato e Mini App locale disattivate")
+        return
+    server = WebServer(HTTP_HOST, HTTP_PORT)
+    add_app_routes(server)
+    await server.start()
+    application.bot_data['app_server'] = server
+
+
 async def post_init(application: Application):
-    """Inizializza scheduler dopo l'avvio"""
-    scheduler.add_job(
-        morning_reminder,
-        CronTrigger(hour=8, minute=0),
-        args=[application],
-        id='morning_reminder',
-        replace_existing=True
+    """Inizializza storage e scheduler dopo l'avvio"""
+    await storage.open()
+    await journal.open()
+    subscribers.rebuild(user_settings)
+    for chat_id in delivery.dead_chats():
+        subscribers.remove(chat_id)
+    
+    application.bot_data['broadcaster'] = Broadcaster(
+        global_rate=BROADCAST_RATE,
+        concurrency=BROADCAST_CONCURRENCY,
+        health=delivery
     )
     
+    # Un solo job per tutti gli utenti: la timing wheel decide chi notificare
+    reminder_schedule.rebuild()
+    await election.start()
+    await start_metrics_server(application)
+    await start_app_server(application)
     scheduler.add_job(
-        evening_reminder,
-        CronTrigger(hour=20, minute=0),
+        reminder_tick,
+        CronTrigger(minute='*'),
         args=[application],
-        id='evening_reminder',
-        replace_existing=True
-    )
-    
-    scheduler.add_job(
-        weekly_report,
-        CronTrigger(day_of_week='sun', hour=21, minute=0),
-        args=[application],
-        id='weekly_report',
-        replace_existing=True
+        id='reminder_tick',
+        replace_existing=True,
+        misfire_grace_time=30
     )
     
     scheduler.start()
     
     logger.info("✅ Bot avviato! Promemoria configurati:")
-    logger.info("⏰ 08:00 - Reminder mattutino")
-    logger.info("⏰ 20:00 - Reminder serale")
-    logger.info("⏰ Domenica 21:00 - Report settimanale")
+    logger.info(f"⏰ Tick ogni minuto per {len(user_settings)} utenti (fuso di default {DEFAULT_TIMEZONE})")
+    logger.info(f"⏰ {DEFAULT_MORNING_TIME} / {DEFAULT_EVENING_TIME} / Domenica 21:00 - orari di default, modificabili con /orari e /fuso")
 
 
-# ============ MAIN ============
+async def post_shutdown(application: Application):
+    """Rilascia il lease e salva le ultime modifiche prima dello spegnimento"""
+    if 'metrics_server' in application.bot_data:
+        await application.bot_data.pop('metrics_server').stop()
+    if 'app_server' in application.bot_data:
+        await application.bot_data.pop('app_server').stop()
+    report_queue.discard()
+    await journal.close()
+    await election.stop()
+    await storage.close()
+    logger.info("💾 Storage chiuso")
 
-def main():
-    """Avvia il bot"""
-    # Controllo token prima di tutto
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN non impostato. Crea un file .env con BOT_TOKEN=<il_tuo_token>")
-        print("Errore: BOT_TOKEN non impostato. Controlla il file .env e rilancia.")
-        sys.exit(1)
 
-    application = Application.builder().token(BOT_TOKEN).build()
+# ============ MAIN ============
+
+def build_application(token, base_url=None):
+    """Crea l'Application con tutti gli handler registrati"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+        .connection_pool_size(HTTP_POOL_SIZE)
+        .pool_timeout(10)
+    )
+    if OUTBOUND_QUEUE:
+        builder = builder.rate_limiter(OutboundQueue(rate=OUTBOUND_RATE, max_in_flight=HTTP_POOL_SIZE))
+    if base_url:
+        builder = builder.base_url(base_url)
+    # Conversazioni e user_data sopravvivono ai riavvii (stesso file SQLite dello storage)
+    persistent = STORAGE_BACKEND.lower() == 'sqlite'
+    if persistent:
+        builder = builder.persistence(SQLitePersistence(DATABASE_PATH, update_interval=STORAGE_FLUSH_INTERVAL))
+    application = builder.build()
     
     # Setup conversation handler
     setup_handler = ConversationHandler(
@@ -1015,6 +1585,8 @@ def main():
             SETUP_ACTIVITY: [CallbackQueryHandler(setup_activity, pattern='^activity_')],
         },
         fallbacks=[CommandHandler('cancel', setup_cancel)],
+        name='setup',
+        persistent=persistent,
     )
     
     # Aggiungi handlers
@@ -1026,6 +1598,8 @@ def main():
     application.add_handler(CommandHandler("macros", macros_command))
     application.add_handler(CommandHandler("oggi", oggi_command))
     application.add_handler(CommandHandler("notifiche", notifiche_command))
+    application.add_handler(CommandHandler("orari", orari_command))
+    application.add_handler(CommandHandler("fuso", fuso_command))
     application.add_handler(CommandHandler("help", help_command))
     
     # Comandi modifica app
@@ -1038,7 +1612,14 @@ def main():
     # Comandi personalizzazione
     application.add_handler(CommandHandler("cambiaobiettivo", cambia_obiettivo_command))
     application.add_handler(CommandHandler("cambiapeso", cambia_peso_command))
+    application.add_handler(CommandHandler("trend", trend_command))
     application.add_handler(CommandHandler("ricalcola", ricalcola_command))
+    application.add_handler(CommandHandler("ricalcolatutti", ricalcola_tutti_command))
+    application.add_handler(CommandHandler("consegne", consegne_command))
+    application.add_handler(TypeHandler(Update, revive_chat), group=-1)
+    if FLOOD_RATE > 0:
+        flood.commands = registered_commands(application)
+        application.add_handler(TypeHandler(Update, flood_control), group=-2)
     
     # Callback handlers
     application.add_handler(CallbackQueryHandler(change_goal_callback, pattern='^change_goal_'))
@@ -1047,14 +1628,142 @@ def main():
     application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, handle_webapp_data))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_messages))
     
+    # Latenza di ogni handler su /metrics
+    instrument_handlers(application)
+    
     # Post init
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
+    
+    return application
+
+
+def registered_commands(application):
+    """Nomi di tutti i comandi gestiti (anche dentro i ConversationHandler)"""
+    commands = set()
+    pending = [handler for handlers in application.handlers.values() for handler in handlers]
+    while pending:
+        handler = pending.pop()
+        if isinstance(handler, ConversationHandler):
+            pending.extend(handler.entry_points)
+            pending.extend(handler.fallbacks)
+        elif isinstance(handler, CommandHandler):
+            commands.update(handler.commands)
+    return commands
+
+
+def run_webhook_mode(application):
+    """Serve gli update via webhook dal server HTTP embedded"""
+    from webhook import run_webhook
+    from webserver import WebServer
+    
+    server = WebServer(HTTP_HOST, HTTP_PORT)
+    if APP_API_URL or MINI_APP_BUNDLE:
+        add_app_routes(server)
+    try:
+        asyncio.run(run_webhook(
+            application,
+            server,
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret=WEBHOOK_SECRET,
+            path=WEBHOOK_PATH,
+            allowed_updates=ALLOWED_UPDATES
+        ))
+    except KeyboardInterrupt:
+        logger.info("Interruzione manuale rilevata. Arresto in corso...")
+    except Exception as e:
+        logger.exception("Errore non gestito in modalità webhook: %s", e)
+        sys.exit(1)
+    finally:
+        try:
+            scheduler.shutdown(wait=False)
+        except Exception:
+            pass
+
+
+async def recalculate_cli(args):
+    """CLI: ricalcola tutti i profili salvati e li riscrive nello storage"""
+    await storage.open()
+    try:
+        start = time.perf_counter()
+        changed = recalculate_all_profiles()
+        elapsed = (time.perf_counter() - start) * 1000
+    finally:
+        await storage.close()
+    print(f"Ricalcolati {len(user_profiles)} profili in {elapsed:.0f} ms: {len(changed)} aggiornati")
+
+
+async def export_cli(args):
+    """CLI: esporta profili e impostazioni dallo storage SQLite (a blocchi, memoria costante)"""
+    stats = export_records(DATABASE_PATH, args.path, args.format, args.chunk_size)
+    print(f"Esportati {stats.rows} utenti ({stats.profiles} profili, {stats.settings} impostazioni) "
+          f"in {args.path}: {stats.elapsed:.1f} s, {stats.rate:.0f} righe/s")
+
+
+async def import_cli(args):
+    """CLI: importa profili e impostazioni nello storage SQLite, ricalcolando bmr, tdee e macro"""
+    stats = import_records(DATABASE_PATH, args.path, args.format, args.chunk_size)
+    print(f"Importati {stats.rows} utenti ({stats.profiles} profili, {stats.settings} impostazioni) "
+          f"da {args.path}: {stats.elapsed:.1f} s, {stats.rate:.0f} righe/s")
+    print(f"Macro ricalcolate diverse dal file: {stats.recomputed}, righe scartate: {stats.rejected}")
+
+
+async def build_app_cli(args):
+    """CLI: compila index.html nel bundle statico (CSS precompilato, JS minificato, gzip/brotli)"""
+    output = args.path or MINI_APP_BUNDLE or DEFAULT_OUTPUT
+    sizes = build_bundle('index.html', output)
+    for name, variants in sizes.items():
+        compressed = ", ".join(f"{extension[1:]} {size / 1024:.1f} KB" for extension, size in variants.items() if extension)
+        print(f"{name:<22} {variants[''] / 1024:>6.1f} KB ({compressed})")
+    print(f"Bundle scritto in {output}/: imposta MINI_APP_BUNDLE={output} e MINI_APP_URL=<url pubblico>/miniapp/")
+
+
+CLI_COMMANDS = {
+    'ricalcola-tutti': recalculate_cli,
+    'esporta': export_cli,
+    'importa': import_cli,
+    'compila-app': build_app_cli,
+}
+# Comandi che leggono/scrivono direttamente il file SQLite (serve un percorso)
+TRANSFER_COMMANDS = {'esporta', 'importa'}
+
+
+def main():
+    """Avvia il bot (senza argomenti) o esegue un comando di manutenzione"""
+    parser = argparse.ArgumentParser(description="Winter Grind Bot")
+    parser.add_argument('command', nargs='?', choices=sorted(CLI_COMMANDS),
+                        help="comando di manutenzione (senza comando avvia il bot)")
+    parser.add_argument('path', nargs='?', help="file per esporta/importa (.jsonl, .jsonl.gz o .parquet), cartella per compila-app")
+    parser.add_argument('--format', choices=FORMATS, help="formato del file (default: dall'estensione)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="utenti per blocco in esporta/importa")
+    args = parser.parse_args()
+    if args.command in TRANSFER_COMMANDS:
+        if not args.path:
+            parser.error(f"{args.command}: serve il percorso del file")
+        if STORAGE_BACKEND.lower() != 'sqlite':
+            parser.error(f"{args.command}: richiede STORAGE_BACKEND=sqlite")
+    if args.command:
+        asyncio.run(CLI_COMMANDS[args.command](args))
+        return
+
+    # Controllo token prima di tutto
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN non impostato. Crea un file .env con BOT_TOKEN=<il_tuo_token>")
+        print("Errore: BOT_TOKEN non impostato. Controlla il file .env e rilancia.")
+        sys.exit(1)
+
+    application = build_application(BOT_TOKEN)
     
     logger.info("🚀 Avvio bot in corso...")
 
+    if WEBHOOK_URL:
+        run_webhook_mode(application)
+        return
+
     try:
         # Esegui il polling; intercetta conflitti dovuti a un'altra istanza attiva
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
     except Conflict as e:
         logger.error("❌ Conflict getUpdates: esiste un'altra istanza del bot (o un altro processo che usa getUpdates). Dettaglio: %s", e)
         print("Conflict: terminated by other getUpdates request; assicurati che non ci siano altre istanze del bot in esecuzione e riprova.")
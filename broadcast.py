@@ -0,0 +1,253 @@
+"""
+Motore di broadcast per i promemoria programmati di Winter Grind
+
+Invia lo stesso messaggio a molti utenti in parallelo rispettando i limiti
+di Telegram:
+- limite globale (~30 msg/s) con un token bucket condiviso tra tutte le run
+- limite per chat (~1 msg/s) per non far scattare il flood control
+- RetryAfter mette in pausa TUTTA la pipeline e il messaggio viene ritentato
+- gli errori di rete vengono ritentati con backoff esponenziale; con un
+  DeliveryHealth (delivery.py) ogni esito viene registrato per chat
+- con un Checkpoint (journal.py) ogni consegna riuscita finisce nel journal
+  della run, così un invio interrotto può riprendere senza doppi invii
+
+Ogni run produce statistiche (throughput, durata, errori) loggate a fine invio.
+"""
+
+import asyncio
+import logging
+import time
+
+from telegram.error import TelegramError
+
+from delivery import DEAD_OUTCOMES, ERROR, NETWORK, RETRY_AFTER, SUCCESS, classify
+from metrics import SEND_OUTCOMES
+
+logger = logging.getLogger(__name__)
+
+# Limiti di default (vedi https://core.telegram.org/bots/faq#broadcasting-to-users)
+DEFAULT_GLOBAL_RATE = 30.0     # messaggi al secondo su tutte le chat
+DEFAULT_PER_CHAT_RATE = 1.0    # messaggi al secondo nella stessa chat
+DEFAULT_CONCURRENCY = 20       # invii HTTP in volo contemporaneamente
+MAX_RETRIES = 3                # tentativi dopo un RetryAfter
+MAX_TRANSIENT_RETRIES = 3      # tentativi dopo un errore di rete
+TRANSIENT_RETRY_DELAY = 1.0    # secondi prima del primo nuovo tentativo (poi raddoppia)
+BULK_PRIORITY = 'bulk'         # classe della coda di invio (outbound.py), se configurata
+
+
+class TokenBucket:
+    """Token bucket asincrono: `rate` token al secondo, picco massimo `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self):
+        """Attende finché non è disponibile un token e lo consuma"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """Distanzia gli invii verso la stessa chat di almeno 1/rate secondi"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_at = {}
+        self._prune_at = 1024
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        next_at = self._next_at.get(chat_id, 0.0)
+        if next_at > now:
+            self._next_at[chat_id] = next_at + self.interval
+            await asyncio.sleep(next_at - now)
+        else:
+            self._next_at[chat_id] = now + self.interval
+
+        # Pulizia ammortizzata delle chat ormai libere
+        if len(self._next_at) >= self._prune_at:
+            now = time.monotonic()
+            self._next_at = {cid: t for cid, t in self._next_at.items() if t > now}
+            self._prune_at = max(1024, 2 * len(self._next_at))
+
+
+class BroadcastStats:
+    """Statistiche di una singola run di broadcast"""
+
+    def __init__(self, name, total):
+        self.name = name
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.forbidden = 0
+        self.retries = 0
+        self.paused_for = 0.0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def duration(self):
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def throughput(self):
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'forbidden': self.forbidden,
+            'retries': self.retries,
+            'paused_for': round(self.paused_for, 3),
+            'duration': round(self.duration, 3),
+            'throughput': round(self.throughput, 2),
+        }
+
+
+class Broadcaster:
+    """Fan-out concorrente e rate-limited di un messaggio verso molte chat"""
+
+    def __init__(self, global_rate=DEFAULT_GLOBAL_RATE, per_chat_rate=DEFAULT_PER_CHAT_RATE,
+                 concurrency=DEFAULT_CONCURRENCY, health=None):
+        self.concurrency = concurrency
+        self.health = health    # DeliveryHealth: esiti per chat e chat morte (opzionale)
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_limiter = PerChatLimiter(per_chat_rate)
+        self._resume = asyncio.Event()
+        self._resume.set()
+        self._paused_until = 0.0
+        self.last_runs = {}
+
+    async def _pause(self, seconds, stats):
+        """Sospende tutti i worker (di tutte le run) per `seconds` secondi"""
+        until = time.monotonic() + seconds
+        if until <= self._paused_until:
+            return
+        self._paused_until = until
+        self._resume.clear()
+        logger.warning(f"⏸️ RetryAfter: broadcast in pausa per {seconds:.1f}s")
+        stats.paused_for += seconds
+        await asyncio.sleep(seconds)
+        if time.monotonic() >= self._paused_until:
+            self._resume.set()
+
+    async def _send(self, bot, chat_id, stats, kwargs):
+        retries = transient = 0
+        while True:
+            await self._resume.wait()
+            await self.chat_limiter.acquire(chat_id)
+            await self.global_bucket.acquire()
+            await self._resume.wait()
+            try:
+                await bot.send_message(chat_id=chat_id, **kwargs)
+            except TelegramError as e:
+                error = e
+                outcome = classify(e)
+            except Exception as e:
+                # Errore imprevisto: conta come fallito per questa chat, la run prosegue
+                error = e
+                outcome = ERROR
+            else:
+                error = None
+                outcome = SUCCESS
+            SEND_OUTCOMES.inc(stats.name, outcome)
+            if self.health is not None:
+                self.health.record(chat_id, outcome)
+
+            if outcome == SUCCESS:
+                stats.sent += 1
+                return True
+            if outcome == RETRY_AFTER:
+                stats.retries += 1
+                if retries < MAX_RETRIES:
+                    retries += 1
+                    retry_after = error.retry_after
+                    if hasattr(retry_after, 'total_seconds'):
+                        retry_after = retry_after.total_seconds()
+                    await self._pause(float(retry_after), stats)
+                    continue
+                stats.failed += 1
+                logger.error(f"Invio {stats.name} a {chat_id} abbandonato dopo {MAX_RETRIES} RetryAfter")
+                return
+            if outcome == NETWORK:
+                if transient < MAX_TRANSIENT_RETRIES:
+                    # Backoff esponenziale solo per questa chat, gli altri worker proseguono
+                    await asyncio.sleep(TRANSIENT_RETRY_DELAY * 2 ** transient)
+                    transient += 1
+                    continue
+                stats.failed += 1
+                if self.health is not None:
+                    self.health.record_failure(chat_id)
+                logger.warning(f"Invio {stats.name} a {chat_id} abbandonato dopo {transient} errori di rete: {error}")
+                return
+            if outcome in DEAD_OUTCOMES:
+                stats.forbidden += 1
+                logger.debug(f"Chat {chat_id} non raggiungibile ({stats.name}): {error}")
+                return
+            stats.failed += 1
+            logger.error(f"Errore invio {stats.name} a {chat_id}: {error}")
+            return
+
+    async def broadcast(self, bot, name, chat_ids, checkpoint=None, **kwargs):
+        """
+        Invia `bot.send_message(chat_id=..., **kwargs)` a tutte le `chat_ids`.
+
+        Con `checkpoint` ogni consegna riuscita viene registrata nel journal.
+        Ritorna le BroadcastStats della run (salvate anche in `last_runs[name]`).
+        """
+        chat_ids = list(chat_ids)
+        return await self._run(bot, name, ((chat_id, None) for chat_id in chat_ids), len(chat_ids), kwargs,
+                               checkpoint)
+
+    async def broadcast_each(self, bot, name, messages, total, checkpoint=None, **kwargs):
+        """
+        Come `broadcast`, ma con un testo per chat: `messages` produce coppie
+        (chat_id, text) e viene consumato in streaming dai worker (può essere
+        letto da disco senza caricarlo tutto in memoria). `total` serve solo
+        alle statistiche.
+        """
+        return await self._run(bot, name, messages, total, kwargs, checkpoint)
+
+    async def _run(self, bot, name, messages, total, kwargs, checkpoint=None):
+        stats = BroadcastStats(name, total)
+        if getattr(bot, 'rate_limiter', None) is not None:
+            # Con la coda di invio i promemoria passano dopo le risposte interattive
+            kwargs = {**kwargs, 'rate_limit_args': BULK_PRIORITY}
+        pending = iter(messages)
+
+        async def worker():
+            for chat_id, text in pending:
+                delivered = await self._send(bot, chat_id, stats, kwargs if text is None else {**kwargs, 'text': text})
+                if delivered and checkpoint is not None:
+                    checkpoint.delivered(chat_id)
+
+        logger.info(f"📣 Broadcast {name}: {stats.total} destinatari")
+        workers = min(self.concurrency, stats.total)
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        stats.finished_at = time.monotonic()
+
+        self.last_runs[name] = stats
+        logger.info(
+            f"📣 Broadcast {name} completato: {stats.sent}/{stats.total} inviati "
+            f"in {stats.duration:.1f}s ({stats.throughput:.1f} msg/s), "
+            f"{stats.forbidden} bloccati, {stats.failed} falliti, {stats.retries} RetryAfter"
+        )
+        return stats
@@ -0,0 +1,252 @@
+"""
+Codec compatto e versionato per il parametro `?data=` della Mini App
+
+Formato v1 (poi base64 URL-safe senza padding):
+    [versione][flag][campi...]
+- flag bit 0: il corpo è compresso con deflate "raw" (solo se conviene)
+- ogni campo: tag (varint) + valore, secondo lo SCHEMA condiviso con index.html
+- interi come varint (zigzag se con segno), pesi in virgola fissa (centesimi di kg)
+- macro con segno (tag 11): un profilo assurdo può dare calorie negative; il
+  tag 1 (macro senza segno) resta solo in lettura per i link già inviati
+- chiavi non previste nello schema finiscono in un campo JSON di riserva
+- `patches` è una lista di sotto-payload (stesso schema) con la loro stateVersion
+
+Il decoder accetta anche il vecchio formato base64(JSON), riconoscibile dal
+primo byte '{'. La Mini App ha il decoder gemello in `decodeAppData`.
+"""
+
+import base64
+import json
+import zlib
+
+VERSION = 1
+FLAG_DEFLATE = 0x01
+COMPRESS_THRESHOLD = 64  # sotto questa dimensione deflate non conviene mai
+
+GOALS = ('bulk', 'cut', 'maintain')
+DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+ACTIVITIES = ('workout', 'diet', 'cardio')
+MACRO_KEYS = ('calories', 'protein', 'carbs', 'fats')
+WEIGHT_SCALE = 100
+
+# tag -> (chiave, tipo). NON riusare mai un tag: aggiungere solo tag nuovi.
+# Con più tag per la stessa chiave l'encoder usa l'ultimo (vedi TAGS).
+SCHEMA = {
+    1: ('macros', 'macros'),    # solo decodifica: sostituito dal tag 11
+    2: ('userName', 'str'),
+    3: ('goal', 'goal'),
+    4: ('currentWeek', 'int'),
+    5: ('pointsForSgarro', 'int'),
+    6: ('streak', 'int'),
+    7: ('weekData', 'week'),
+    8: ('savedWeights', 'weights'),
+    9: ('stateVersion', 'int'),
+    10: ('patches', 'patches'),
+    11: ('macros', 'smacros'),
+}
+TAG_EXTRA = 127
+TAGS = {key: (tag, kind) for tag, (key, kind) in SCHEMA.items()}
+
+
+class CodecError(ValueError):
+    """Payload non decodificabile"""
+
+
+# ---- primitive ----
+
+def _write_uvarint(out, value):
+    if value < 0:
+        raise CodecError(f"Valore negativo per uvarint: {value}")
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_svarint(out, value):
+    _write_uvarint(out, value * 2 if value >= 0 else -value * 2 - 1)
+
+
+def _write_str(out, value):
+    raw = value.encode('utf-8')
+    _write_uvarint(out, len(raw))
+    out.extend(raw)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        if self.pos >= len(self.data):
+            raise CodecError("Payload troncato")
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def uvarint(self):
+        result = shift = 0
+        while True:
+            byte = self.byte()
+            result |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    def svarint(self):
+        value = self.uvarint()
+        return -(value + 1) // 2 if value & 1 else value // 2
+
+    def str(self):
+        length = self.uvarint()
+        if self.pos + length > len(self.data):
+            raise CodecError("Payload troncato")
+        value = self.data[self.pos:self.pos + length].decode('utf-8')
+        self.pos += length
+        return value
+
+
+# ---- campi ----
+
+def _encode_value(out, kind, value):
+    if kind == 'int':
+        _write_svarint(out, int(value))
+    elif kind == 'str':
+        _write_str(out, value)
+    elif kind == 'goal':
+        out.append(GOALS.index(value))
+    elif kind == 'smacros':
+        for key in MACRO_KEYS:
+            _write_svarint(out, int(value[key]))
+    elif kind == 'week':
+        # maschera dei giorni presenti, poi un byte di bit-attività per giorno
+        days = [i for i, day in enumerate(DAYS) if day in value]
+        _write_uvarint(out, sum(1 << i for i in days))
+        for i in days:
+            entry = value[DAYS[i]]
+            out.append(sum(1 << bit for bit, activity in enumerate(ACTIVITIES) if entry.get(activity)))
+    elif kind == 'weights':
+        _write_uvarint(out, len(value))
+        for entry in value:
+            _write_svarint(out, int(entry['week']))
+            _write_svarint(out, round(float(entry['weight']) * WEIGHT_SCALE))
+    elif kind == 'patches':
+        _write_uvarint(out, len(value))
+        for patch in value:
+            body = bytearray()
+            _encode_fields(body, patch)
+            _write_uvarint(out, len(body))
+            out.extend(body)
+
+
+def _decode_value(reader, kind):
+    if kind == 'int':
+        return reader.svarint()
+    if kind == 'str':
+        return reader.str()
+    if kind == 'goal':
+        index = reader.byte()
+        if index >= len(GOALS):
+            raise CodecError(f"Obiettivo sconosciuto: {index}")
+        return GOALS[index]
+    if kind == 'macros':
+        return {key: reader.uvarint() for key in MACRO_KEYS}
+    if kind == 'smacros':
+        return {key: reader.svarint() for key in MACRO_KEYS}
+    if kind == 'week':
+        mask = reader.uvarint()
+        week = {}
+        for i, day in enumerate(DAYS):
+            if mask & (1 << i):
+                bits = reader.byte()
+                week[day] = {activity: bool(bits & (1 << bit)) for bit, activity in enumerate(ACTIVITIES)}
+        return week
+    if kind == 'weights':
+        return [
+            {'week': reader.svarint(), 'weight': reader.svarint() / WEIGHT_SCALE}
+            for _ in range(reader.uvarint())
+        ]
+    if kind == 'patches':
+        patches = []
+        for _ in range(reader.uvarint()):
+            length = reader.uvarint()
+            end = reader.pos + length
+            if end > len(reader.data):
+                raise CodecError("Payload troncato")
+            patches.append(_decode_fields(reader, end))
+        return patches
+    raise CodecError(f"Tipo sconosciuto: {kind}")
+
+
+def _encode_fields(out, data):
+    extra = {}
+    for key, value in data.items():
+        if key not in TAGS or value is None:
+            if value is not None:
+                extra[key] = value
+            continue
+        tag, kind = TAGS[key]
+        _write_uvarint(out, tag)
+        _encode_value(out, kind, value)
+    if extra:
+        _write_uvarint(out, TAG_EXTRA)
+        _write_str(out, json.dumps(extra, separators=(',', ':')))
+
+
+def _decode_fields(reader, end):
+    data = {}
+    while reader.pos < end:
+        tag = reader.uvarint()
+        if tag == TAG_EXTRA:
+            data.update(json.loads(reader.str()))
+        elif tag in SCHEMA:
+            key, kind = SCHEMA[tag]
+            data[key] = _decode_value(reader, kind)
+        else:
+            raise CodecError(f"Tag sconosciuto: {tag}")
+    return data
+
+
+# ---- API ----
+
+def encode_app_data(data, compress=True):
+    """dict -> stringa URL-safe per `?data=`"""
+    body = bytearray()
+    _encode_fields(body, data)
+
+    flags = 0
+    if compress and len(body) > COMPRESS_THRESHOLD:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        packed = compressor.compress(bytes(body)) + compressor.flush()
+        if len(packed) < len(body):
+            body = packed
+            flags |= FLAG_DEFLATE
+
+    raw = bytes([VERSION, flags]) + bytes(body)
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_app_data(encoded):
+    """Stringa di `?data=` -> dict (accetta anche il vecchio base64(JSON))"""
+    text = encoded.strip().replace(' ', '+')
+    try:
+        raw = base64.urlsafe_b64decode(text.replace('+', '-').replace('/', '_') + '=' * (-len(text) % 4))
+    except (ValueError, TypeError) as e:
+        raise CodecError(f"Base64 non valido: {e}") from e
+    if not raw:
+        raise CodecError("Payload vuoto")
+
+    if raw[:1] == b'{':
+        return json.loads(raw)
+
+    if raw[0] != VERSION or len(raw) < 2:
+        raise CodecError(f"Versione payload non supportata: {raw[0]}")
+    body = raw[2:]
+    if raw[1] & FLAG_DEFLATE:
+        try:
+            body = zlib.decompress(body, -15)
+        except zlib.error as e:
+            raise CodecError(f"Deflate non valido: {e}") from e
+
+    return _decode_fields(_Reader(body), len(body))
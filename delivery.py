@@ -0,0 +1,162 @@
+"""
+Salute delle consegne dei promemoria
+
+Classifica l'esito di ogni invio alla Bot API:
+- success:        consegnato
+- forbidden:      l'utente ha bloccato il bot o disattivato l'account
+- chat_not_found: la chat non esiste più
+- retry_after:    flood control di Telegram (gestito dal broadcaster)
+- network:        errore di rete / timeout, transitorio
+- error:          altro errore (es. messaggio non valido), non legato alla chat
+
+Le chat morte (forbidden, chat_not_found) escono dai broadcast finché
+l'utente non scrive di nuovo al bot (`revive`). Dopo gli errori transitori
+il broadcaster ritenta con backoff esponenziale; se l'invio fallisce comunque,
+la chat viene saltata nei promemoria successivi con un backoff che raddoppia
+(da TRANSIENT_BACKOFF a MAX_BACKOFF) fino al primo invio riuscito.
+
+Statistiche per giorno (UTC): invii consegnati, sprecati (ogni chiamata che
+non ha consegnato) e saltati perché la chat era sospesa. Stato per chat e
+statistiche sono dict JSON-serializzabili persistiti dallo storage.
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+SUCCESS = 'success'
+FORBIDDEN = 'forbidden'
+CHAT_NOT_FOUND = 'chat_not_found'
+RETRY_AFTER = 'retry_after'
+NETWORK = 'network'
+ERROR = 'error'
+DEAD_OUTCOMES = (FORBIDDEN, CHAT_NOT_FOUND)
+
+TRANSIENT_BACKOFF = 3600        # secondi di sospensione dopo il primo invio fallito per errori di rete
+MAX_BACKOFF = 7 * 24 * 3600     # tetto del backoff tra un promemoria e l'altro
+RETENTION_DAYS = 30             # giorni di statistiche conservati
+
+# Messaggi di BadRequest che indicano una chat che non esiste più
+_DEAD_CHAT_MESSAGES = ('chat not found', 'user not found', 'chat_id is empty', 'user is deactivated')
+
+
+def classify(error):
+    """Esito di un invio fallito (una delle costanti del modulo)"""
+    if isinstance(error, Forbidden):
+        return FORBIDDEN
+    if isinstance(error, RetryAfter):
+        return RETRY_AFTER
+    # BadRequest e TimedOut sono sottoclassi di NetworkError: prima i casi specifici
+    if isinstance(error, BadRequest):
+        message = str(error).lower()
+        return CHAT_NOT_FOUND if any(text in message for text in _DEAD_CHAT_MESSAGES) else ERROR
+    if isinstance(error, NetworkError):
+        return NETWORK
+    return ERROR
+
+
+def _day_key(now):
+    """Chiave intera del giorno UTC (es. 20261018), usabile come chiave dello storage"""
+    day = datetime.fromtimestamp(now, timezone.utc)
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+class DeliveryHealth:
+    """Chat morte o in backoff e statistiche giornaliere degli invii"""
+
+    def __init__(self, chats, days, on_change=None):
+        self._chats = chats        # chat_id -> {'dead': ts, 'reason': esito} | {'failures': n, 'retry_at': ts}
+        self._days = days          # yyyymmdd -> {esito: conteggio, 'suppressed': n}
+        self._on_change = on_change or (lambda namespace, key: None)
+        self.on_dead = None        # callback(chat_id) quando una chat viene segnata come morta
+
+    def _count(self, outcome, amount=1, now=None):
+        key = _day_key(now or time.time())
+        counts = self._days.get(key)
+        if counts is None:
+            counts = self._days[key] = {}
+            self._prune(key)
+        counts[outcome] = counts.get(outcome, 0) + amount
+        self._on_change('delivery_days', key)
+
+    def _prune(self, today):
+        oldest = datetime.strptime(str(today), '%Y%m%d') - timedelta(days=RETENTION_DAYS)
+        limit = oldest.year * 10000 + oldest.month * 100 + oldest.day
+        for key in [key for key in self._days if key < limit]:
+            del self._days[key]
+            self._on_change('delivery_days', key)
+
+    # ---- esiti ----
+
+    def record(self, chat_id, outcome):
+        """Registra l'esito di una chiamata alla Bot API verso `chat_id`"""
+        self._count(outcome)
+        if outcome == SUCCESS:
+            if chat_id in self._chats:
+                del self._chats[chat_id]
+                self._on_change('delivery', chat_id)
+        elif outcome in DEAD_OUTCOMES:
+            self._chats[chat_id] = {'dead': time.time(), 'reason': outcome}
+            self._on_change('delivery', chat_id)
+            if self.on_dead is not None:
+                self.on_dead(chat_id)
+
+    def record_failure(self, chat_id):
+        """Invio abbandonato dopo i tentativi per errori transitori: sospende la chat con backoff"""
+        state = self._chats.get(chat_id)
+        if state is not None and 'dead' in state:
+            return
+        failures = (state or {}).get('failures', 0) + 1
+        backoff = min(TRANSIENT_BACKOFF * 2 ** (failures - 1), MAX_BACKOFF)
+        self._chats[chat_id] = {'failures': failures, 'retry_at': time.time() + backoff}
+        self._on_change('delivery', chat_id)
+
+    # ---- filtro dei destinatari ----
+
+    def is_dead(self, chat_id):
+        state = self._chats.get(chat_id)
+        return state is not None and 'dead' in state
+
+    def suppressed(self, chat_id, now=None):
+        """True se la chat è morta o ancora in backoff"""
+        state = self._chats.get(chat_id)
+        if state is None:
+            return False
+        return 'dead' in state or state['retry_at'] > (now or time.time())
+
+    def filter(self, chat_ids):
+        """Destinatari senza le chat sospese (conteggiate come invii risparmiati)"""
+        now = time.time()
+        kept = [chat_id for chat_id in chat_ids if not self.suppressed(chat_id, now)]
+        if len(kept) < len(chat_ids):
+            self._count('suppressed', len(chat_ids) - len(kept), now)
+        return kept
+
+    def revive(self, chat_id):
+        """L'utente ha scritto al bot: la chat torna raggiungibile. True se era sospesa"""
+        if chat_id not in self._chats:
+            return False
+        del self._chats[chat_id]
+        self._on_change('delivery', chat_id)
+        return True
+
+    def dead_chats(self):
+        return [chat_id for chat_id, state in self._chats.items() if 'dead' in state]
+
+    @property
+    def dead_count(self):
+        return sum(1 for state in self._chats.values() if 'dead' in state)
+
+    # ---- statistiche ----
+
+    def daily_stats(self, days=7):
+        """[(giorno, consegnati, sprecati, saltati)] degli ultimi `days` giorni con invii"""
+        rows = []
+        for key in sorted(self._days, reverse=True)[:days]:
+            counts = self._days[key]
+            delivered = counts.get(SUCCESS, 0)
+            suppressed = counts.get('suppressed', 0)
+            wasted = sum(counts.values()) - delivered - suppressed
+            rows.append((datetime.strptime(str(key), '%Y%m%d').date(), delivered, wasted, suppressed))
+        return rows
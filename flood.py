@@ -0,0 +1,107 @@
+"""
+Flood control per utente, davanti a tutti gli handler
+
+Ogni utente ha un token bucket (`rate` token al secondo, al massimo `burst`):
+ogni update consuma 1 token, i comandi pesanti (JSON+base64 del link della
+Mini App, ricalcoli) ne consumano di più. Senza token l'update viene scartato
+prima di arrivare agli handler, quindi senza lavoro né chiamate alla Bot API:
+- coalesced: ripetizione dello stesso comando/callback dell'ultimo update
+  accettato (la risposta a quello vale anche per questo)
+- dropped:   qualsiasi altro update in eccesso
+
+All'utente arriva al massimo un avviso ogni `burst / rate` secondi (il tempo
+per riempire il bucket), anche se nel frattempo qualche update passa. I bucket stanno in un LRU limitato a
+`max_users`: gli utenti inattivi da più tempo vengono scartati per primi, e un
+bucket scartato equivale a uno pieno, quindi l'eviction non penalizza nessuno.
+
+Costo per update: una lookup nel dict, qualche operazione aritmetica.
+"""
+
+import time
+from collections import Counter, OrderedDict
+
+DEFAULT_RATE = 1.0          # token al secondo per utente
+DEFAULT_BURST = 10          # picco: il flusso /setup (7 update) passa senza attese
+DEFAULT_MAX_USERS = 100_000
+
+# Token consumati dai comandi con lavoro o invii extra; i lotti della Mini App
+# sono già coalescenti lato client e portano dati da non perdere
+COMMAND_COSTS = {'app': 3, 'ricalcola': 3, 'ricalcolatutti': 5, 'trend': 2, 'web_app_data': 0}
+
+COALESCED = 'coalesced'
+DROPPED = 'dropped'
+
+
+def classify_update(update, commands=()):
+    """(tipo, chiave di coalescenza): tipo è il comando, 'callback', 'web_app_data' o 'message'
+
+    I comandi fuori da `commands` diventano 'command', così contatori e label
+    delle metriche non crescono con i comandi inventati da chi fa spam.
+    """
+    message = update.message
+    if message is not None:
+        text = message.text
+        if text and text.startswith('/'):
+            command = text.split(maxsplit=1)[0][1:].split('@', 1)[0].lower()
+            return (command if command in commands else 'command'), text
+        if message.web_app_data is not None:
+            return 'web_app_data', None
+        return 'message', None
+    if update.callback_query is not None:
+        return 'callback', update.callback_query.data
+    return 'other', None
+
+
+class FloodControl:
+    """Token bucket per utente in un LRU limitato"""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_users=DEFAULT_MAX_USERS,
+                 costs=None, exempt=()):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.costs = COMMAND_COSTS if costs is None else costs
+        self.exempt = set(exempt)
+        self.commands = set()        # comandi registrati (gli altri contano come 'command')
+        self.throttled = Counter()   # (azione, tipo) -> update scartati
+        self.evicted = 0
+        self._buckets = OrderedDict()   # user_id -> [token, ultimo refill, chiave accettata, ultimo avviso]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def check(self, user_id, kind, key=None, now=None):
+        """None se l'update passa, altrimenti (azione, avvisare) con azione COALESCED o DROPPED"""
+        if user_id in self.exempt:
+            return None
+        now = time.monotonic() if now is None else now
+        cost = self.costs.get(kind, 1)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [float(self.burst), now, None, None]
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            bucket[2] = key
+            return None
+
+        action = COALESCED if key is not None and key == bucket[2] else DROPPED
+        self.throttled[(action, kind)] += 1
+        notify = bucket[3] is None or now - bucket[3] >= self.burst / self.rate
+        if notify:
+            bucket[3] = now
+        return action, notify
+
+    def retry_after(self, user_id, kind):
+        """Secondi prima che l'utente abbia di nuovo i token per `kind`"""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            return 0.0
+        return max(0.0, (self.costs.get(kind, 1) - bucket[0]) / self.rate)
@@ -0,0 +1,263 @@
+"""
+Journal dei broadcast: ripresa dopo un crash senza doppi invii
+
+Ogni run di promemoria ha un id (`tipo-AAAAMMGGTHHMM`, il minuto UTC
+programmato) e due tabelle append-only nello stesso file SQLite dello storage:
+- broadcast_runs:     destinatari della run (array di int64) e stato
+- broadcast_progress: chat a cui il messaggio è già stato consegnato
+
+Il broadcaster segna ogni consegna riuscita con `Checkpoint.delivered`
+(O(1), nessun I/O); le consegne vengono scritte a lotti, in un'unica
+transazione ogni `batch_size` chat o `flush_interval` secondi, su un thread
+dedicato.
+
+Sul leader, a ogni tick, le run rimaste aperte (processo terminato a metà
+invio, o leader caduto) ripartono verso i soli destinatari non ancora
+consegnati se sono più recenti di `freshness` secondi; quelle più vecchie
+vengono chiuse come scadute (un buongiorno che arriva a mezzogiorno non
+serve). Allo spegnimento ordinato il journal viene scritto tutto: dopo un
+crash solo le chat dell'ultimo lotto non ancora scritto possono ricevere il
+messaggio due volte.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FRESHNESS = 30 * 60     # secondi entro cui una run interrotta viene ripresa
+DEFAULT_BATCH_SIZE = 200        # consegne per scrittura nel journal
+DEFAULT_FLUSH_INTERVAL = 1.0    # secondi massimi tra una consegna e la sua scrittura
+RETENTION = 24 * 3600           # secondi di run terminate conservate
+
+FINISHED = 'finished'
+EXPIRED = 'expired'
+
+
+def make_run_id(reminder_type, scheduled_at):
+    """Id della run: tipo di promemoria e minuto UTC programmato"""
+    return f"{reminder_type}-{scheduled_at:%Y%m%dT%H%M}"
+
+
+class Checkpoint:
+    """Avanzamento di una run: consegne in attesa di essere scritte nel journal"""
+
+    def __init__(self, journal, run_id, reminder_type, scheduled_at):
+        self.journal = journal
+        self.run_id = run_id
+        self.reminder_type = reminder_type
+        self.scheduled_at = scheduled_at
+        self._buffer = []
+
+    def delivered(self, chat_id):
+        """Messaggio consegnato a `chat_id` (scritto con il prossimo lotto)"""
+        self._buffer.append(chat_id)
+        if len(self._buffer) >= self.journal.batch_size:
+            self.journal._schedule_flush(self)
+
+
+class BroadcastJournal:
+    """Run di broadcast e consegne in SQLite, per riprendere gli invii interrotti"""
+
+    def __init__(self, path, freshness=DEFAULT_FRESHNESS, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        # Senza file condiviso (storage in memoria) il journal vive solo nel processo
+        self.path = path or ':memory:'
+        self.freshness = freshness
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._active = {}     # run_id -> Checkpoint delle run in corso in questo processo
+        self._writes = set()
+        self._pruned_at = 0.0
+        self._conn = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+
+    # ---- SQLite (thread dedicato) ----
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS broadcast_runs ("
+            " run_id TEXT PRIMARY KEY,"
+            " reminder_type TEXT NOT NULL,"
+            " scheduled_at REAL NOT NULL,"
+            " recipients BLOB NOT NULL,"
+            " status TEXT,"
+            " finished_at REAL"
+            ")"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS broadcast_progress ("
+            " run_id TEXT NOT NULL,"
+            " chat_id INTEGER NOT NULL,"
+            " PRIMARY KEY (run_id, chat_id)"
+            ") WITHOUT ROWID"
+        )
+        conn.commit()
+        return conn
+
+    def _insert_run(self, run_id, reminder_type, scheduled_at, recipients):
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO broadcast_runs (run_id, reminder_type, scheduled_at, recipients) "
+                "VALUES (?, ?, ?, ?)",
+                (run_id, reminder_type, scheduled_at.timestamp(), array('q', recipients).tobytes())
+            )
+        return cursor.rowcount == 1
+
+    def _append(self, run_id, chat_ids):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO broadcast_progress (run_id, chat_id) VALUES (?, ?)",
+                [(run_id, chat_id) for chat_id in chat_ids]
+            )
+
+    def _close_run(self, run_id, status):
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "UPDATE broadcast_runs SET status = ?, finished_at = ? WHERE run_id = ?",
+                (status, now, run_id)
+            )
+            if now - self._pruned_at > RETENTION / 10:
+                old = "SELECT run_id FROM broadcast_runs WHERE finished_at < ?"
+                self._conn.execute(f"DELETE FROM broadcast_progress WHERE run_id IN ({old})", (now - RETENTION,))
+                self._conn.execute("DELETE FROM broadcast_runs WHERE finished_at < ?", (now - RETENTION,))
+                self._pruned_at = now
+
+    def _open_runs(self, active):
+        """Run non terminate (escluse quelle in corso qui): [(run_id, tipo, ts, destinatari rimasti)]"""
+        rows = self._conn.execute(
+            "SELECT run_id, reminder_type, scheduled_at, recipients FROM broadcast_runs "
+            "WHERE finished_at IS NULL"
+        ).fetchall()
+        runs = []
+        for run_id, reminder_type, scheduled_at, blob in rows:
+            if run_id in active:
+                continue
+            delivered = {chat_id for chat_id, in self._conn.execute(
+                "SELECT chat_id FROM broadcast_progress WHERE run_id = ?", (run_id,)
+            )}
+            recipients = array('q')
+            recipients.frombytes(blob)
+            runs.append((run_id, reminder_type, scheduled_at,
+                         [chat_id for chat_id in recipients if chat_id not in delivered]))
+        return runs
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # ---- scritture a lotti ----
+
+    async def _flush(self, checkpoint):
+        chat_ids, checkpoint._buffer = checkpoint._buffer, []
+        if not chat_ids:
+            return
+        try:
+            await self._run(self._append, checkpoint.run_id, chat_ids)
+        except sqlite3.Error as e:
+            # Rimesse in coda: verranno riscritte con il prossimo lotto
+            checkpoint._buffer.extend(chat_ids)
+            logger.warning(f"⚠️ Journal {checkpoint.run_id}: scrittura di {len(chat_ids)} consegne fallita: {e}")
+
+    def _schedule_flush(self, checkpoint):
+        task = asyncio.get_running_loop().create_task(self._flush(checkpoint))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for checkpoint in list(self._active.values()):
+                await self._flush(checkpoint)
+
+    # ---- API ----
+
+    async def open(self):
+        self._conn = await self._run(self._connect)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def start_run(self, reminder_type, scheduled_at, recipients):
+        """Registra una nuova run; None se la run di quel minuto esiste già (la riprende `resumable`)"""
+        run_id = make_run_id(reminder_type, scheduled_at)
+        if run_id in self._active:
+            return None
+        checkpoint = self._active[run_id] = Checkpoint(self, run_id, reminder_type, scheduled_at)
+        try:
+            created = await self._run(self._insert_run, run_id, reminder_type, scheduled_at, recipients)
+        except sqlite3.Error as e:
+            # Senza journal l'invio parte comunque, solo non sarà ripristinabile
+            logger.warning(f"⚠️ Journal {run_id}: registrazione della run fallita: {e}")
+            created = True
+        if not created:
+            del self._active[run_id]
+            return None
+        return checkpoint
+
+    async def resumable(self):
+        """Run interrotte da riprendere: [(Checkpoint, destinatari non ancora consegnati)]
+
+        Le run più vecchie di `freshness` vengono chiuse come scadute.
+        """
+        try:
+            runs = await self._run(self._open_runs, set(self._active))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Lettura del journal dei broadcast fallita: {e}")
+            return []
+        now = time.time()
+        resumed = []
+        for run_id, reminder_type, scheduled_at, remaining in runs:
+            if run_id in self._active:
+                continue
+            if now - scheduled_at > self.freshness:
+                logger.warning(f"⌛ Run {run_id} scaduta: {len(remaining)} destinatari non raggiunti")
+                try:
+                    await self._run(self._close_run, run_id, EXPIRED)
+                except sqlite3.Error as e:
+                    logger.warning(f"⚠️ Journal {run_id}: chiusura della run scaduta fallita: {e}")
+                continue
+            checkpoint = self._active[run_id] = Checkpoint(
+                self, run_id, reminder_type, datetime.fromtimestamp(scheduled_at, timezone.utc)
+            )
+            resumed.append((checkpoint, remaining))
+        return resumed
+
+    async def finish(self, checkpoint):
+        """Run completata: scrive le ultime consegne e la chiude"""
+        self._active.pop(checkpoint.run_id, None)
+        await self._flush(checkpoint)
+        try:
+            await self._run(self._close_run, checkpoint.run_id, FINISHED)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Journal {checkpoint.run_id}: chiusura della run fallita: {e}")
+
+    async def abandon(self, checkpoint):
+        """Run interrotta da un errore: scrive le consegne e la lascia aperta, da riprendere"""
+        self._active.pop(checkpoint.run_id, None)
+        await self._flush(checkpoint)
+
+    async def close(self):
+        """Allo spegnimento: scrive le consegne in sospeso, le run aperte restano da riprendere"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            if self._writes:
+                await asyncio.gather(*self._writes, return_exceptions=True)
+            for checkpoint in list(self._active.values()):
+                await self._flush(checkpoint)
+            self._active.clear()
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,162 @@
+"""
+Leader election a lease per il deploy multi-istanza di Winter Grind
+
+Con più repliche del bot (webhook dietro un load balancer) solo una deve
+inviare i promemoria. Le istanze si contendono una riga di lock in SQLite
+(lo stesso file condiviso dello storage):
+- il leader rinnova il lease ogni `ttl / 3` secondi
+- se il leader muore, il lease scade e un'altra istanza lo prende entro `ttl`
+- allo spegnimento il lease viene rilasciato, così il passaggio è immediato
+- il leader salva nel lease il suo avanzamento (ultimo minuto di promemoria
+  elaborato): chi subentra riparte da lì, senza buchi né doppi invii
+
+SQLite fa da stand-in locale (istanze sullo stesso host/volume); per istanze
+su host diversi la stessa logica va su Redis (SET NX PX + rinnovo).
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_TTL = 15.0  # secondi
+
+
+def default_instance_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaderElection:
+    """Lease `name` conteso tra istanze; `is_leader` vale finché il lease è valido"""
+
+    def __init__(self, path, name='reminders', ttl=DEFAULT_LEASE_TTL, instance_id=None):
+        # Senza file condiviso (storage in memoria) il lease è locale: unica istanza, sempre leader
+        self.path = path or ':memory:'
+        self.name = name
+        self.ttl = ttl
+        self.instance_id = instance_id or default_instance_id()
+        self.progress = None
+        self.on_elected = None   # callback(progress) quando l'istanza diventa leader
+        self._expires_at = 0.0
+        self._leader = False
+        self._conn = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='leader')
+
+    @property
+    def is_leader(self):
+        # Senza rinnovi riusciti il lease scade anche localmente (margine di 1s sugli altri)
+        return self._leader and time.time() < self._expires_at - 1
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=self.ttl / 3)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " name TEXT PRIMARY KEY,"
+            " holder TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " progress INTEGER"
+            ")"
+        )
+        conn.commit()
+        return conn
+
+    def _acquire(self):
+        """Prende o rinnova il lease se libero, scaduto o già nostro; ritorna (leader, progress)"""
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET "
+                "holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+                (self.name, self.instance_id, now + self.ttl, now)
+            )
+            holder, progress = self._conn.execute(
+                "SELECT holder, progress FROM leases WHERE name = ?", (self.name,)
+            ).fetchone()
+        return holder == self.instance_id, now + self.ttl, progress
+
+    def _save_progress(self, progress):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE leases SET progress = ? WHERE name = ? AND holder = ?",
+                (progress, self.name, self.instance_id)
+            )
+
+    def _release(self):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ?",
+                (self.name, self.instance_id)
+            )
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def renew(self):
+        """Un tentativo di acquisizione/rinnovo del lease"""
+        try:
+            leader, expires_at, progress = await self._run(self._acquire)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Rinnovo lease '{self.name}' fallito: {e}")
+            return
+        was_leader = self.is_leader
+        self._leader = leader
+        if not leader:
+            if was_leader:
+                logger.warning(f"👑 Lease '{self.name}' perso: {self.instance_id} ora è in standby")
+            return
+        self._expires_at = expires_at
+        if not was_leader:
+            self.progress = progress
+            logger.info(f"👑 {self.instance_id} è leader di '{self.name}'")
+            if self.on_elected:
+                self.on_elected(progress)
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self.renew()
+
+    async def start(self):
+        """Primo tentativo di elezione, poi rinnovo periodico in background"""
+        self._conn = await self._run(self._connect)
+        await self.renew()
+        if not self.is_leader:
+            logger.info(f"⏸️ {self.instance_id} in standby per '{self.name}'")
+        self._task = asyncio.create_task(self._renew_loop())
+
+    async def save_progress(self, progress):
+        """Salva nel lease l'avanzamento del leader (ignorato se il lease non è nostro)"""
+        self.progress = progress
+        try:
+            await self._run(self._save_progress, progress)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Salvataggio avanzamento '{self.name}' fallito: {e}")
+
+    async def stop(self):
+        """Ferma il rinnovo e rilascia il lease, così un'altra istanza subentra subito"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            if self._leader:
+                try:
+                    await self._run(self._release)
+                except sqlite3.Error as e:
+                    logger.warning(f"⚠️ Rilascio lease '{self.name}' fallito: {e}")
+            await self._run(self._conn.close)
+            self._conn = None
+        self._leader = False
+        self._executor.shutdown(wait=True)
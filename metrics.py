@@ -0,0 +1,213 @@
+"""
+Metriche in stile Prometheus per Winter Grind
+
+Registro minimale senza dipendenze (formato testo di esposizione 0.0.4):
+- Counter:   contatori monotoni (es. esiti degli invii per promemoria)
+- Histogram: bucket fissi, `observe` in O(log bucket) senza lock né allocazioni
+- Gauge:     valori letti da una callback solo quando /metrics viene letto
+
+Gli handler vengono avvolti da `instrument_handlers`: sul percorso caldo il
+costo è due `perf_counter()` e un `observe` (vedi benchmarks/bench_metrics.py).
+"""
+
+import functools
+import time
+from bisect import bisect_left
+
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+
+# Secondi: da 1 ms (handler) a 5 minuti (broadcast lunghi)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contatore monotono con etichette"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """Istogramma a bucket fissi con etichette"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # labels -> [conteggi per bucket (+Inf in coda), somma, totale]
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def samples(self):
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(float(bound))}"'
+                yield f'{self.name}_bucket', _labels(self.labelnames, labels, le), cumulative
+            yield f'{self.name}_sum', _labels(self.labelnames, labels), total
+            yield f'{self.name}_count', _labels(self.labelnames, labels), count
+
+
+class Gauge:
+    """Valore istantaneo letto da `callback()`: un numero o `{labels: valore}`"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        value = self.callback()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, number in value.items():
+            if not isinstance(labels, tuple):
+                labels = (labels,)
+            yield self.name, _labels(self.labelnames, labels), number
+
+
+class Registry:
+    """Insieme delle metriche esposte su /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metrica già registrata: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        return self._add(Gauge(name, documentation, callback, labelnames))
+
+    def render(self):
+        """Testo nel formato di esposizione Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    'wintergrind_handler_duration_seconds', "Durata degli handler di Telegram", ('handler',))
+HANDLER_ERRORS = REGISTRY.counter(
+    'wintergrind_handler_errors_total', "Eccezioni non gestite negli handler", ('handler',))
+SEND_OUTCOMES = REGISTRY.counter(
+    'wintergrind_send_total', "Esiti degli invii (promemoria e risposte interattive)", ('reminder', 'outcome'))
+JOB_START_DELAY = REGISTRY.histogram(
+    'wintergrind_job_start_delay_seconds', "Ritardo tra l'orario previsto e l'avvio di un job", ('job',))
+JOB_DURATION = REGISTRY.histogram(
+    'wintergrind_job_duration_seconds', "Durata dei job schedulati", ('job',))
+THROTTLED = REGISTRY.counter(
+    'wintergrind_throttled_total', "Update scartati dal flood control", ('action', 'kind'))
+
+
+def _instrument(handler):
+    callback = handler.callback
+    if getattr(callback, '__wrapped__', None) is not None:
+        return  # già strumentato
+    name = getattr(callback, '__name__', type(handler).__name__)
+    observe = HANDLER_LATENCY.observe
+    clock = time.perf_counter
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        start = clock()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            observe(clock() - start, name)
+
+    handler.callback = timed
+
+
+def instrument_handlers(application):
+    """Avvolge la callback di ogni handler registrato (anche dentro i ConversationHandler)"""
+    pending = [handler for handlers in application.handlers.values() for handler in handlers]
+    while pending:
+        handler = pending.pop()
+        if isinstance(handler, ConversationHandler):
+            pending.extend(handler.entry_points)
+            pending.extend(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                pending.extend(state_handlers)
+        else:
+            _instrument(handler)
+
+
+def metrics_handler(registry=REGISTRY):
+    """Handler aiohttp per GET /metrics"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    return handle
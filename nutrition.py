@@ -0,0 +1,152 @@
+"""
+Calcolo di BMR, TDEE e macro per Winter Grind
+
+Due versioni con le stesse tabelle di coefficienti:
+- scalare (calculate_bmr / calculate_tdee / calculate_macros), usata dagli handler
+- vettoriale con NumPy (batch_macros / recalculate_profiles), per ricalcolare
+  tutti i profili in un colpo quando si cambia un moltiplicatore o uno split
+
+La versione vettoriale esegue le stesse operazioni in virgola mobile nello
+stesso ordine e tronca come `int()`, quindi i risultati coincidono al bit.
+NumPy serve solo per il ricalcolo massivo.
+"""
+
+# Moltiplicatori del livello di attività (livello sconosciuto -> DEFAULT_ACTIVITY_MULTIPLIER)
+ACTIVITY_MULTIPLIERS = {
+    'sedentary': 1.2,      # Poco o nessun esercizio
+    'light': 1.375,        # Esercizio leggero 1-3 giorni/settimana
+    'moderate': 1.55,      # Esercizio moderato 3-5 giorni/settimana
+    'active': 1.725,       # Esercizio intenso 6-7 giorni/settimana
+    'very_active': 1.9     # Esercizio molto intenso, lavoro fisico
+}
+DEFAULT_ACTIVITY_MULTIPLIER = 1.55
+
+# Obiettivo -> (fattore calorie, % proteine, % carboidrati, % grassi); sconosciuto -> maintain
+GOAL_SPLITS = {
+    'bulk': (1.1, 0.30, 0.45, 0.25),      # Massa: +10% calorie, alto protein, medio carb
+    'cut': (0.8, 0.40, 0.30, 0.30),       # Definizione: -20% calorie, alto protein, basso carb
+    'maintain': (1.0, 0.30, 0.40, 0.30),  # Mantenimento
+}
+DEFAULT_GOAL = 'maintain'
+
+# Codici per gli array (ultimo codice = valore sconosciuto)
+ACTIVITY_LEVELS = tuple(ACTIVITY_MULTIPLIERS)
+GOALS = tuple(GOAL_SPLITS)
+
+
+# ============ SCALARE ============
+
+def calculate_bmr(weight, height, age, gender='male'):
+    """Calcola il metabolismo basale (BMR)"""
+    if gender.lower() == 'male':
+        # Formula Mifflin-St Jeor per uomini
+        bmr = (10 * weight) + (6.25 * height) - (5 * age) + 5
+    else:
+        # Formula per donne
+        bmr = (10 * weight) + (6.25 * height) - (5 * age) - 161
+    return bmr
+
+
+def calculate_tdee(bmr, activity_level):
+    """Calcola il dispendio energetico totale giornaliero"""
+    return bmr * ACTIVITY_MULTIPLIERS.get(activity_level, DEFAULT_ACTIVITY_MULTIPLIER)
+
+
+def calculate_macros(calories, goal='bulk'):
+    """Calcola le macro in base all'obiettivo"""
+    factor, protein_pct, carbs_pct, fats_pct = GOAL_SPLITS.get(goal, GOAL_SPLITS[DEFAULT_GOAL])
+    target_cal = int(calories * factor)
+
+    return {
+        'calories': target_cal,
+        'protein': int((target_cal * protein_pct) / 4),
+        'carbs': int((target_cal * carbs_pct) / 4),
+        'fats': int((target_cal * fats_pct) / 9)
+    }
+
+
+# ============ VETTORIALE (NumPy) ============
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise RuntimeError("Il ricalcolo massivo richiede numpy: pip install numpy") from e
+    return numpy
+
+
+def activity_code(level):
+    return ACTIVITY_LEVELS.index(level) if level in ACTIVITY_MULTIPLIERS else len(ACTIVITY_LEVELS)
+
+
+def goal_code(goal):
+    return GOALS.index(goal) if goal in GOAL_SPLITS else GOALS.index(DEFAULT_GOAL)
+
+
+def batch_macros(weights, heights, ages, activity_codes, goal_codes, male=None):
+    """
+    BMR, TDEE e macro per array di profili (codici da activity_code / goal_code).
+
+    Ritorna un dict di array: bmr, tdee (float64), calories, protein, carbs, fats (int64).
+    """
+    np = _numpy()
+    weights = np.asarray(weights, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    ages = np.asarray(ages, dtype=np.float64)
+
+    # Stesso ordine di valutazione di calculate_bmr: ((10w + 6.25h) - 5a) + costante
+    bmr = (10 * weights) + (6.25 * heights) - (5 * ages)
+    bmr = bmr + (5.0 if male is None else np.where(male, 5.0, -161.0))
+
+    multipliers = np.array([ACTIVITY_MULTIPLIERS[level] for level in ACTIVITY_LEVELS] + [DEFAULT_ACTIVITY_MULTIPLIER])
+    tdee = bmr * multipliers[np.asarray(activity_codes)]
+
+    splits = np.array([GOAL_SPLITS[goal] for goal in GOALS])[np.asarray(goal_codes)]
+    # int() tronca verso lo zero: np.trunc, poi di nuovo in float come fa Python con int * float
+    target_cal = np.trunc(tdee * splits[:, 0])
+    return {
+        'bmr': bmr,
+        'tdee': tdee,
+        'calories': target_cal.astype(np.int64),
+        'protein': np.trunc((target_cal * splits[:, 1]) / 4).astype(np.int64),
+        'carbs': np.trunc((target_cal * splits[:, 2]) / 4).astype(np.int64),
+        'fats': np.trunc((target_cal * splits[:, 3]) / 9).astype(np.int64),
+    }
+
+
+def recalculate_profiles(profiles):
+    """
+    Ricalcola bmr, tdee e macros di tutti i profili `{user_id: profile}` in un passaggio.
+
+    Ritorna gli user_id il cui profilo è cambiato.
+    """
+    np = _numpy()
+    user_ids = list(profiles)
+    values = [profiles[user_id] for user_id in user_ids]
+    count = len(values)
+    if not count:
+        return []
+
+    result = batch_macros(
+        np.fromiter((p['weight'] for p in values), np.float64, count),
+        np.fromiter((p['height'] for p in values), np.float64, count),
+        np.fromiter((p['age'] for p in values), np.float64, count),
+        np.fromiter((activity_code(p.get('activity')) for p in values), np.int64, count),
+        np.fromiter((goal_code(p.get('goal')) for p in values), np.int64, count),
+        np.fromiter((str(p.get('gender', 'male')).lower() == 'male' for p in values), bool, count),
+    )
+
+    # tolist() riporta a float/int Python (serializzabili in JSON)
+    columns = zip(
+        result['bmr'].tolist(), result['tdee'].tolist(), result['calories'].tolist(),
+        result['protein'].tolist(), result['carbs'].tolist(), result['fats'].tolist(),
+    )
+    changed = []
+    for user_id, profile, (bmr, tdee, calories, protein, carbs, fats) in zip(user_ids, values, columns):
+        macros = {'calories': calories, 'protein': protein, 'carbs': carbs, 'fats': fats}
+        if profile.get('macros') != macros or profile.get('bmr') != bmr or profile.get('tdee') != tdee:
+            changed.append(user_id)
+        profile['bmr'] = bmr
+        profile['tdee'] = tdee
+        profile['macros'] = macros
+    return changed
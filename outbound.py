@@ -0,0 +1,284 @@
+"""
+Coda centrale dei messaggi in uscita con priorità
+
+Tutte le richieste alla Bot API passano dal rate limiter dell'Application
+(`ApplicationBuilder.rate_limiter`). Questa coda le ordina così:
+- due classi di priorità: INTERACTIVE (risposte agli utenti, default) e BULK
+  (broadcast dei promemoria, `rate_limit_args='bulk'`): una richiesta
+  interattiva passa sempre davanti a quelle bulk in attesa
+- FIFO per chat: al massimo una richiesta in volo per chat, nell'ordine di
+  arrivo; tra chat diverse round robin
+- un unico token bucket condiviso (limite globale di Telegram) e un numero
+  massimo di richieste in volo (pari al pool HTTP)
+- RetryAfter sospende l'intera coda e la richiesta viene ritentata
+
+Le richieste senza `chat_id` (answerCallbackQuery, setWebhook, getMe...) non
+consumano il budget dei messaggi e vengono eseguite subito.
+
+Statistiche: profondità per classe e tempo di attesa in coda, anche su /metrics,
+dove gli esiti degli invii interattivi finiscono in wintergrind_send_total con
+reminder="interactive".
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from broadcast import TokenBucket
+from delivery import RETRY_AFTER, SUCCESS, classify
+from metrics import REGISTRY, SEND_OUTCOMES
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)   # in ordine di precedenza
+
+DEFAULT_RATE = 30.0       # messaggi/secondo globali
+DEFAULT_MAX_RETRIES = 3   # tentativi dopo un RetryAfter
+
+_active = []   # code avviate (una per Application), lette dalla gauge di /metrics
+
+QUEUE_WAIT = REGISTRY.histogram(
+    'wintergrind_outbound_wait_seconds', "Attesa in coda dei messaggi in uscita", ('priority',))
+REGISTRY.gauge(
+    'wintergrind_outbound_depth', "Messaggi in coda per priorità",
+    lambda: {priority: sum(queue._classes[priority].depth for queue in _active) for priority in PRIORITIES},
+    ('priority',))
+
+
+class _Request:
+    __slots__ = ('chat_id', 'priority', 'call', 'future', 'enqueued_at', 'attempts')
+
+    def __init__(self, chat_id, priority, call, future):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.call = call
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class _PriorityClass:
+    """Richieste in attesa di una classe: FIFO per chat, round robin tra chat"""
+
+    def __init__(self):
+        self.chats = {}         # chat_id -> deque di _Request
+        self.ready = deque()    # chat con richieste in attesa, in ordine di turno
+        self.in_ready = set()
+        self.depth = 0
+        self.enqueued = 0
+        self.sent = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class OutboundQueue(BaseRateLimiter):
+    """Rate limiter PTB con coda a priorità, FIFO per chat e limite globale condiviso"""
+
+    def __init__(self, rate=DEFAULT_RATE, max_in_flight=8, max_retries=DEFAULT_MAX_RETRIES):
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate)
+        self._classes = {priority: _PriorityClass() for priority in PRIORITIES}
+        self._busy = set()          # chat con una richiesta in volo
+        self._in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._resume = asyncio.Event()
+        self._resume.set()
+        self._paused_until = 0.0
+        self._dispatcher = None
+        self._tasks = set()
+        self.retry_after = 0
+
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+            _active.append(self)
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+            _active.remove(self)
+        # Gli invii in volo si concludono, quelli in coda non partiranno più
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        dropped = 0
+        for queue in self._classes.values():
+            for pending in queue.chats.values():
+                for request in pending:
+                    if not request.future.done():
+                        request.future.cancel()
+                        dropped += 1
+            queue.chats.clear()
+            queue.ready.clear()
+            queue.in_ready.clear()
+            queue.depth = 0
+        if dropped:
+            logger.warning(f"⚠️ Coda di invio chiusa: {dropped} messaggi in attesa annullati")
+
+    # ---- accodamento ----
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        priority = BULK if rate_limit_args == BULK else INTERACTIVE
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(_Request(chat_id, priority, lambda: callback(*args, **kwargs), future))
+        return await future
+
+    def _enqueue(self, request, front=False):
+        queue = self._classes[request.priority]
+        pending = queue.chats.get(request.chat_id)
+        if pending is None:
+            pending = queue.chats[request.chat_id] = deque()
+            if request.chat_id not in self._busy:
+                queue.ready.append(request.chat_id)
+                queue.in_ready.add(request.chat_id)
+        if front:
+            pending.appendleft(request)
+        else:
+            pending.append(request)
+            queue.enqueued += 1
+        queue.depth += 1
+        self._wakeup.set()
+
+    def _next(self):
+        """Prossima richiesta da inviare: prima classe non vuota, chat in round robin"""
+        for priority in PRIORITIES:
+            queue = self._classes[priority]
+            while queue.ready:
+                chat_id = queue.ready.popleft()
+                queue.in_ready.discard(chat_id)
+                if chat_id in self._busy:
+                    continue  # ha già una richiesta in volo (dall'altra classe)
+                pending = queue.chats[chat_id]
+                request = pending.popleft()
+                if not pending:
+                    del queue.chats[chat_id]
+                # se restano richieste, la chat rientra nel turno con _release a invio concluso
+                queue.depth -= 1
+                return request
+        return None
+
+    def _release(self, chat_id):
+        """Fine di un invio: la chat torna disponibile nelle classi in cui ha richieste"""
+        self._busy.discard(chat_id)
+        for queue in self._classes.values():
+            if chat_id in queue.chats and chat_id not in queue.in_ready:
+                queue.ready.append(chat_id)
+                queue.in_ready.add(chat_id)
+        self._wakeup.set()
+
+    # ---- invio ----
+
+    async def _dispatch_loop(self):
+        while True:
+            await self._wakeup.wait()
+            await self._resume.wait()
+            if self._in_flight >= self.max_in_flight or not self._has_ready():
+                self._wakeup.clear()
+                continue
+            # Il token si prende prima di scegliere: chi arriva nel frattempo con priorità più alta passa avanti
+            await self._bucket.acquire()
+            await self._resume.wait()
+            request = self._next()
+            if request is None:
+                continue
+            self._busy.add(request.chat_id)
+            self._in_flight += 1
+            task = asyncio.create_task(self._send(request))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _has_ready(self):
+        return any(chat_id not in self._busy for queue in self._classes.values() for chat_id in queue.ready)
+
+    async def _send(self, request):
+        queue = self._classes[request.priority]
+        if request.attempts == 0:
+            waited = time.monotonic() - request.enqueued_at
+            queue.wait_total += waited
+            queue.wait_max = max(queue.wait_max, waited)
+            QUEUE_WAIT.observe(waited, request.priority)
+        request.attempts += 1
+        retry = False
+        outcome = None
+        try:
+            result = await request.call()
+        except RetryAfter as e:
+            outcome = RETRY_AFTER
+            self.retry_after += 1
+            if request.attempts <= self.max_retries:
+                retry = True
+                self._pause(e.retry_after)
+            elif not request.future.done():
+                request.future.set_exception(e)
+        except BaseException as e:  # noqa: B036 - l'errore va sempre a chi attende
+            if isinstance(e, Exception):
+                outcome = classify(e)
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            outcome = SUCCESS
+            queue.sent += 1
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            # I broadcast (BULK) contano i propri esiti per promemoria in broadcast.py
+            if outcome is not None and request.priority == INTERACTIVE:
+                SEND_OUTCOMES.inc(INTERACTIVE, outcome)
+            self._in_flight -= 1
+            if retry:
+                # Torna in testa alla sua chat: l'ordine per chat resta quello di arrivo
+                self._enqueue(request, front=True)
+            self._release(request.chat_id)
+
+    def _pause(self, retry_after):
+        if hasattr(retry_after, 'total_seconds'):
+            retry_after = retry_after.total_seconds()
+        until = time.monotonic() + float(retry_after)
+        if until <= self._paused_until:
+            return
+        self._paused_until = until
+        self._resume.clear()
+        logger.warning(f"⏸️ RetryAfter: coda di invio in pausa per {float(retry_after):.1f}s")
+        asyncio.get_running_loop().call_later(float(retry_after), self._maybe_resume)
+
+    def _maybe_resume(self):
+        if time.monotonic() >= self._paused_until:
+            self._resume.set()
+        else:
+            asyncio.get_running_loop().call_later(self._paused_until - time.monotonic(), self._maybe_resume)
+
+    # ---- statistiche ----
+
+    def stats(self):
+        """Profondità, totali e attese per classe di priorità"""
+        return {
+            'in_flight': self._in_flight,
+            'paused': not self._resume.is_set(),
+            'retry_after': self.retry_after,
+            'classes': {
+                priority: {
+                    'depth': queue.depth,
+                    'enqueued': queue.enqueued,
+                    'sent': queue.sent,
+                    'wait_avg_ms': round(queue.wait_total / max(1, queue.enqueued - queue.depth) * 1000, 3),
+                    'wait_max_ms': round(queue.wait_max * 1000, 3),
+                }
+                for priority, queue in self._classes.items()
+            },
+        }
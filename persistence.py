@@ -0,0 +1,227 @@
+"""
+Persistenza di conversazioni e user_data su SQLite
+
+Sostituisce PicklePersistence (che riscrive tutto il file a ogni flush):
+- scrive solo gli utenti modificati: PTB passa a `update_user_data` solo chi ha
+  ricevuto update dall'ultimo giro, e chi non è cambiato davvero viene saltato
+- le scritture di un giro (ogni `update_interval` secondi) finiscono in
+  un'unica transazione, su un thread dedicato
+- `user_data` è caricato pigramente: all'avvio non si legge nulla, il singolo
+  utente viene letto al suo primo update (`refresh_user_data`), quindi il tempo
+  di avvio non cresce con il numero di utenti
+- gli stati delle conversazioni attive (es. /setup a metà) vengono caricati
+  all'avvio: sono pochi, e senza di loro l'utente resterebbe bloccato
+
+Stesso file SQLite dello storage (tabelle `user_data` e `conversations`).
+bot_data e chat_data non sono persistiti.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """BasePersistence con scritture incrementali e caricamento pigro di user_data"""
+
+    def __init__(self, path, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        self._conn = None
+        self._loaded = set()        # utenti già letti dal database
+        self._written = {}          # user_id -> JSON dell'ultima scrittura (per saltare i non cambiati)
+        self._pending_users = {}    # user_id -> JSON | None (eliminato)
+        self._pending_states = {}   # (nome, chiave JSON) -> JSON | None (conversazione finita)
+        self._commit_task = None
+        self.writes = 0
+        self.skipped = 0
+        # Un solo thread: tutte le operazioni sulla connessione sono serializzate
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persistence')
+
+    # ---- database ----
+
+    def _connect(self):
+        if self._conn is not None:
+            return
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_data ("
+            " user_id INTEGER PRIMARY KEY,"
+            " data TEXT NOT NULL"
+            ")"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            " name TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " PRIMARY KEY (name, key)"
+            ") WITHOUT ROWID"
+        )
+        conn.commit()
+        self._conn = conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _read_user(self, user_id):
+        self._connect()
+        row = self._conn.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def _read_conversations(self, name):
+        self._connect()
+        rows = self._conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    def _write(self, users, states):
+        self._connect()
+        with self._conn:
+            upserts = [(user_id, data) for user_id, data in users.items() if data is not None]
+            deletes = [(user_id,) for user_id, data in users.items() if data is None]
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO user_data (user_id, data) VALUES (?, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET data = excluded.data",
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM user_data WHERE user_id = ?", deletes)
+            for (name, key), state in states.items():
+                if state is None:
+                    self._conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, key))
+                else:
+                    self._conn.execute(
+                        "INSERT INTO conversations (name, key, state) VALUES (?, ?, ?) "
+                        "ON CONFLICT (name, key) DO UPDATE SET state = excluded.state",
+                        (name, key, state)
+                    )
+
+    # ---- scritture coalescenti ----
+
+    def _schedule_commit(self):
+        """Le update_* di un giro di PTB sono raccolte e scritte in una sola transazione"""
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.create_task(self._commit())
+
+    async def _commit(self):
+        await asyncio.sleep(0)  # lascia completare le altre update_* dello stesso giro
+        # Quello che arriva durante una scrittura va nella transazione successiva
+        while self._pending_users or self._pending_states:
+            users, self._pending_users = self._pending_users, {}
+            states, self._pending_states = self._pending_states, {}
+            try:
+                await self._run(self._write, users, states)
+            except sqlite3.Error as e:
+                logger.error(f"Errore scrittura persistenza: {e}")
+                # Riprova al prossimo giro senza perdere modifiche più recenti
+                for user_id, data in users.items():
+                    self._pending_users.setdefault(user_id, data)
+                    self._written.pop(user_id, None)
+                for key, state in states.items():
+                    self._pending_states.setdefault(key, state)
+                return
+            self.writes += len(users) + len(states)
+
+    # ---- user_data ----
+
+    async def get_user_data(self):
+        # Caricamento pigro: vedi refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        """Prima volta che l'utente scrive dopo l'avvio: carica i suoi dati dal database"""
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        pending = self._pending_users.get(user_id)
+        data = pending if pending is not None else await self._run(self._read_user, user_id)
+        if data is None:
+            return
+        self._written[user_id] = data
+        # I valori già presenti in memoria (scritti prima del caricamento) hanno la precedenza
+        for key, value in json.loads(data).items():
+            user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id, data):
+        try:
+            encoded = json.dumps(data, sort_keys=True)
+        except (TypeError, ValueError) as e:
+            logger.error(f"user_data di {user_id} non serializzabile: {e}")
+            return
+        if self._written.get(user_id) == encoded:
+            self.skipped += 1
+            return
+        self._written[user_id] = encoded
+        self._loaded.add(user_id)
+        self._pending_users[user_id] = encoded
+        self._schedule_commit()
+
+    async def drop_user_data(self, user_id):
+        self._written.pop(user_id, None)
+        self._loaded.add(user_id)
+        self._pending_users[user_id] = None
+        self._schedule_commit()
+
+    # ---- conversazioni ----
+
+    async def get_conversations(self, name):
+        return await self._run(self._read_conversations, name)
+
+    async def update_conversation(self, name, key, new_state):
+        state = None if new_state is None else json.dumps(new_state)
+        self._pending_states[(name, json.dumps(list(key)))] = state
+        self._schedule_commit()
+
+    # ---- non persistiti ----
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # ---- chiusura ----
+
+    async def flush(self):
+        """Allo spegnimento: scrive le ultime modifiche e chiude il database"""
+        if self._commit_task is not None:
+            await self._commit_task
+        await self._commit()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
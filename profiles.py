@@ -0,0 +1,332 @@
+"""
+Profili utente in forma colonnare, compatti anche con milioni di utenti
+
+Un profilo come dict (nome, peso, altezza, età, obiettivo, attività, bmr,
+tdee, macro annidate, timestamp ISO) costa circa 800 byte in CPython;
+ProfileStore, indice compreso, ne usa circa 250 (benchmarks/bench_profiles.py).
+ProfileStore tiene una riga per utente in array tipizzati:
+- peso, altezza, bmr, tdee:   float64 (valori identici a quelli salvati)
+- età, macro:                 int32 (le quattro macro in colonne separate)
+- obiettivo, attività:        codici a un byte (nutrition.GOALS / ACTIVITY_LEVELS)
+- created_at:                 microsecondi, ricostruiti nella stessa stringa ISO
+- nome:                       lista di str
+più un dict `user_id -> riga` e una free list delle righe liberate.
+
+Chiavi fuori schema o valori che non entrano nella colonna (un peso intero,
+un obiettivo sconosciuto, un timestamp con fuso) finiscono in un dict di
+extra per riga: nessun dato viene perso o arrotondato.
+
+`store[user_id]` ritorna un ProfileView, una vista dict-like sulla riga:
+gli handler continuano a leggere e scrivere `profile['weight']`,
+`profile['macros']['calories']`, `profile.get(...)` come prima. `macros`
+letto dalla vista è un dict nuovo: per cambiarle va riassegnato per intero.
+Allo storage si passa `encode=dict` (la vista diventa il dict di sempre).
+
+Con le colonne il ricalcolo massivo (`recalculate`) lavora direttamente sugli
+array con NumPy, senza raccogliere e riscrivere un dict per utente.
+"""
+
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+
+from nutrition import ACTIVITY_LEVELS, DEFAULT_GOAL, GOALS, _numpy, batch_macros, recalculate_profiles
+
+MACROS = ('calories', 'protein', 'carbs', 'fats')
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Campi a colonna, nell'ordine in cui la vista li elenca
+_FLOATS = ('weight', 'height', 'bmr', 'tdee')
+_FIELDS = ('name', 'weight', 'height', 'age', 'goal', 'activity', 'bmr', 'tdee', 'macros', 'created_at')
+_BIT = {field: 1 << index for index, field in enumerate(_FIELDS)}
+_ENUMS = {'goal': GOALS, 'activity': ACTIVITY_LEVELS}
+_CODES = {field: {value: code for code, value in enumerate(values)} for field, values in _ENUMS.items()}
+
+_INT32 = (-2**31, 2**31 - 1)
+
+
+def _is_int32(value):
+    return type(value) is int and _INT32[0] <= value <= _INT32[1]
+
+
+def _encode_timestamp(value):
+    """Microsecondi di un timestamp ISO naive, se si ricostruisce nella stessa stringa"""
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.tzinfo is not None or moment.isoformat() != value:
+        return None
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def _decode_timestamp(micros):
+    return (_EPOCH + micros * _MICROSECOND).isoformat()
+
+
+class ProfileView(MutableMapping):
+    """Vista dict-like sul profilo di un utente (legge e scrive le colonne)"""
+
+    __slots__ = ('_store', '_user_id')
+
+    def __init__(self, store, user_id):
+        self._store = store
+        self._user_id = user_id
+
+    def __getitem__(self, key):
+        return self._store._get(self._store._index[self._user_id], key)
+
+    def __setitem__(self, key, value):
+        self._store._set(self._store._index[self._user_id], key, value)
+
+    def __delitem__(self, key):
+        self._store._delete(self._store._index[self._user_id], key)
+
+    def __iter__(self):
+        return iter(self._store._keys(self._store._index[self._user_id]))
+
+    def __len__(self):
+        return len(self._store._keys(self._store._index[self._user_id]))
+
+    def __repr__(self):
+        return f"ProfileView({dict(self)!r})"
+
+
+class ProfileStore(MutableMapping):
+    """`{user_id: profilo}` su array tipizzati, con viste dict-like per gli handler"""
+
+    def __init__(self):
+        self._index = {}       # user_id -> riga
+        self._free = []        # righe liberate, riusate dai nuovi profili
+        self._present = array('H')   # bitmask dei campi a colonna presenti nella riga
+        self._names = []
+        self._floats = {field: array('d') for field in _FLOATS}
+        self._age = array('i')
+        self._codes = {field: array('B') for field in _ENUMS}
+        self._macros = {field: array('i') for field in MACROS}
+        self._created = array('q')
+        self._extras = {}      # riga -> {chiave: valore} fuori schema
+
+    # ---- righe ----
+
+    def _new_row(self):
+        if self._free:
+            return self._free.pop()
+        self._present.append(0)
+        self._names.append(None)
+        for column in self._floats.values():
+            column.append(0.0)
+        self._age.append(0)
+        for column in self._codes.values():
+            column.append(0)
+        for column in self._macros.values():
+            column.append(0)
+        self._created.append(0)
+        return len(self._present) - 1
+
+    def _clear_row(self, row):
+        self._present[row] = 0
+        self._names[row] = None
+        self._extras.pop(row, None)
+
+    def _get(self, row, key):
+        bit = _BIT.get(key)
+        if bit is None or not self._present[row] & bit:
+            extras = self._extras.get(row)
+            if extras is None or key not in extras:
+                raise KeyError(key)
+            return extras[key]
+        if key in self._floats:
+            return self._floats[key][row]
+        if key == 'name':
+            return self._names[row]
+        if key == 'age':
+            return self._age[row]
+        if key in self._codes:
+            return _ENUMS[key][self._codes[key][row]]
+        if key == 'macros':
+            return {field: column[row] for field, column in self._macros.items()}
+        return _decode_timestamp(self._created[row])
+
+    def _set(self, row, key, value):
+        bit = _BIT.get(key)
+        stored = bit is not None and self._store_column(row, key, value)
+        if stored:
+            self._present[row] |= bit
+            extras = self._extras.get(row)
+            if extras is not None and key in extras:
+                self._discard_extra(row, key)
+        else:
+            if bit is not None:
+                self._present[row] &= ~bit
+            self._extras.setdefault(row, {})[key] = value
+
+    def _store_column(self, row, key, value):
+        """Scrive `value` nella colonna di `key`; False se non è rappresentabile senza perdite"""
+        if key in self._floats:
+            if type(value) is not float:
+                return False
+            self._floats[key][row] = value
+        elif key == 'name':
+            if not isinstance(value, str):
+                return False
+            self._names[row] = value
+        elif key == 'age':
+            if not _is_int32(value):
+                return False
+            self._age[row] = value
+        elif key in self._codes:
+            code = _CODES[key].get(value) if isinstance(value, str) else None
+            if code is None:
+                return False
+            self._codes[key][row] = code
+        elif key == 'macros':
+            if not isinstance(value, dict) or list(value) != list(MACROS) \
+                    or not all(_is_int32(amount) for amount in value.values()):
+                return False
+            for field, column in self._macros.items():
+                column[row] = value[field]
+        else:
+            micros = _encode_timestamp(value)
+            if micros is None:
+                return False
+            self._created[row] = micros
+        return True
+
+    def _discard_extra(self, row, key):
+        extras = self._extras[row]
+        del extras[key]
+        if not extras:
+            del self._extras[row]
+
+    def _delete(self, row, key):
+        bit = _BIT.get(key)
+        if bit is not None and self._present[row] & bit:
+            self._present[row] &= ~bit
+            if key == 'name':
+                self._names[row] = None
+        elif row in self._extras and key in self._extras[row]:
+            self._discard_extra(row, key)
+        else:
+            raise KeyError(key)
+
+    def _keys(self, row):
+        present = self._present[row]
+        keys = [field for field in _FIELDS if present & _BIT[field]]
+        extras = self._extras.get(row)
+        if extras:
+            keys.extend(extras)
+        return keys
+
+    # ---- mapping user_id -> profilo ----
+
+    def __getitem__(self, user_id):
+        if user_id not in self._index:
+            raise KeyError(user_id)
+        return ProfileView(self, user_id)
+
+    def __setitem__(self, user_id, profile):
+        """Sostituisce l'intero profilo (come assegnare un dict nuovo)"""
+        profile = dict(profile)   # copia: il valore può essere la vista della stessa riga
+        row = self._index.get(user_id)
+        if row is None:
+            row = self._index[user_id] = self._new_row()
+        else:
+            self._clear_row(row)
+        for key, value in profile.items():
+            self._set(row, key, value)
+
+    def __delitem__(self, user_id):
+        row = self._index.pop(user_id)
+        self._clear_row(row)
+        self._free.append(row)
+
+    def __contains__(self, user_id):
+        return user_id in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def clear(self):
+        self.__init__()
+
+    # ---- ricalcolo massivo ----
+
+    def recalculate(self):
+        """Come nutrition.recalculate_profiles, ma sulle colonne: ritorna gli user_id cambiati"""
+        np = _numpy()
+        needed = _BIT['weight'] | _BIT['height'] | _BIT['age']
+        user_ids, others = [], []
+        for user_id, row in self._index.items():
+            (user_ids if self._present[row] & needed == needed else others).append(user_id)
+        changed_others = self._recalculate_rows(others)
+        if not user_ids:
+            return changed_others
+        rows = np.fromiter((self._index[user_id] for user_id in user_ids), np.int64, len(user_ids))
+        present = np.frombuffer(self._present, np.uint16)[rows]
+
+        def column(values, dtype):
+            return np.frombuffer(values, dtype)[rows]
+
+        # Valore sconosciuto (negli extra) o mancante -> stesso ripiego di activity_code / goal_code
+        activity = column(self._codes['activity'], np.uint8).astype(np.int64)
+        activity[(present & _BIT['activity']) == 0] = len(ACTIVITY_LEVELS)
+        goal = column(self._codes['goal'], np.uint8).astype(np.int64)
+        goal[(present & _BIT['goal']) == 0] = GOALS.index(DEFAULT_GOAL)
+        male = np.fromiter(
+            (str(self._extras.get(row, {}).get('gender', 'male')).lower() == 'male' for row in rows.tolist()),
+            bool, len(rows)
+        )
+        result = batch_macros(
+            column(self._floats['weight'], np.float64), column(self._floats['height'], np.float64),
+            column(self._age, np.int32), activity, goal, male,
+        )
+
+        old = {field: column(self._floats[field], np.float64) for field in ('bmr', 'tdee')}
+        old.update({field: column(self._macros[field], np.int32) for field in MACROS})
+        all_bits = _BIT['bmr'] | _BIT['tdee'] | _BIT['macros']
+        changed = (present & all_bits) != all_bits
+        for field, values in old.items():
+            changed |= values != result[field]
+
+        # Scrittura diretta negli array (le viste NumPy vanno rilasciate prima di ridimensionarli)
+        for field in ('bmr', 'tdee'):
+            target = np.frombuffer(self._floats[field], np.float64)
+            target[rows] = result[field]
+            del target
+        for field in MACROS:
+            target = np.frombuffer(self._macros[field], np.int32)
+            target[rows] = result[field]
+            del target
+        self._present_set(rows, all_bits)
+        return [user_ids[index] for index in np.flatnonzero(changed).tolist()] + changed_others
+
+    def _recalculate_rows(self, user_ids):
+        """Ricalcolo riga per riga dei (rari) profili con peso/altezza/età fuori colonna"""
+        profiles = {}
+        for user_id in user_ids:
+            view = self[user_id]
+            if 'weight' in view and 'height' in view and 'age' in view:
+                profiles[user_id] = dict(view)
+        changed = recalculate_profiles(profiles)
+        for user_id, profile in profiles.items():
+            view = self[user_id]
+            for key in ('bmr', 'tdee', 'macros'):
+                view[key] = profile[key]
+        return changed
+
+    def _present_set(self, rows, bits):
+        for row in rows.tolist():
+            self._present[row] |= bits
+            extras = self._extras.get(row)
+            if extras:
+                for key in ('bmr', 'tdee', 'macros'):
+                    if key in extras:
+                        self._discard_extra(row, key)
@@ -0,0 +1,180 @@
+"""
+Report settimanale personalizzato, preparato in anticipo
+
+Pipeline:
+1. `REPORT_LEAD_MINUTES` prima dell'invio il tick dei promemoria sbircia il
+   bucket settimanale di quel minuto e avvia `ReportQueue.prepare`
+2. la preparazione è un passaggio in streaming sugli utenti: per ognuno
+   aggrega la settimana (punti, sgarro guadagnato, variazione del peso,
+   aderenza) e scrive il messaggio già pronto in uno spool
+3. all'orario del report il broadcast legge lo spool in streaming e fa
+   solo I/O; chi non era nello spool (iscritto dopo, o un altro leader ha
+   preparato) viene renderizzato al volo, come chi ha cambiato attività o
+   peso dopo l'avvio della preparazione (segnalato con `ReportQueue.touch`)
+
+Memoria limitata: lo spool è un SpooledTemporaryFile che resta in RAM fino a
+`memory_budget` byte e poi passa su disco, e durante l'invio si legge un
+record alla volta. Con 100k utenti in memoria restano solo gli id in uscita
+dalla timing wheel (vedi benchmarks/bench_reports.py).
+"""
+
+import asyncio
+import logging
+import tempfile
+
+from activity import MAX_POINTS, STREAK_POINTS, adherence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET = 8 * 1024 * 1024   # byte di spool in RAM prima di passare su disco
+YIELD_EVERY = 1000                         # utenti elaborati prima di cedere il loop
+
+
+def week_stats(activity_state, series):
+    """Aggregati della settimana di un utente (dallo stato attività e dallo storico peso)"""
+    stats = {'points': 0, 'sgarro': False, 'adherence': 0, 'streak': 0, 'weight_delta': None}
+    if activity_state is not None:
+        points = min(activity_state['raw'], MAX_POINTS)
+        stats.update(
+            points=points,
+            sgarro=points >= STREAK_POINTS,
+            adherence=adherence(activity_state),
+            streak=activity_state['streak'],
+        )
+    if series is not None:
+        stats['weight_delta'] = series.weekly_delta
+    return stats
+
+
+def render_report(name, stats):
+    """Testo Markdown del report settimanale"""
+    points = stats['points']
+    lines = [f"📊 *REPORT SETTIMANALE*\n\nEcco la tua settimana, {name}!\n"]
+    lines.append(f"🏆 Punti: *{points}/{MAX_POINTS}*")
+    lines.append(f"✅ Aderenza al piano: *{stats['adherence']}%*")
+    if stats['weight_delta'] is not None:
+        lines.append(f"⚖️ Peso vs settimana scorsa: *{stats['weight_delta']:+.1f} kg*")
+    if stats['sgarro']:
+        lines.append(f"🍕 Sgarro guadagnato! Streak: {stats['streak'] + 1} settimane 🔥")
+    else:
+        lines.append(f"🍕 Ti mancano {STREAK_POINTS - points} punti per lo sgarro")
+    lines.append("\nResetta la settimana nell'app e riparti! La costanza batte il talento 💪")
+    return '\n'.join(lines)
+
+
+class ReportSpool:
+    """Coda di messaggi pronti (chat_id, testo): in RAM fino al budget, poi su disco"""
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self._file = tempfile.SpooledTemporaryFile(max_size=memory_budget, mode='w+b')
+        self.count = 0
+        self.minute = None   # minuto di invio, assegnato da ReportQueue.take
+
+    def append(self, chat_id, text):
+        # Record: "chat_id lunghezza\n" + testo UTF-8 (più economico di JSON, testi multiriga)
+        data = text.encode()
+        self._file.write(b'%d %d\n' % (chat_id, len(data)) + data)
+        self.count += 1
+
+    @property
+    def on_disk(self):
+        return self._file._rolled
+
+    @property
+    def size(self):
+        return self._file.tell()
+
+    def __iter__(self):
+        """Legge i messaggi un record alla volta (una sola lettura per spool)"""
+        self._file.seek(0)
+        readline, read = self._file.readline, self._file.read
+        while True:
+            header = readline()
+            if not header:
+                return
+            chat_id, length = header.split()
+            yield int(chat_id), read(int(length)).decode()
+
+    def close(self):
+        self._file.close()
+
+
+async def build_spool(user_ids, render, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Renderizza in streaming i report di `user_ids` in uno spool (cede il loop ogni YIELD_EVERY utenti)"""
+    spool = ReportSpool(memory_budget)
+    for index, user_id in enumerate(user_ids, 1):
+        try:
+            spool.append(user_id, render(user_id))
+        except Exception as e:
+            logger.error(f"Errore report settimanale per {user_id}: {e}")
+        if index % YIELD_EVERY == 0:
+            await asyncio.sleep(0)
+    return spool
+
+
+class ReportQueue:
+    """Spool dei report preparati in anticipo, per minuto di invio"""
+
+    def __init__(self, render, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.render = render
+        self.memory_budget = memory_budget
+        self._pending = {}   # minuto -> Task che produce un ReportSpool
+        self._changed = {}   # minuto -> utenti modificati dopo l'avvio della preparazione
+
+    def prepare(self, minute, user_ids):
+        """Avvia la preparazione dei report del minuto `minute` (una sola volta)"""
+        if minute in self._pending or not user_ids:
+            return
+        self._changed[minute] = set()
+        self._pending[minute] = asyncio.create_task(build_spool(user_ids, self.render, self.memory_budget))
+
+    def touch(self, user_id):
+        """Attività o peso di `user_id` cambiati: il report già preparato va rifatto all'invio"""
+        for changed in self._changed.values():
+            changed.add(user_id)
+
+    async def take(self, minute):
+        """Spool pronti per i minuti fino a `minute` (attende quelli ancora in preparazione)"""
+        spools = []
+        for ready_minute in sorted(m for m in self._pending if m <= minute):
+            spool = await self._pending.pop(ready_minute)
+            spool.minute = ready_minute
+            logger.info(
+                f"📊 Report preparati: {spool.count} ({spool.size // 1024} KiB"
+                f"{', su disco' if spool.on_disk else ''})"
+            )
+            spools.append(spool)
+        return spools
+
+    def messages(self, spools, recipients):
+        """(chat_id, testo) per i soli `recipients`: prima dagli spool, poi al volo chi mancava"""
+        missing = set(recipients)
+        for spool in spools:
+            # Letto a ogni record: vale anche per le modifiche arrivate durante l'invio
+            changed = self._changed.get(spool.minute, ())
+            for chat_id, text in spool:
+                if chat_id in missing:
+                    missing.discard(chat_id)
+                    if chat_id in changed:
+                        text = self._render(chat_id) or text
+                    yield chat_id, text
+            spool.close()
+            self._changed.pop(spool.minute, None)
+        for chat_id in list(missing):
+            text = self._render(chat_id)
+            if text is not None:
+                yield chat_id, text
+
+    def _render(self, chat_id):
+        try:
+            return self.render(chat_id)
+        except Exception as e:
+            logger.error(f"Errore report settimanale per {chat_id}: {e}")
+            return None
+
+    def discard(self):
+        """Allo spegnimento: annulla le preparazioni in corso"""
+        for task in self._pending.values():
+            task.cancel()
+        self._pending.clear()
+        self._changed.clear()
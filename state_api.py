@@ -0,0 +1,225 @@
+"""
+API HTTP per lo stato della Mini App, ospitata dal bot
+
+La Mini App salvava tutto `state` in CloudStorage a ogni modifica (un blob
+unico, limitato in dimensione). Con l'API lo stato vive nello storage del bot:
+l'app scarica lo stato solo se è cambiato e invia solo i campi modificati.
+
+    GET   /app/state   -> 200 {"version": 7, "state": {...}} con ETag "7"
+                          304 se If-None-Match coincide con la versione attuale
+    PATCH /app/state   {"set": {"streak": 3, "weekData/monday": {...}},
+                        "unset": ["customWorkouts/monday"],
+                        "ackVersion": 5, "week": 2, "events": [...]}
+                       -> 200 {"version": 8} con ETag "8"
+                          412 se If-Match non è la versione attuale
+
+Le chiavi di `set`/`unset` sono un campo di primo livello o `campo/elemento`
+per un elemento di un oggetto (es. un giorno di weekData), come in sync.py.
+`ackVersion` ed `events` hanno lo stesso significato che in web_app_data: il
+bot li riceve tramite `on_patch` e aggiorna delta sync e punti settimanali.
+
+Ogni richiesta è autenticata con `Authorization: tma <initData>`: la firma
+HMAC-SHA256 di Telegram (chiave derivata dal token del bot) garantisce
+l'identità dell'utente, senza sessioni né cookie.
+
+Lo stato per utente è un dict JSON-serializzabile (persistito dallo storage):
+    {'v': 8, 'state': {'streak': 3, 'weekData': {...}, ...}}
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+STATE_PATH = '/app/state'
+INIT_DATA_MAX_AGE = 24 * 3600   # secondi di validità di initData
+MAX_STATE_BYTES = 64 * 1024     # stato serializzato per utente
+MAX_PATCH_FIELDS = 64           # campi per PATCH
+
+
+class StateConflict(Exception):
+    """If-Match non corrisponde alla versione attuale dello stato"""
+
+
+def verify_init_data(init_data, token, max_age=INIT_DATA_MAX_AGE, now=None):
+    """Verifica la firma di initData della Mini App; ritorna lo user_id (ValueError se non valido)"""
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+    except ValueError:
+        raise ValueError("initData malformato") from None
+    received = fields.pop('hash', '')
+    check = '\n'.join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret = hmac.new(b'WebAppData', token.encode(), hashlib.sha256).digest()
+    expected = hmac.new(secret, check.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, received):
+        raise ValueError("firma di initData non valida")
+    try:
+        auth_date = int(fields.get('auth_date', ''))
+        user = json.loads(fields.get('user', 'null'))
+    except ValueError:
+        raise ValueError("initData incompleto") from None
+    if max_age and (now if now is not None else time.time()) - auth_date > max_age:
+        raise ValueError("initData scaduto")
+    if not isinstance(user, dict) or type(user.get('id')) is not int:
+        raise ValueError("utente mancante in initData")
+    return user['id']
+
+
+def etag(version):
+    return f'"{version}"'
+
+
+def _matches(header, version):
+    """If-None-Match / If-Match: lista di ETag o `*`"""
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag(version) in tags
+
+
+class MiniAppStates:
+    """Stato della Mini App per utente, con versione monotona usata come ETag"""
+
+    def __init__(self, states, max_bytes=MAX_STATE_BYTES, on_change=None):
+        self._states = states
+        self.max_bytes = max_bytes
+        self._on_change = on_change or (lambda user_id: None)
+
+    def get(self, user_id):
+        """(versione, stato); versione 0 e stato vuoto se l'app non ha mai salvato"""
+        entry = self._states.get(user_id)
+        return (entry['v'], entry['state']) if entry else (0, {})
+
+    def patch(self, user_id, set_fields, unset=(), expected=None):
+        """Applica una patch per campi; ritorna la nuova versione
+
+        `expected` è la versione attesa (If-Match): StateConflict se diversa.
+        ValueError se la patch non è valida o lo stato supererebbe `max_bytes`.
+        """
+        version, current = self.get(user_id)
+        if expected is not None and expected != version:
+            raise StateConflict(f"versione attuale {version}")
+        if len(set_fields) + len(unset) > MAX_PATCH_FIELDS:
+            raise ValueError("troppi campi nella patch")
+        # Copia di primo livello: lo stato salvato cambia solo se la patch è valida
+        state = dict(current)
+        for key, value in set_fields.items():
+            name, item = self._split(key)
+            if item is None:
+                state[name] = value
+            else:
+                parent = state.get(name)
+                state[name] = {**(parent if isinstance(parent, dict) else {}), item: value}
+        for key in unset:
+            name, item = self._split(key)
+            if item is None:
+                state.pop(name, None)
+            elif isinstance(state.get(name), dict):
+                state[name] = {k: v for k, v in state[name].items() if k != item}
+        if len(json.dumps(state, separators=(',', ':')).encode()) > self.max_bytes:
+            raise ValueError(f"stato oltre {self.max_bytes} byte")
+        if state == current:
+            return version
+        version += 1
+        self._states[user_id] = {'v': version, 'state': state}
+        self._on_change(user_id)
+        return version
+
+    @staticmethod
+    def _split(key):
+        if not isinstance(key, str) or not key:
+            raise ValueError(f"campo non valido: {key!r}")
+        name, separator, item = key.partition('/')
+        if not name or (separator and not item):
+            raise ValueError(f"campo non valido: {key!r}")
+        return name, item or None
+
+
+def _origin(url):
+    """Origin (schema://host[:porta]) della Mini App, per il CORS"""
+    if not url:
+        return '*'
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def add_state_routes(server, store, token, app_url=None, on_patch=None, path=STATE_PATH):
+    """Registra GET/PATCH/OPTIONS dello stato sul WebServer
+
+    `on_patch(user_id, body)` riceve il corpo di ogni PATCH accettata, per
+    `ackVersion` ed `events`.
+    """
+    from aiohttp import web
+
+    cors = {
+        'Access-Control-Allow-Origin': _origin(app_url),
+        'Access-Control-Allow-Methods': 'GET, PATCH, OPTIONS',
+        'Access-Control-Allow-Headers': 'Authorization, Content-Type, If-Match, If-None-Match',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Access-Control-Max-Age': '86400',
+        'Vary': 'Origin',
+    }
+
+    def authenticate(request):
+        scheme, _, init_data = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'tma' or not init_data:
+            raise web.HTTPUnauthorized(headers=cors)
+        try:
+            return verify_init_data(init_data, token)
+        except ValueError as e:
+            logger.info(f"🔒 Richiesta stato rifiutata: {e}")
+            raise web.HTTPUnauthorized(headers=cors) from None
+
+    def versioned(body, version, status=200):
+        headers = {**cors, 'ETag': etag(version), 'Cache-Control': 'no-cache'}
+        return web.json_response(body, status=status, headers=headers)
+
+    async def get_state(request):
+        user_id = authenticate(request)
+        version, state = store.get(user_id)
+        if _matches(request.headers.get('If-None-Match', ''), version):
+            return web.Response(status=304, headers={**cors, 'ETag': etag(version)})
+        return versioned({'version': version, 'state': state}, version)
+
+    async def patch_state(request):
+        user_id = authenticate(request)
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(headers=cors) from None
+        set_fields = body.get('set', {}) if isinstance(body, dict) else None
+        unset = body.get('unset', []) if isinstance(body, dict) else None
+        if not isinstance(set_fields, dict) or not isinstance(unset, list):
+            raise web.HTTPBadRequest(headers=cors)
+        expected = None
+        if_match = request.headers.get('If-Match')
+        if if_match and if_match.strip() != '*':
+            try:
+                expected = int(if_match.strip().removeprefix('W/').strip('"'))
+            except ValueError:
+                raise web.HTTPBadRequest(headers=cors) from None
+        try:
+            version = store.patch(user_id, set_fields, unset, expected)
+        except StateConflict:
+            current, state = store.get(user_id)
+            return versioned({'version': current, 'state': state}, current, status=412)
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=422, headers=cors)
+        if on_patch is not None:
+            try:
+                on_patch(user_id, body)
+            except (TypeError, ValueError) as e:
+                # Lo stato è salvato: solo gli eventi allegati sono scartati
+                logger.warning(f"⚠️ Eventi della patch di {user_id} scartati: {e}")
+            except Exception:
+                logger.exception(f"❌ Errore negli eventi della patch di {user_id}")
+        return versioned({'version': version}, version)
+
+    async def preflight(request):
+        return web.Response(status=204, headers=cors)
+
+    server.add_route('GET', path, get_state)
+    server.add_route('PATCH', path, patch_state)
+    server.add_route('OPTIONS', path, preflight)
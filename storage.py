@@ -0,0 +1,362 @@
+"""
+Storage persistente per Winter Grind
+
+I dati restano in dizionari in memoria (cache calda letta dagli handler),
+il backend li rende durevoli in modalità write-behind:
+- gli handler chiamano solo `storage.touch(namespace, user_id)` (O(1), nessun I/O)
+- un task in background scrive i record modificati in un'unica transazione
+  ogni `flush_interval` secondi, su un thread dedicato
+
+Backend disponibili:
+- MemoryStorage: nessuna persistenza (comportamento storico)
+- SQLiteStorage: SQLite in modalità WAL
+
+Multi-istanza: con più repliche sullo stesso file SQLite ogni scrittura finisce
+anche in un change log (`changes`); a ogni ciclo di flush ogni istanza rilegge
+i record modificati dalle altre e aggiorna le proprie cache (i listener
+registrati con `on_change` vengono avvisati). Le scritture in blocco (import)
+lasciano invece un solo marcatore `reload:<namespace>`: chi lo legge ricarica
+l'intero namespace. In entrambi i casi le modifiche si applicano a blocchi di
+`APPLY_CHUNK` record, cedendo il loop tra un blocco e l'altro.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 2.0  # secondi
+CHANGE_LOG_RETENTION = 3600   # secondi di change log conservati per le altre istanze
+APPLY_CHUNK = 5000            # record remoti applicati alle cache prima di cedere il loop
+RELOAD_PREFIX = 'reload:'     # namespace dei marcatori "ricarica tutto" nel change log
+
+
+class Storage:
+    """Interfaccia comune dei backend di storage"""
+
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._caches = {}
+        self._codecs = {}
+        self._dirty = {}
+        self._listeners = {}
+        self._task = None
+
+    def register(self, namespace, cache, encode=None, decode=None):
+        """Associa un dizionario `{user_id: dict}` a un namespace persistente
+
+        Per valori non JSON (es. serie compatte) `encode` li converte in un
+        oggetto serializzabile e `decode` li ricostruisce al caricamento.
+        """
+        self._caches[namespace] = cache
+        self._codecs[namespace] = (encode, decode)
+        self._dirty[namespace] = set()
+
+    def _decode(self, namespace, data):
+        value = json.loads(data)
+        decode = self._codecs[namespace][1]
+        return decode(value) if decode is not None else value
+
+    def on_change(self, namespace, callback):
+        """`callback(key, value)` quando un'altra istanza modifica un record (value None = eliminato)"""
+        self._listeners.setdefault(namespace, []).append(callback)
+
+    def _apply_remote(self, changes):
+        """Applica alle cache i record modificati da altre istanze: {namespace: {key: json | None}}"""
+        for namespace, rows in changes.items():
+            cache = self._caches.get(namespace)
+            if cache is None:
+                continue
+            for key, data in rows.items():
+                if key in self._dirty[namespace]:
+                    continue  # modifica locale non ancora scritta: vince quella
+                if data is None:
+                    cache.pop(key, None)
+                    value = None
+                else:
+                    value = self._decode(namespace, data)
+                    current = cache.get(key)
+                    if isinstance(current, dict) and isinstance(value, dict):
+                        # Aggiornamento in place: gli handler in corso vedono lo stesso oggetto
+                        current.clear()
+                        current.update(value)
+                        value = current
+                    else:
+                        cache[key] = value
+                for callback in self._listeners.get(namespace, ()):
+                    callback(key, value)
+
+    def touch(self, namespace, key):
+        """Segna un record come modificato (verrà scritto al prossimo flush)"""
+        self._dirty[namespace].add(key)
+
+    @property
+    def pending(self):
+        return sum(len(keys) for keys in self._dirty.values())
+
+    def _take_dirty(self):
+        """Serializza e svuota i record sporchi: {namespace: [(key, json | None)]}"""
+        batch = {}
+        for namespace, keys in self._dirty.items():
+            if not keys:
+                continue
+            cache = self._caches[namespace]
+            encode = self._codecs[namespace][0]
+            rows = []
+            for key in keys:
+                value = cache.get(key)
+                if value is not None and encode is not None:
+                    value = encode(value)
+                rows.append((key, json.dumps(value) if value is not None else None))
+            batch[namespace] = rows
+            self._dirty[namespace] = set()
+        return batch
+
+    def _restore_dirty(self, batch):
+        """Scrittura fallita: i record del batch tornano sporchi (con quelli toccati nel frattempo)"""
+        for namespace, rows in batch.items():
+            self._dirty[namespace].update(key for key, _ in rows)
+
+    async def open(self):
+        """Carica i dati persistiti nelle cache e avvia il flush periodico"""
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                await self.pull()
+            except Exception as e:
+                logger.error(f"Errore flush storage: {e}")
+
+    async def flush(self):
+        """Scrive su disco tutti i record modificati"""
+        self._take_dirty()
+
+    async def pull(self):
+        """Rilegge le modifiche fatte da altre istanze (nessuna, per default)"""
+
+    async def close(self):
+        """Ferma il flush periodico e salva le ultime modifiche"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class MemoryStorage(Storage):
+    """Nessuna persistenza: i dati vivono solo nei dizionari in memoria"""
+
+
+def connect(path):
+    """Connessione al file SQLite dello storage (WAL), con le tabelle create se mancano"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS records ("
+        " namespace TEXT NOT NULL,"
+        " key INTEGER NOT NULL,"
+        " data TEXT NOT NULL,"
+        " updated_at REAL NOT NULL,"
+        " PRIMARY KEY (namespace, key)"
+        ") WITHOUT ROWID"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS changes ("
+        " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " namespace TEXT NOT NULL,"
+        " key INTEGER NOT NULL,"
+        " instance TEXT NOT NULL,"
+        " created_at REAL NOT NULL"
+        ")"
+    )
+    conn.commit()
+    return conn
+
+
+def upsert_rows(conn, rows):
+    """Upsert di tuple già pronte (namespace, key, json, updated_at), senza change log"""
+    conn.executemany(
+        "INSERT INTO records (namespace, key, data, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (namespace, key) DO UPDATE SET "
+        "data = excluded.data, updated_at = excluded.updated_at",
+        rows
+    )
+
+
+def mark_reload(conn, namespaces, instance_id, now):
+    """Marcatore nel change log: le altre istanze ricaricano per intero questi namespace"""
+    conn.executemany(
+        "INSERT INTO changes (namespace, key, instance, created_at) VALUES (?, 0, ?, ?)",
+        [(RELOAD_PREFIX + namespace, instance_id, now) for namespace in namespaces]
+    )
+
+
+def write_records(conn, batch, instance_id, now):
+    """Upsert/delete di {namespace: [(key, json | None)]} e voci nel change log (dentro una transazione)"""
+    for namespace, rows in batch.items():
+        upserts = [(namespace, key, data, now) for key, data in rows if data is not None]
+        deletes = [(namespace, key) for key, data in rows if data is None]
+        if upserts:
+            upsert_rows(conn, upserts)
+        if deletes:
+            conn.executemany(
+                "DELETE FROM records WHERE namespace = ? AND key = ?", deletes
+            )
+        conn.executemany(
+            "INSERT INTO changes (namespace, key, instance, created_at) VALUES (?, ?, ?, ?)",
+            [(namespace, key, instance_id, now) for key, _ in rows]
+        )
+
+
+class SQLiteStorage(Storage):
+    """Backend SQLite (WAL) con write-behind su un thread dedicato"""
+
+    def __init__(self, path, flush_interval=DEFAULT_FLUSH_INTERVAL, instance_id=None):
+        super().__init__(flush_interval)
+        self.path = path
+        self.instance_id = instance_id or f"{os.getpid()}"
+        self._conn = None
+        self._last_seq = 0
+        self._pruned_at = 0.0
+        # Un solo thread: tutte le operazioni sulla connessione sono serializzate
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
+
+    def _connect(self):
+        return connect(self.path)
+
+    def _load(self):
+        loaded = {}
+        self._last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        for namespace, cache in self._caches.items():
+            rows = self._conn.execute(
+                "SELECT key, data FROM records WHERE namespace = ?", (namespace,)
+            )
+            for key, data in rows:
+                cache[key] = self._decode(namespace, data)
+            loaded[namespace] = len(cache)
+        return loaded
+
+    def _write(self, batch):
+        now = time.time()
+        with self._conn:
+            write_records(self._conn, batch, self.instance_id, now)
+            if now - self._pruned_at > CHANGE_LOG_RETENTION / 10:
+                self._conn.execute("DELETE FROM changes WHERE created_at < ?", (now - CHANGE_LOG_RETENTION,))
+                self._pruned_at = now
+
+    def _read_changes(self):
+        """(record modificati da altre istanze dopo l'ultimo seq letto, namespace da ricaricare)"""
+        rows = self._conn.execute(
+            "SELECT seq, namespace, key, instance FROM changes WHERE seq > ? ORDER BY seq",
+            (self._last_seq,)
+        ).fetchall()
+        changed = {}
+        reload = set()
+        for seq, namespace, key, instance in rows:
+            self._last_seq = seq
+            if instance == self.instance_id:
+                continue
+            if namespace.startswith(RELOAD_PREFIX):
+                reload.add(namespace[len(RELOAD_PREFIX):])
+            else:
+                changed.setdefault(namespace, set()).add(key)
+        changes = {}
+        for namespace, keys in changed.items():
+            if namespace in reload:
+                continue  # già compresi nel ricaricamento
+            data = {key: None for key in keys}
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT data FROM records WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                if row is not None:
+                    data[key] = row[0]
+            changes[namespace] = data
+        return changes, reload
+
+    def _read_namespace(self, namespace, after, limit):
+        """Blocco di record di un namespace con chiave > `after`, in ordine di chiave"""
+        return self._conn.execute(
+            "SELECT key, data FROM records WHERE namespace = ? AND key > ? ORDER BY key LIMIT ?",
+            (namespace, after, limit)
+        ).fetchall()
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self._conn = await loop.run_in_executor(self._executor, self._connect)
+        loaded = await loop.run_in_executor(self._executor, self._load)
+        logger.info(f"💾 Storage SQLite {self.path}: caricati {loaded}")
+        await super().open()
+
+    async def flush(self):
+        if self._conn is None:
+            return
+        batch = self._take_dirty()
+        if not batch:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write, batch)
+        except Exception:
+            # Riprova al prossimo flush: i valori vengono riletti dalle cache
+            self._restore_dirty(batch)
+            raise
+
+    async def pull(self):
+        if self._conn is None:
+            return
+        loop = asyncio.get_running_loop()
+        changes, reload = await loop.run_in_executor(self._executor, self._read_changes)
+        updated = 0
+        for namespace, rows in changes.items():
+            items = list(rows.items())
+            for start in range(0, len(items), APPLY_CHUNK):
+                self._apply_remote({namespace: dict(items[start:start + APPLY_CHUNK])})
+                await asyncio.sleep(0)
+            updated += len(items)
+        for namespace in reload:
+            if namespace not in self._caches:
+                continue
+            # L'import non elimina record: basta riapplicare quelli presenti
+            after = float('-inf')
+            while True:
+                rows = await loop.run_in_executor(self._executor, self._read_namespace, namespace, after, APPLY_CHUNK)
+                if not rows:
+                    break
+                self._apply_remote({namespace: dict(rows)})
+                updated += len(rows)
+                after = rows[-1][0]
+                await asyncio.sleep(0)
+            logger.info(f"🔄 Storage: namespace {namespace} ricaricato dopo un import")
+        if updated:
+            logger.info(f"🔄 Storage: {updated} record aggiornati da altre istanze")
+
+    async def close(self):
+        await super().close()
+        if self._conn is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+def create_storage(backend, path=None, flush_interval=DEFAULT_FLUSH_INTERVAL, instance_id=None):
+    """Crea il backend di storage richiesto ('sqlite' o 'memory')"""
+    backend = (backend or 'memory').lower()
+    if backend == 'sqlite':
+        return SQLiteStorage(path, flush_interval=flush_interval, instance_id=instance_id)
+    if backend == 'memory':
+        return MemoryStorage(flush_interval=flush_interval)
+    raise ValueError(f"Backend di storage sconosciuto: {backend}")
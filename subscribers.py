@@ -0,0 +1,52 @@
+"""
+Indice degli iscritti ai promemoria
+
+Mantiene, per ogni tipo di promemoria, l'insieme delle chat che lo ricevono.
+L'indice viene aggiornato in modo incrementale a ogni modifica delle
+impostazioni, così un broadcast ottiene i destinatari in O(destinatari)
+senza scorrere tutto `user_settings`.
+"""
+
+REMINDER_TYPES = ('morning', 'evening', 'weekly')
+
+
+def is_subscribed(settings, reminder_type):
+    """Un utente riceve un promemoria se ha le notifiche attive E quel tipo attivo"""
+    return settings.get('notifications', True) and settings.get(f'reminder_{reminder_type}', True)
+
+
+class SubscriberIndex:
+    """Insiemi di chat ID iscritte, uno per tipo di promemoria"""
+
+    def __init__(self):
+        self._subscribers = {reminder_type: set() for reminder_type in REMINDER_TYPES}
+
+    def update(self, user_id, settings):
+        """Riallinea l'indice alle impostazioni correnti di un utente"""
+        for reminder_type, chat_ids in self._subscribers.items():
+            if is_subscribed(settings, reminder_type):
+                chat_ids.add(user_id)
+            else:
+                chat_ids.discard(user_id)
+
+    def remove(self, user_id):
+        """Rimuove un utente da tutti i promemoria"""
+        for chat_ids in self._subscribers.values():
+            chat_ids.discard(user_id)
+
+    def rebuild(self, user_settings):
+        """Ricostruisce l'indice da zero (solo all'avvio, dopo il caricamento dallo storage)"""
+        for chat_ids in self._subscribers.values():
+            chat_ids.clear()
+        for user_id, settings in user_settings.items():
+            self.update(user_id, settings)
+
+    def has(self, reminder_type, user_id):
+        return user_id in self._subscribers[reminder_type]
+
+    def recipients(self, reminder_type):
+        """Snapshot dei destinatari di un promemoria"""
+        return list(self._subscribers[reminder_type])
+
+    def count(self, reminder_type):
+        return len(self._subscribers[reminder_type])
@@ -0,0 +1,85 @@
+"""
+Delta sync dello stato della Mini App
+
+Il bot tiene per ogni utente una versione monotona dello stato che ha inviato
+alla Mini App. Ogni modifica prende una nuova versione; un deep link contiene
+solo i campi cambiati dopo l'ultima versione confermata dall'app (`ackVersion`
+in web_app_data), raggruppati in `patches` ordinate per versione. L'app applica
+solo le patch più recenti della propria `syncVersion`, quindi riaprire un link
+vecchio o ricevere di nuovo una modifica già applicata non ha effetti.
+
+Le collezioni sono tracciate per elemento, così il payload cresce con le
+modifiche e non con la storia:
+- savedWeights: un elemento per settimana ("savedWeights/<week>")
+- weekData: un elemento per giorno ("weekData/<day>")
+
+Lo stato per utente è un dict JSON-serializzabile (persistito dallo storage):
+    {'v': 7, 'acked': 3, 'fields': {'macros': [5, {...}], 'savedWeights/12': [6, {...}]}}
+"""
+
+def _field_keys(fields):
+    """Espande i campi in chiavi tracciate: collezioni per elemento, il resto per nome"""
+    for name, value in fields.items():
+        if name == 'savedWeights':
+            for entry in value:
+                yield f"savedWeights/{entry['week']}", entry
+        elif name == 'weekData':
+            for day, entry in value.items():
+                yield f"weekData/{day}", entry
+        else:
+            yield name, value
+
+
+class AppStateTracker:
+    """Versioni per utente dello stato inviato alla Mini App"""
+
+    def __init__(self, states):
+        self._states = states
+
+    def version(self, user_id):
+        state = self._states.get(user_id)
+        return state['v'] if state else 0
+
+    def update(self, user_id, fields):
+        """Registra una modifica (nuova versione) ai campi indicati; ritorna la versione"""
+        state = self._states.setdefault(user_id, {'v': 0, 'acked': 0, 'fields': {}})
+        if not fields:
+            return state['v']
+        state['v'] += 1
+        for key, value in _field_keys(fields):
+            state['fields'][key] = [state['v'], value]
+        return state['v']
+
+    def delta(self, user_id):
+        """Patch non ancora confermate dalla Mini App, pronte per il codec"""
+        state = self._states.get(user_id)
+        if not state or not state['fields']:
+            return {}
+        patches = {}
+        for key, (version, value) in state['fields'].items():
+            patch = patches.setdefault(version, {'stateVersion': version})
+            name, _, item = key.partition('/')
+            if name == 'savedWeights':
+                patch.setdefault('savedWeights', []).append(value)
+            elif name == 'weekData':
+                patch.setdefault('weekData', {})[item] = value
+            else:
+                patch[name] = value
+        for patch in patches.values():
+            if 'savedWeights' in patch:
+                patch['savedWeights'].sort(key=lambda entry: entry['week'])
+        return {
+            'stateVersion': state['v'],
+            'patches': [patches[version] for version in sorted(patches)],
+        }
+
+    def ack(self, user_id, version):
+        """La Mini App ha applicato lo stato fino a `version`: scarta i campi confermati"""
+        state = self._states.get(user_id)
+        if not state or version <= state['acked']:
+            return False
+        state['acked'] = min(version, state['v'])
+        state['fields'] = {
+            key: entry for key, entry in state['fields'].items() if entry[0] > state['acked']
+        }
+        return True
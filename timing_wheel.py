@@ -0,0 +1,199 @@
+"""
+Timing wheel per i promemoria personalizzati di Winter Grind
+
+Ogni utente sceglie fuso orario e orari dei promemoria. Invece di creare un job
+APScheduler per utente, gli utenti vengono messi in "bucket" da un minuto
+(indicizzati in UTC) e un unico job `tick` ogni minuto svuota il bucket corrente:
+- costo di un tick: O(utenti nel bucket)
+- un solo job, qualunque sia il numero di utenti
+- i promemoria si distribuiscono nella giornata in base a orari e fusi scelti
+
+Ruote:
+- morning / evening: 1440 bucket (un giorno)
+- weekly: 10080 bucket (una settimana, domenica 21:00 locale)
+"""
+
+import re
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+DEFAULT_MORNING_TIME = '08:00'
+DEFAULT_EVENING_TIME = '20:00'
+WEEKLY_REPORT_DAY = 6           # domenica (datetime.weekday())
+WEEKLY_REPORT_TIME = '21:00'
+MAX_CATCH_UP_MINUTES = 15       # minuti recuperati se un tick arriva in ritardo
+
+_TIME_RE = re.compile(r'^([01]?\d|2[0-3])[:.]([0-5]\d)$')
+
+
+def parse_time(value):
+    """'7:30' / '07.30' -> '07:30'; ValueError se non valido"""
+    match = _TIME_RE.match(value.strip())
+    if not match:
+        raise ValueError(f"Orario non valido: {value}")
+    return f"{int(match.group(1)):02d}:{match.group(2)}"
+
+
+def get_timezone(name):
+    """Ritorna la ZoneInfo per un nome IANA (es: Europe/Rome); ValueError se sconosciuto"""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"Fuso orario sconosciuto: {name}") from e
+
+
+def utc_slot(local_time, tz, now, weekday=None):
+    """
+    Bucket UTC in cui cade `local_time` ('HH:MM') nel fuso `tz`, con l'offset
+    valido a `now`. Con `weekday` il bucket è nella ruota settimanale.
+    """
+    hour, minute = map(int, local_time.split(':'))
+    local = now.astimezone(tz).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if weekday is not None:
+        local += timedelta(days=(weekday - local.weekday()) % 7)
+    utc = local.astimezone(timezone.utc)
+    slot = utc.hour * 60 + utc.minute
+    if weekday is not None:
+        slot += utc.weekday() * MINUTES_PER_DAY
+    return slot
+
+
+class TimingWheel:
+    """Bucket da un minuto: slot -> insieme di user_id (ogni utente in un solo slot)"""
+
+    def __init__(self, slots):
+        self.slots = slots
+        self._buckets = {}
+        self._slot_of = {}
+
+    def add(self, user_id, slot):
+        if self._slot_of.get(user_id) == slot:
+            return
+        self.remove(user_id)
+        self._buckets.setdefault(slot, set()).add(user_id)
+        self._slot_of[user_id] = slot
+
+    def remove(self, user_id):
+        slot = self._slot_of.pop(user_id, None)
+        if slot is None:
+            return
+        bucket = self._buckets[slot]
+        bucket.discard(user_id)
+        if not bucket:
+            del self._buckets[slot]
+
+    def bucket(self, slot):
+        return self._buckets.get(slot % self.slots, ())
+
+    def __len__(self):
+        return len(self._slot_of)
+
+
+class ReminderSchedule:
+    """Ruote dei promemoria (mattina, sera, report settimanale) con fuso per utente"""
+
+    def __init__(self, user_settings, default_timezone):
+        self._settings = user_settings
+        self.default_timezone = get_timezone(default_timezone)
+        self.wheels = {
+            'morning': TimingWheel(MINUTES_PER_DAY),
+            'evening': TimingWheel(MINUTES_PER_DAY),
+            'weekly': TimingWheel(MINUTES_PER_WEEK),
+        }
+        self._tz_members = {}     # nome fuso -> user_id
+        self._tz_of = {}          # user_id -> nome fuso
+        self._tz_offsets = {}     # nome fuso -> offset UTC usato per gli slot
+        self._last_minute = None
+
+    def timezone_of(self, user_id):
+        name = self._tz_of.get(user_id)
+        return get_timezone(name) if name else self.default_timezone
+
+    def _timezone_name(self, settings):
+        return settings.get('timezone') or self.default_timezone.key
+
+    def update(self, user_id, settings, now=None):
+        """(Ri)posiziona un utente nelle ruote in base a fuso e orari scelti"""
+        now = now or datetime.now(timezone.utc)
+        tz_name = self._timezone_name(settings)
+        tz = get_timezone(tz_name)
+
+        old_tz = self._tz_of.get(user_id)
+        if old_tz != tz_name:
+            if old_tz is not None:
+                self._tz_members[old_tz].discard(user_id)
+            self._tz_members.setdefault(tz_name, set()).add(user_id)
+            self._tz_of[user_id] = tz_name
+            self._tz_offsets.setdefault(tz_name, now.astimezone(tz).utcoffset())
+
+        morning = settings.get('morning_time', DEFAULT_MORNING_TIME)
+        evening = settings.get('evening_time', DEFAULT_EVENING_TIME)
+        self.wheels['morning'].add(user_id, utc_slot(morning, tz, now))
+        self.wheels['evening'].add(user_id, utc_slot(evening, tz, now))
+        self.wheels['weekly'].add(user_id, utc_slot(WEEKLY_REPORT_TIME, tz, now, weekday=WEEKLY_REPORT_DAY))
+
+    def remove(self, user_id):
+        for wheel in self.wheels.values():
+            wheel.remove(user_id)
+        tz_name = self._tz_of.pop(user_id, None)
+        if tz_name is not None:
+            self._tz_members[tz_name].discard(user_id)
+
+    def rebuild(self, now=None):
+        """Posiziona tutti gli utenti (solo all'avvio)"""
+        now = now or datetime.now(timezone.utc)
+        for user_id, settings in self._settings.items():
+            self.update(user_id, settings, now)
+
+    def _check_offsets(self, now):
+        """Ricalcola gli slot solo per i fusi il cui offset è cambiato (ora legale)"""
+        for tz_name, members in self._tz_members.items():
+            offset = now.astimezone(get_timezone(tz_name)).utcoffset()
+            if self._tz_offsets.get(tz_name) == offset:
+                continue
+            self._tz_offsets[tz_name] = offset
+            for user_id in list(members):
+                self.update(user_id, self._settings.get(user_id, {}), now)
+
+    @property
+    def last_minute(self):
+        """Ultimo minuto (timestamp // 60) già elaborato da `due`"""
+        return self._last_minute
+
+    def resume(self, minute):
+        """Riparte dall'avanzamento di un'altra istanza (nuovo leader dei promemoria)"""
+        if minute is not None:
+            self._last_minute = minute
+
+    def upcoming(self, reminder_type, minute):
+        """Utenti nel bucket del minuto assoluto `minute` (timestamp // 60), senza consumarlo"""
+        moment = datetime.fromtimestamp(minute * 60, timezone.utc)
+        slot = moment.hour * 60 + moment.minute
+        if reminder_type == 'weekly':
+            slot += moment.weekday() * MINUTES_PER_DAY
+        return list(self.wheels[reminder_type].bucket(slot))
+
+    def due(self, now):
+        """
+        Utenti da notificare per ogni tipo di promemoria fino al minuto `now` (UTC).
+
+        Se il tick precedente è stato saltato recupera al massimo
+        MAX_CATCH_UP_MINUTES minuti.
+        """
+        self._check_offsets(now)
+        minute = int(now.timestamp() // 60)
+        start = minute if self._last_minute is None else max(self._last_minute + 1, minute - MAX_CATCH_UP_MINUTES + 1)
+        self._last_minute = minute
+
+        due = {reminder_type: [] for reminder_type in self.wheels}
+        for absolute in range(start, minute + 1):
+            moment = datetime.fromtimestamp(absolute * 60, timezone.utc)
+            minute_of_day = moment.hour * 60 + moment.minute
+            minute_of_week = moment.weekday() * MINUTES_PER_DAY + minute_of_day
+            due['morning'].extend(self.wheels['morning'].bucket(minute_of_day))
+            due['evening'].extend(self.wheels['evening'].bucket(minute_of_day))
+            due['weekly'].extend(self.wheels['weekly'].bucket(minute_of_week))
+        return due
@@ -0,0 +1,520 @@
+"""
+Export e import in blocco di profili e impostazioni (backup, migrazioni, analisi)
+
+Lavora direttamente sul file SQLite dello storage, senza caricare le cache del
+bot: ogni passaggio è un generatore e i dati scorrono a blocchi di
+`chunk_size` utenti, quindi la memoria resta costante qualunque sia il numero
+di utenti.
+
+Export:  records (profiles e settings, in ordine di user_id, uniti con un
+         merge join) -> una riga per utente -> JSONL o Parquet
+Import:  JSONL o Parquet -> validazione -> ricalcolo di bmr, tdee e macros
+         (vettoriale, un blocco alla volta) -> upsert nello storage, una
+         transazione per blocco
+
+Formato JSONL (anche compresso: `.jsonl.gz`), una riga per utente:
+    {"user_id": 123, "profile": {...} | null, "settings": {...} | null}
+L'export copia il JSON già salvato senza decodificarlo. L'import aggiorna solo
+gli utenti presenti nel file; le righe non valide vengono scartate e contate.
+Per le righe nel formato dell'export l'import tiene il testo JSON originale e
+lo riscrive così com'è se validazione e ricalcolo non cambiano nulla.
+
+Formato Parquet (richiede pyarrow): i campi del profilo e le macro in colonne,
+gli altri campi del profilo in `extra` (JSON, null = utente senza profilo) e le
+impostazioni in `settings` (JSON).
+
+Le scritture non passano dal change log riga per riga: a import concluso un
+solo marcatore per namespace chiede alle istanze del bot in esecuzione di
+ricaricare il namespace intero (a blocchi, senza bloccare il loop).
+"""
+
+import gzip
+import heapq
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime
+from functools import lru_cache
+from itertools import groupby, islice
+from operator import itemgetter
+
+from nutrition import ACTIVITY_MULTIPLIERS, GOAL_SPLITS, recalculate_profiles
+from storage import connect, mark_reload, upsert_rows
+from timing_wheel import get_timezone, parse_time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 10_000
+IMPORT_INSTANCE = 'import'    # istanza registrata nel change log
+MAX_LOGGED_ERRORS = 20        # righe scartate riportate nel log (le altre solo contate)
+
+FORMATS = ('jsonl', 'parquet')
+
+_FLAGS = ('notifications', 'reminder_morning', 'reminder_evening', 'reminder_weekly')
+_MACROS = ('calories', 'protein', 'carbs', 'fats')
+
+_EXPORT_PREFIX = '{"user_id": '
+_decoder = json.JSONDecoder()
+
+# Orari e fusi si ripetono tra milioni di utenti: normalizzati una volta sola
+_normal_time = lru_cache(maxsize=4096)(parse_time)
+
+
+@lru_cache(maxsize=1024)
+def _timezone_key(name):
+    return get_timezone(name).key
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Il formato Parquet richiede pyarrow: pip install pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+
+def detect_format(path):
+    """'parquet' per i file .parquet, altrimenti 'jsonl'"""
+    return 'parquet' if path.endswith('.parquet') else 'jsonl'
+
+
+class TransferStats:
+    """Contatori di un export/import"""
+
+    def __init__(self):
+        self.rows = 0
+        self.profiles = 0
+        self.settings = 0
+        self.rejected = 0
+        self.recomputed = 0     # profili con bmr/tdee/macros diversi da quelli nel file
+        self.elapsed = 0.0
+        self._started = time.perf_counter()
+
+    def reject(self, number, reason):
+        self.rejected += 1
+        if self.rejected <= MAX_LOGGED_ERRORS:
+            logger.warning(f"⚠️ Riga {number} scartata: {reason}")
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self._started
+        return self
+
+    @property
+    def rate(self):
+        """Righe al secondo"""
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+# ============ VALIDAZIONE ============
+
+def _positive(profile, key):
+    value = profile.get(key)
+    if type(value) not in (int, float) or not math.isfinite(value) or value <= 0:
+        raise ValueError(f"{key} non valido: {value!r}")
+    return float(value)   # come lo salva /setup
+
+
+def clean_profile(profile):
+    """Copia del profilo con i tipi di /setup; ValueError se non è importabile"""
+    if not isinstance(profile, dict):
+        raise ValueError("profile non è un oggetto")
+    profile = dict(profile)
+    name = profile.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError(f"nome non valido: {name!r}")
+    profile['weight'] = _positive(profile, 'weight')
+    profile['height'] = _positive(profile, 'height')
+    age = profile.get('age')
+    if type(age) is float and age.is_integer():
+        age = int(age)
+    if type(age) is not int or age <= 0:
+        raise ValueError(f"età non valida: {age!r}")
+    profile['age'] = age
+    if profile.get('goal') not in GOAL_SPLITS:
+        raise ValueError(f"obiettivo sconosciuto: {profile.get('goal')!r}")
+    if profile.get('activity') not in ACTIVITY_MULTIPLIERS:
+        raise ValueError(f"livello di attività sconosciuto: {profile.get('activity')!r}")
+    if 'gender' in profile and not isinstance(profile['gender'], str):
+        raise ValueError(f"gender non valido: {profile['gender']!r}")
+    if 'created_at' in profile:
+        try:
+            datetime.fromisoformat(profile['created_at'])
+        except (TypeError, ValueError):
+            raise ValueError(f"created_at non valido: {profile['created_at']!r}") from None
+    return profile
+
+
+def clean_settings(settings):
+    """Copia delle impostazioni con orari e fuso normalizzati; ValueError se non valide"""
+    if not isinstance(settings, dict):
+        raise ValueError("settings non è un oggetto")
+    settings = dict(settings)
+    for key in _FLAGS:
+        if key in settings and type(settings[key]) is not bool:
+            raise ValueError(f"{key} non valido: {settings[key]!r}")
+    for key in ('morning_time', 'evening_time'):
+        if key in settings:
+            if not isinstance(settings[key], str):
+                raise ValueError(f"{key} non valido: {settings[key]!r}")
+            settings[key] = _normal_time(settings[key])
+    if settings.get('timezone') is not None:
+        if not isinstance(settings['timezone'], str):
+            raise ValueError(f"timezone non valido: {settings['timezone']!r}")
+        settings['timezone'] = _timezone_key(settings['timezone'])
+    return settings
+
+
+def _well_formed(profiles):
+    """True se tutti i profili di un blocco sono validi e già con i tipi di /setup
+
+    Controlli per colonna (map/set in C) senza copiare i profili; se anche un
+    solo profilo non torna il blocco passa da clean_profile riga per riga.
+    """
+    if set(map(type, profiles)) != {dict}:
+        return False
+    names = [profile.get('name') for profile in profiles]
+    if set(map(type, names)) != {str} or not all(map(str.strip, names)):
+        return False
+    for key in ('weight', 'height'):
+        column = [profile.get(key) for profile in profiles]
+        if set(map(type, column)) != {float} or not all(map(math.isfinite, column)) or min(column) <= 0:
+            return False
+    ages = [profile.get('age') for profile in profiles]
+    if set(map(type, ages)) != {int} or min(ages) <= 0:
+        return False
+    if not {profile.get('goal') for profile in profiles} <= GOAL_SPLITS.keys():
+        return False
+    if not {profile.get('activity') for profile in profiles} <= ACTIVITY_MULTIPLIERS.keys():
+        return False
+    if not {type(profile['gender']) for profile in profiles if 'gender' in profile} <= {str}:
+        return False
+    created = [profile['created_at'] for profile in profiles if 'created_at' in profile]
+    if not set(map(type, created)) <= {str}:
+        return False
+    try:
+        all(map(datetime.fromisoformat, created))
+    except ValueError:
+        return False
+    return True
+
+
+def _settings_well_formed(settings):
+    """True se tutte le impostazioni di un blocco sono valide e già normalizzate
+
+    Orari e fusi si controllano una volta per valore distinto.
+    """
+    if set(map(type, settings)) != {dict}:
+        return False
+    for key in _FLAGS:
+        if not {type(values[key]) for values in settings if key in values} <= {bool}:
+            return False
+    for key, normalize in (('morning_time', _normal_time), ('evening_time', _normal_time),
+                           ('timezone', _timezone_key)):
+        distinct = {values[key] for values in settings if key in values}
+        if key == 'timezone':
+            distinct.discard(None)   # fuso non impostato
+        if not set(map(type, distinct)) <= {str}:
+            return False
+        try:
+            if any(normalize(value) != value for value in distinct):
+                return False
+        except ValueError:
+            return False
+    return True
+
+
+def _validated(rows, stats):
+    """(numero di riga, riga, testi JSON | None) -> [numero, user_id, profilo, impostazioni, testo profilo, testo impostazioni]
+
+    Profili e impostazioni si validano dopo, a blocchi (_cleaned). I testi
+    originali restano solo se nulla viene normalizzato.
+    """
+    for number, row, texts in rows:
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("la riga non è un oggetto")
+            user_id = row.get('user_id')
+            if type(user_id) is not int:
+                raise ValueError(f"user_id non valido: {user_id!r}")
+            profile = row.get('profile')
+            settings = row.get('settings')
+            if profile is None and settings is None:
+                raise ValueError("né profile né settings")
+            yield [number, user_id, profile, settings, *(texts or (None, None))]
+        except ValueError as e:
+            stats.reject(number, e)
+
+
+# ============ PIPELINE ============
+
+def _chunked(items, size):
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _cleaned(chunks, stats):
+    """Valida profili e impostazioni di ogni blocco: per colonna, riga per riga solo se qualcosa non torna"""
+    for chunk in chunks:
+        profiles = [record[2] for record in chunk if record[2] is not None]
+        settings = [record[3] for record in chunk if record[3] is not None]
+        if (not profiles or _well_formed(profiles)) and (not settings or _settings_well_formed(settings)):
+            yield chunk
+            continue
+        valid = []
+        for record in chunk:
+            profile, values = record[2], record[3]
+            try:
+                if profile is not None:
+                    record[2] = clean_profile(profile)
+                    # clean_profile normalizza solo i tipi di peso, altezza ed età
+                    if type(profile['weight']) is not float or type(profile['height']) is not float \
+                            or type(profile['age']) is not int:
+                        record[4] = None
+                if values is not None:
+                    record[3] = clean_settings(values)
+                    if record[3] != values:
+                        record[5] = None
+            except ValueError as e:
+                stats.reject(record[0], e)
+                continue
+            valid.append(record)
+        yield valid
+
+
+def _recomputed(chunks, stats):
+    """Ricalcola bmr, tdee e macros dei profili di ogni blocco (in place)"""
+    for chunk in chunks:
+        profiles = {index: record[2] for index, record in enumerate(chunk) if record[2] is not None}
+        if profiles:
+            changed = recalculate_profiles(profiles)
+            stats.recomputed += len(changed)
+            for index in changed:
+                chunk[index][4] = None   # testo originale superato dal ricalcolo
+        yield chunk
+
+
+def _open_text(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def _scan(conn, namespace, tag, chunk_size):
+    cursor = conn.execute(
+        "SELECT key, data FROM records WHERE namespace = ? ORDER BY key", (namespace,)
+    )
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        for key, data in rows:
+            yield key, tag, data
+
+
+def _joined(conn, chunk_size):
+    """(user_id, profilo JSON | None, impostazioni JSON | None) in ordine di user_id"""
+    merged = heapq.merge(_scan(conn, 'profiles', 0, chunk_size), _scan(conn, 'settings', 1, chunk_size))
+    for user_id, group in groupby(merged, key=itemgetter(0)):
+        record = [None, None]
+        for _, tag, data in group:
+            record[tag] = data
+        yield user_id, record[0], record[1]
+
+
+# ============ JSONL ============
+
+def _write_jsonl(path, records, chunk_size, stats):
+    with _open_text(path, 'w') as file:
+        for chunk in _chunked(records, chunk_size):
+            file.writelines(
+                f'{{"user_id": {user_id}, "profile": {profile or "null"}, "settings": {settings or "null"}}}\n'
+                for user_id, profile, settings in chunk
+            )
+            stats.rows += len(chunk)
+            stats.profiles += sum(profile is not None for _, profile, _ in chunk)
+            stats.settings += sum(settings is not None for _, _, settings in chunk)
+
+
+def _split_export_line(line):
+    """Riga scritta da _write_jsonl -> (riga, (testo profilo, testo impostazioni)); None se il formato è diverso"""
+    if not line.startswith(_EXPORT_PREFIX):
+        return None
+    middle = line.find(', "profile": ', len(_EXPORT_PREFIX))
+    user_id = line[len(_EXPORT_PREFIX):middle]
+    if middle < 0 or not user_id.isascii() or not user_id.lstrip('-').isdigit():
+        return None
+    try:
+        profile_start = middle + len(', "profile": ')
+        profile, profile_end = _decoder.raw_decode(line, profile_start)
+        if not line.startswith(', "settings": ', profile_end):
+            return None
+        settings_start = profile_end + len(', "settings": ')
+        settings, settings_end = _decoder.raw_decode(line, settings_start)
+    except ValueError:
+        return None
+    if line[settings_end:].strip() != '}':
+        return None
+    row = {'user_id': int(user_id), 'profile': profile, 'settings': settings}
+    return row, (line[profile_start:profile_end], line[settings_start:settings_end])
+
+
+def _read_jsonl(path, stats):
+    with _open_text(path, 'r') as file:
+        for number, line in enumerate(file, 1):
+            split = _split_export_line(line)
+            if split is not None:
+                yield number, *split
+                continue
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                stats.reject(number, f"JSON non valido: {e}")
+                continue
+            yield number, row, None
+
+
+# ============ PARQUET ============
+
+# Campi del profilo in colonna: (nome, tipo Arrow, tipi Python accettati)
+_PROFILE_COLUMNS = (
+    ('name', 'string', (str,)),
+    ('weight', 'float64', (float, int)),
+    ('height', 'float64', (float, int)),
+    ('age', 'int64', (int,)),
+    ('goal', 'string', (str,)),
+    ('activity', 'string', (str,)),
+    ('bmr', 'float64', (float, int)),
+    ('tdee', 'float64', (float, int)),
+    ('created_at', 'string', (str,)),
+)
+
+
+def _parquet_schema():
+    pa, _ = _pyarrow()
+    fields = [pa.field('user_id', pa.int64(), nullable=False)]
+    fields += [pa.field(name, getattr(pa, arrow_type)()) for name, arrow_type, _ in _PROFILE_COLUMNS]
+    fields += [pa.field(name, pa.int64()) for name in _MACROS]
+    fields += [pa.field('extra', pa.string()), pa.field('settings', pa.string())]
+    return pa.schema(fields)
+
+
+def _fits(value, types):
+    return type(value) in types and (type(value) is not int or -2**63 <= value < 2**63)
+
+
+def _flatten(user_id, profile, settings):
+    """Riga Parquet: campi noti in colonna, il resto del profilo in `extra`"""
+    row = {'user_id': user_id, 'settings': settings}
+    if profile is None:
+        row['extra'] = None
+        return row
+    profile = json.loads(profile)
+    for name, _, types in _PROFILE_COLUMNS:
+        if name in profile and _fits(profile[name], types):
+            row[name] = profile.pop(name)
+    macros = profile.get('macros')
+    if isinstance(macros, dict) and list(macros) == list(_MACROS) \
+            and all(_fits(amount, (int,)) for amount in macros.values()):
+        row.update(profile.pop('macros'))
+    row['extra'] = json.dumps(profile)
+    return row
+
+
+def _write_parquet(path, records, chunk_size, stats):
+    pa, pq = _pyarrow()
+    schema = _parquet_schema()
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in _chunked(records, chunk_size):
+            rows = [_flatten(*record) for record in chunk]
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            stats.rows += len(chunk)
+            stats.profiles += sum(profile is not None for _, profile, _ in chunk)
+            stats.settings += sum(settings is not None for _, _, settings in chunk)
+
+
+def _read_parquet(path, chunk_size, stats):
+    _, pq = _pyarrow()
+    number = 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        for row in batch.to_pylist():
+            number += 1
+            try:
+                profile = None
+                if row['extra'] is not None:
+                    profile = {name: row[name] for name, _, _ in _PROFILE_COLUMNS if row[name] is not None}
+                    if all(row[name] is not None for name in _MACROS):
+                        profile['macros'] = {name: row[name] for name in _MACROS}
+                    profile.update(json.loads(row['extra']))
+                settings = json.loads(row['settings']) if row['settings'] is not None else None
+            except ValueError as e:
+                stats.reject(number, f"JSON non valido: {e}")
+                continue
+            yield number, {'user_id': row['user_id'], 'profile': profile, 'settings': settings}, None
+
+
+# ============ API ============
+
+def export_records(db_path, path, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Esporta profili e impostazioni dallo storage SQLite in `path`; ritorna le statistiche"""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Database non trovato: {db_path}")
+    fmt = fmt or detect_format(path)
+    write = _write_parquet if fmt == 'parquet' else _write_jsonl
+    stats = TransferStats()
+    conn = connect(db_path)
+    partial = f"{path}.tmp"
+    try:
+        # Un'unica transazione di lettura: istantanea coerente anche con il bot attivo
+        conn.execute("BEGIN")
+        write(partial, _joined(conn, chunk_size), chunk_size, stats)
+        conn.rollback()
+        os.replace(partial, path)
+    finally:
+        conn.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+    return stats.finish()
+
+
+def import_records(db_path, path, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Importa profili e impostazioni da `path` nello storage SQLite; ritorna le statistiche"""
+    fmt = fmt or detect_format(path)
+    stats = TransferStats()
+    rows = _read_parquet(path, chunk_size, stats) if fmt == 'parquet' else _read_jsonl(path, stats)
+    chunks = _recomputed(_cleaned(_chunked(_validated(rows, stats), chunk_size), stats), stats)
+    conn = connect(db_path)
+    written = set()
+    try:
+        for chunk in chunks:
+            now = time.time()
+            profiles = [
+                ('profiles', user_id, profile_text or json.dumps(profile), now)
+                for _, user_id, profile, _, profile_text, _ in chunk if profile is not None
+            ]
+            settings = [
+                ('settings', user_id, settings_text or json.dumps(values), now)
+                for _, user_id, _, values, _, settings_text in chunk if values is not None
+            ]
+            with conn:
+                upsert_rows(conn, profiles)
+                upsert_rows(conn, settings)
+            written.update(namespace for namespace, rows in (('profiles', profiles), ('settings', settings)) if rows)
+            stats.rows += len(chunk)
+            stats.profiles += len(profiles)
+            stats.settings += len(settings)
+    finally:
+        # Anche dopo un errore: i blocchi già scritti vanno ricaricati dalle istanze attive
+        if written:
+            with conn:
+                mark_reload(conn, sorted(written), IMPORT_INSTANCE, time.time())
+        conn.close()
+    return stats.finish()
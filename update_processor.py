@@ -0,0 +1,74 @@
+"""
+Elaborazione concorrente degli update di Telegram
+
+Update di utenti diversi vengono gestiti in parallelo, quelli dello stesso
+utente restano in ordine di arrivo (il ConversationHandler di /setup e il flag
+`waiting_for_weight` dipendono dall'ordine dei messaggi).
+
+L'ordine per utente è una catena fuori dagli slot di `max_concurrent_updates`:
+solo l'update in testa alla catena di un utente occupa uno slot, quindi una
+raffica di un solo utente non blocca gli altri. Tutto passa dall'hook
+documentato `do_process_update`: il semaforo di `process_update` (finale in
+PTB) è senza limite e gli slot veri sono un semaforo nostro, preso dopo
+l'attesa del turno.
+"""
+
+import asyncio
+import sys
+
+from telegram.ext import BaseUpdateProcessor
+
+_UNBOUNDED = sys.maxsize   # limite del semaforo della classe base
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Concorrenza tra utenti, ordine FIFO per il singolo utente"""
+
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        self._limit = _UNBOUNDED
+        super().__init__(_UNBOUNDED)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._tails = {}  # user_id -> future dell'ultimo update in catena
+
+    @property
+    def max_concurrent_updates(self):
+        return self._limit
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        previous = self._tails.get(user.id)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[user.id] = done
+        try:
+            if previous is not None:
+                # Attesa del turno senza occupare uno slot
+                await asyncio.shield(previous)
+            async with self._slots:
+                await coroutine
+        finally:
+            def release(_=None):
+                if not done.done():
+                    done.set_result(None)
+                if self._tails.get(user.id) is done:
+                    del self._tails[user.id]
+
+            if previous is None or previous.done():
+                release()
+            else:
+                # Cancellato in attesa: il turno passa dopo l'update precedente
+                previous.add_done_callback(release)
+            coroutine.close()  # no-op se già eseguita
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
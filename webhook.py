@@ -0,0 +1,74 @@
+"""
+Modalità webhook di Winter Grind
+
+Alternativa a `run_polling`: Telegram invia gli update via HTTPS al server
+embedded (aiohttp). Vantaggi:
+- niente long polling, quindi niente round-trip extra per ogni interazione
+- niente `Conflict` tra istanze: durante un deploy la nuova istanza
+  reimposta semplicemente il webhook
+- ogni richiesta è verificata con il secret token di Telegram
+"""
+
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def webhook_handler(application, secret):
+    """Handler aiohttp: verifica il secret e accoda l'update all'Application"""
+
+    async def handle(request):
+        received = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(received.encode(), secret.encode()):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        # Risponde subito a Telegram: l'elaborazione avviene nell'update processor
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        return web.Response()
+
+    return handle
+
+
+async def run_webhook(application, server, url, secret, path, allowed_updates):
+    """Avvia Application + server HTTP e imposta il webhook; termina con SIGINT/SIGTERM"""
+    server.add_route('POST', path, webhook_handler(application, secret))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: resta KeyboardInterrupt
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            url=url,
+            secret_token=secret,
+            allowed_updates=allowed_updates,
+        )
+        logger.info(f"🪝 Webhook impostato su {url}")
+        try:
+            await stop.wait()
+        finally:
+            logger.info("Arresto webhook in corso...")
+            await server.stop()
+            await application.stop()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
@@ -0,0 +1,37 @@
+"""
+Server HTTP embedded (aiohttp) di Winter Grind
+
+Un solo server per processo: ogni funzionalità registra le proprie route
+(es. il webhook di Telegram) prima dell'avvio con `add_route`.
+"""
+
+import logging
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class WebServer:
+    """Server aiohttp con route registrate dalle varie funzionalità del bot"""
+
+    def __init__(self, host='0.0.0.0', port=8080):
+        self.host = host
+        self.port = port
+        self.app = web.Application()
+        self._runner = None
+
+    def add_route(self, method, path, handler):
+        self.app.router.add_route(method, path, handler)
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"🌐 Server HTTP in ascolto su {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
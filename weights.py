@@ -0,0 +1,205 @@
+"""
+Storico del peso lato server
+
+Ogni utente ha una serie compatta di pesate, una per giorno:
+- `days`:   array('H') di giorni dalla prima pesata (2 byte per pesata)
+- `values`: array('f') dei pesi in kg (4 byte per pesata)
+
+Le statistiche di tendenza sono mantenute in modo incrementale: due finestre
+scorrevoli (ultimi 7 giorni e 7 giorni precedenti) con indice di inizio e
+somma. Una pesata nuova sposta in avanti gli indici (O(1) ammortizzato), e
+media mobile, variazione settimanale e variazione totale si leggono in O(1)
+senza riscorrere lo storico. Solo una pesata inserita nel passato (prima
+dell'ultima) ricostruisce le finestre in O(n).
+
+Per i grafici `downsample` riduce la serie a un numero massimo di punti
+(media per intervallo di giorni). La serie è persistita dallo storage come
+JSON con gli array codificati in base64 (`to_dict` / `from_dict`).
+"""
+
+import base64
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import date
+
+WINDOW_DAYS = 7       # ampiezza della media mobile
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+
+def _encode(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def _decode(typecode, text):
+    values = array(typecode)
+    values.frombytes(base64.b64decode(text))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class WeightSeries:
+    """Pesate di un utente (una per giorno) con media mobile e delta settimanale incrementali"""
+
+    __slots__ = ('base', 'days', 'values', '_cur', '_cur_sum', '_prev', '_prev_sum')
+
+    def __init__(self):
+        self.base = None          # ordinale (date.toordinal) della prima pesata
+        self.days = array('H')
+        self.values = array('f')
+        # Finestra corrente: indici [_cur, n); precedente: [_prev, _cur)
+        self._cur = 0
+        self._cur_sum = 0.0
+        self._prev = 0
+        self._prev_sum = 0.0
+
+    def __len__(self):
+        return len(self.values)
+
+    # ---- inserimento ----
+
+    def add(self, day, weight):
+        """Registra la pesata del giorno `day` (date); una seconda pesata nello stesso giorno la sostituisce"""
+        ordinal = day.toordinal()
+        if self.base is None:
+            self.base = ordinal
+        if ordinal < self.base:
+            self._rebase(ordinal)
+        offset = ordinal - self.base
+        days, values = self.days, self.values
+
+        if days and offset == days[-1]:
+            # Stesso giorno dell'ultima pesata: l'ultima è sempre nella finestra corrente
+            previous = values[-1]
+            values[-1] = weight
+            self._cur_sum += values[-1] - previous
+        elif not days or offset > days[-1]:
+            days.append(offset)
+            values.append(weight)
+            self._cur_sum += values[-1]
+            self._advance()
+        else:
+            # Pesata nel passato: raro, si ricostruiscono le finestre
+            index = bisect_left(days, offset)
+            if days[index] == offset:
+                values[index] = weight
+            else:
+                days.insert(index, offset)
+                values.insert(index, weight)
+            self._rebuild()
+
+    def _advance(self):
+        """Sposta le finestre fino all'ultima pesata: ogni elemento entra ed esce una volta sola"""
+        days, values = self.days, self.values
+        last = days[-1]
+        while days[self._cur] <= last - WINDOW_DAYS:
+            value = values[self._cur]
+            self._cur_sum -= value
+            self._prev_sum += value
+            self._cur += 1
+        while self._prev < self._cur and days[self._prev] <= last - 2 * WINDOW_DAYS:
+            self._prev_sum -= values[self._prev]
+            self._prev += 1
+
+    def _rebuild(self):
+        self._cur = self._prev = 0
+        self._cur_sum = self._prev_sum = 0.0
+        if not self.values:
+            return
+        self._cur_sum = sum(self.values)
+        self._advance()
+
+    def _rebase(self, ordinal):
+        shift = self.base - ordinal
+        self.days = array('H', (offset + shift for offset in self.days))
+        self.base = ordinal
+
+    # ---- statistiche (O(1)) ----
+
+    @property
+    def latest(self):
+        return float(self.values[-1]) if self.values else None
+
+    @property
+    def latest_day(self):
+        return date.fromordinal(self.base + self.days[-1]) if self.days else None
+
+    @property
+    def rolling_average(self):
+        """Media delle pesate negli ultimi 7 giorni (rispetto all'ultima pesata)"""
+        count = len(self.values) - self._cur
+        return self._cur_sum / count if count else None
+
+    @property
+    def previous_average(self):
+        """Media delle pesate nei 7 giorni precedenti"""
+        count = self._cur - self._prev
+        return self._prev_sum / count if count else None
+
+    @property
+    def weekly_delta(self):
+        """Variazione della media mobile rispetto alla settimana precedente (None senza dati)"""
+        previous = self.previous_average
+        if previous is None:
+            return None
+        return self.rolling_average - previous
+
+    @property
+    def total_change(self):
+        if not self.values:
+            return None
+        return float(self.values[-1] - self.values[0])
+
+    # ---- grafici ----
+
+    def downsample(self, max_points=30):
+        """Serie ridotta a `max_points` punti al massimo: [(data, media kg)] per intervalli di giorni uguali"""
+        if not self.values:
+            return []
+        days, values = self.days, self.values
+        if len(values) <= max_points:
+            return [(date.fromordinal(self.base + d), round(float(v), 2)) for d, v in zip(days, values)]
+        first = days[0]
+        width = -(-(days[-1] - first + 1) // max_points)   # divisione per eccesso
+        points = []
+        bucket, total, count, start = 0, 0.0, 0, first
+        for offset, value in zip(days, values):
+            index = (offset - first) // width
+            if index != bucket and count:
+                points.append((date.fromordinal(self.base + start), round(total / count, 2)))
+                total, count = 0.0, 0
+            if count == 0:
+                bucket, start = index, offset
+            total += value
+            count += 1
+        points.append((date.fromordinal(self.base + start), round(total / count, 2)))
+        return points
+
+    # ---- persistenza ----
+
+    def to_dict(self):
+        return {'base': self.base, 'days': _encode(self.days), 'values': _encode(self.values)}
+
+    @classmethod
+    def from_dict(cls, data):
+        series = cls()
+        series.base = data['base']
+        series.days = _decode('H', data['days'])
+        series.values = _decode('f', data['values'])
+        series._rebuild()
+        return series
+
+
+def sparkline(weights):
+    """Mini grafico testuale di una lista di pesi"""
+    if not weights:
+        return ''
+    low, high = min(weights), max(weights)
+    if high - low < 1e-9:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(weights)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return ''.join(SPARK_CHARS[round((weight - low) * scale)] for weight in weights)